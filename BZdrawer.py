@@ -10,7 +10,9 @@ Requirements:
 
 import numpy as np
 import matplotlib.pyplot as plt
-np.seterr(all='raise') #raise warning as errors
+
+import chunking
+import crystal
 
 
 class BZ:
@@ -33,6 +35,7 @@ class BZ:
             kvector: the k vector of the bulk BZ, with unit A^-1 and written in the Cartesian coordinates. eg: np.array([[1,0,0],[0,1,0],[0,0,1]]).
         '''
         self.kvector = kvector
+        self.reduced = crystal.selling_reduce(np.asarray(kvector,dtype=float)) #Selling-reduced basis of the same lattice
         self.kvectors = [] #The k-vectors of the bulk BZ
         self.hs_lines_f = [] #The high symmetry lines of the bulk BZ
         self.hs_points = []
@@ -44,11 +47,10 @@ class BZ:
     
     def __crossline(self,vector1:list,vector2:list):
         #Return the crossing line of two planes with normal vectors 1 and 2.
-        if(abs(np.dot(vector1,vector2))==np.sqrt(np.dot(vector1,vector1)*np.dot(vector2,vector2))):
-            return np.array([0,0,0,0,0,0,0,0]) #Two planes are parrellel
-        
         #Vector 1 and 2 are normal vectors of two planes: just k vector): So the planes are vector*(x,y,z)==1/2|vector|^2
         direct = np.cross(vector1,vector2) #The direction of the line
+        if(np.dot(direct,direct)<=1e-20*np.dot(vector1,vector1)*np.dot(vector2,vector2)):
+            return np.array([0,0,0,0,0,0,0,0]) #Two planes are parrellel
         
         #Then we need to figure out how to find a point on the line. 
         norm_direct = np.cross(vector1,direct) #direction of a line // to the plane 1 and perpendicular to the line
@@ -63,14 +65,17 @@ class BZ:
 
         flag1 = np.dot(kvector,linevector[6]*linevector[:3]+linevector[3:6])-0.5*np.dot(kvector,kvector)
         flag2 = np.dot(kvector,linevector[7]*linevector[:3]+linevector[3:6])-0.5*np.dot(kvector,kvector)
+        slope = np.dot(kvector,linevector[:3])
     
-    
+        if(abs(slope)<=1e-12*np.sqrt(np.dot(kvector,kvector)*np.dot(linevector[:3],linevector[:3]))):
+            #the line is parallel to the plane: it is either wholly outside or wholly inside
+            return 0 if min(flag1,flag2)>0.0001 else 1
         if(flag1>0.0001 and flag2>0.0001):
             return 0 #the line part is not in the first BZ, why return True doesn't work?
         elif(flag1>0.0001 and flag2<=0.0001):
-            linevector[6] = (0.5*np.dot(kvector,kvector)-np.dot(kvector,linevector[3:6]))/(np.dot(kvector,linevector[:3]))
+            linevector[6] = (0.5*np.dot(kvector,kvector)-np.dot(kvector,linevector[3:6]))/slope
         elif(flag1<=0.0001 and flag2>0.0001):
-            linevector[7] = (0.5*np.dot(kvector,kvector)-np.dot(kvector,linevector[3:6]))/(np.dot(kvector,linevector[:3]))
+            linevector[7] = (0.5*np.dot(kvector,kvector)-np.dot(kvector,linevector[3:6]))/slope
     
         return 1
     
@@ -84,16 +89,17 @@ class BZ:
             self.hs_lines_f: the high symmetry lines of the bulk BZ
             self.hs_points: the high symmetry points of the bulk BZ
 
+        Floating point errors raise inside this call only; the caller's numpy error state is restored afterwards.
 
         '''
+        with np.errstate(all='raise'): #raise warning as errors
+            self.__bulkBZ()
+
+    def __bulkBZ(self):
 
+        #The reduced basis has an obtuse superbase, so its 14 Voronoi vectors are the only possible faces
         kvectors = self.kvectors
-        for i in [-1,0,1]:
-            for j in [-1,0,1]:
-                for k in [-1,0,1]:
-                    if(i==0 and j==0 and k==0):
-                        continue
-                    kvectors.append(i*self.kvector[0]+j*self.kvector[1]+k*self.kvector[2])
+        kvectors.extend(self.neighbours()[0])
         hs_lines = [] #High symmetry lines
 
         for i in range(len(self.kvectors)-1):
@@ -104,12 +110,9 @@ class BZ:
                 flag = 0
                 for k in range(len(kvectors)):
                     if(k!=i and k!=j):
-                        try:
-                            if(not self.__cutrange(kvectors[k],hs_line)):
-                                flag=1
-                                break
-                        except:
-                            print(i,j,k,hs_line)
+                        if(not self.__cutrange(kvectors[k],hs_line)):
+                            flag=1
+                            break
                 if(flag==0 and (hs_line[6]!=0 or hs_line[7]!=0)):
                     hs_lines.append(hs_line)
         
@@ -144,6 +147,60 @@ class BZ:
                 self.hs_points.append(hs_line[7]*hs_line[:3]+hs_line[3:6])
         
                 
+    def neighbours(self):
+        '''
+        Return the 14 reciprocal lattice vectors whose bisecting planes bound the bulk BZ (the Voronoi vectors
+        of the Selling-reduced basis), as rows of an array, together with their integer coefficients in the basis self.kvector.
+        '''
+        N = crystal.voronoi_vectors(self.reduced)
+        index = np.rint(N@np.linalg.inv(np.asarray(self.kvector,dtype=float))).astype(int)
+        return N, index
+
+    def fold(self, Q, basis=None, budget=None):
+        '''
+        Reduce points into the first (bulk) BZ, Q = G + k, without a per-point loop.
+
+        Input:
+            Q: points, shape (...,3), Cartesian in A^-1, or components in the rows of basis when it is given
+               (e.g. r.l.u. with the conventional reciprocal lattice vectors as basis).
+            basis: optional basis of Q, rows written in the Cartesian coordinates of self.kvector.
+            budget: memory budget in bytes for the temporaries of each block of points, see chunking.
+
+        Returns:
+            k, G: the reduced wavevectors and the reciprocal lattice vectors, in the coordinates of Q.
+
+        Points are first rounded to the nearest lattice vector in the reduced basis, then moved across the
+        bisecting plane they violate most until they lie inside every plane; each move shortens k, so this ends
+        after a few passes over the points that are still outside.
+        '''
+        Q = np.asarray(Q,dtype=float)
+        shape = Q.shape
+        basis = None if basis is None else np.asarray(basis,dtype=float)
+        X = Q.reshape(-1,3) if basis is None else Q.reshape(-1,3)@basis
+        K = self.reduced
+        K_inv = np.linalg.inv(K)
+        N,_ = self.neighbours()
+        half = 0.5*np.sum(N**2,axis=1)
+        tol = 1e-9*half.max()
+
+        k = np.empty_like(X)
+        for rows in chunking.chunks(X.shape[0],8*4*len(N),budget):
+            k_block = X[rows]-np.rint(X[rows]@K_inv)@K
+            outside = np.arange(k_block.shape[0])
+            while outside.size:
+                excess = k_block[outside]@N.T-half
+                worst = np.argmax(excess,axis=1)
+                move = excess[np.arange(outside.size),worst]>tol
+                outside,worst = outside[move],worst[move]
+                k_block[outside] -= N[worst]
+            k[rows] = k_block
+        G = X-k
+        if basis is not None:
+            # back to components in basis
+            basis_inv = np.linalg.inv(basis)
+            k,G = k@basis_inv,G@basis_inv
+        return k.reshape(shape),G.reshape(shape)
+
     def __crossline_surface(self,kvector,kgamma):
 
         slope = np.cross(kvector-kgamma,self.direc_a)
@@ -153,12 +210,16 @@ class BZ:
 
         flag1 = np.dot(kvector-kgamma,linevector[6]*linevector[:3]+linevector[3:6])-0.5*np.dot(kvector-kgamma,kvector-kgamma)
         flag2 = np.dot(kvector-kgamma,linevector[7]*linevector[:3]+linevector[3:6])-0.5*np.dot(kvector-kgamma,kvector-kgamma)
+        slope = np.dot(kvector-kgamma,linevector[:3])
+        if(abs(slope)<=1e-12*np.sqrt(np.dot(kvector-kgamma,kvector-kgamma)*np.dot(linevector[:3],linevector[:3]))):
+            #the line is parallel to the plane: it is either wholly outside or wholly inside
+            return 0 if min(flag1,flag2)>0.0001 else 1
         if(flag1>0.0001 and flag2>0.0001):
             return 0 #the line part is not in the first BZ, 
         elif(flag1>0.0001 and flag2<=0.0001):
-            linevector[6] = (0.5*np.dot(kvector-kgamma,kvector-kgamma)-np.dot(kvector-kgamma,linevector[3:6]))/(np.dot(kvector-kgamma,linevector[:3]))
+            linevector[6] = (0.5*np.dot(kvector-kgamma,kvector-kgamma)-np.dot(kvector-kgamma,linevector[3:6]))/slope
         elif(flag1<=0.0001 and flag2>0.0001):
-            linevector[7] = (0.5*np.dot(kvector-kgamma,kvector-kgamma)-np.dot(kvector-kgamma,linevector[3:6]))/(np.dot(kvector-kgamma,linevector[:3]))
+            linevector[7] = (0.5*np.dot(kvector-kgamma,kvector-kgamma)-np.dot(kvector-kgamma,linevector[3:6]))/slope
 
         return 1
 
@@ -172,16 +233,22 @@ class BZ:
         Generated attributes:
             self.hs_lines_pro_f: the projected high symmetry lines on the surface BZ
             self.hs_pro_points: the projected high symmetry points on the surface BZ
+
+        Floating point errors raise inside this call only, as in bulkBZ.
         """
-        kvectors = self.kvectors
+        with np.errstate(all='raise'): #raise warning as errors
+            self.__surfaceBZ(dis, direc)
+
+    def __surfaceBZ(self, dis, direc):
         self.dis = dis
         self.direc = direc
         self.direc_a = np.dot(self.direc,self.kvector)/np.sqrt(np.dot(np.dot(self.direc,self.kvector),np.dot(self.direc,self.kvector)))
         #So the projected surface is np.dot(direc_a,(x,y,z))=dis
-        #projected bulk Gammas
+        #projected bulk Gammas of the +-1 shell of the reduced basis; the projected lattice needs more than the 14 bulk faces
+        shell = np.array([[i,j,k] for i in [-1,0,1] for j in [-1,0,1] for k in [-1,0,1] if (i,j,k)!=(0,0,0)])@self.reduced
         kvectors_pro = []
         kgamma_pro = dis*self.direc_a
-        for kv in self.kvectors:
+        for kv in shell:
             kv_pro = (dis-np.dot(kv,self.direc_a))*self.direc_a+kv
             if(np.dot(kgamma_pro-kv_pro,kgamma_pro-kv_pro)<0.0001):
                 continue
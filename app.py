@@ -1,5 +1,6 @@
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, send_file, Response, stream_with_context
 import sqlite3
+from result_store import ResultStore
 #import matplotlib.pyplot as plt
 #import pandas as pd
 import io
@@ -9,18 +10,48 @@ import lattice_utils as lu
 import numpy as np
 import planning as pla
 from math import pi, asin, sin, cos
-from plotting import get_theta_cut_plot_data
+from plotting import get_theta_cut_plot_data, get_coverage_plot_data, get_resolution_trace
+import coverage as cov
+import resolution as res
+import spurions
+import scans
+import kpath
+import indexing
+import profiling
 import plotly.graph_objects as go
 from BZdrawer import BZ
 
 
+SG_BRAVAIS_MAP = lu.SG_BRAVAIS_MAP
+# largest coverage grid per axis; the response holds n*n values
+MAX_COVERAGE_N = int(os.environ.get('QPC_MAX_COVERAGE_N', 1000))
+
 app = Flask(__name__)
+result_store = ResultStore()
+profiling.register(app)
+
+
+def compute_recip_cell(lattice, recip_lattice):
+    return {
+        'lattice_vectors': lu.basis_vectors(lattice),
+        'recip_lattice_vectors': lu.basis_vectors(recip_lattice),
+    }
+
+
+def compute_bz(kvector):
+    brillouin_zone = BZ(kvector)
+    brillouin_zone.bulkBZ()
+    return {
+        'hs_points': np.reshape(brillouin_zone.hs_points, (-1, 3)),
+        'hs_lines_f': np.reshape(brillouin_zone.hs_lines_f, (-1, 8)),
+    }
 
 @app.route('/')
 def index():
     return render_template('calculator.html')
 
 @app.route('/calculate', methods=['POST'])
+@profiling.profiled
 def calculate():
     data = request.json
     space_group = float(data['space_group'])
@@ -42,12 +73,10 @@ def calculate():
     lattice = lu.lattice(a, b, c, aa, bb, cc)
     recip_lattice = lu.recip_lattice(lattice)
 
-    def get_lattice_vectors_json(lattice):
-        basis = lu.basis_vectors(lattice)
-        return [vec.tolist() for vec in basis]
-    
-    lattice_vectors = get_lattice_vectors_json(lattice)
-    recip_lattice_vectors = get_lattice_vectors_json(recip_lattice)
+    recip_cell = result_store.get_or_compute('recip_cell', [a, b, c, aa, bb, cc],
+                                             lambda: compute_recip_cell(lattice, recip_lattice))
+    lattice_vectors = recip_cell['lattice_vectors'].tolist()
+    recip_lattice_vectors = recip_cell['recip_lattice_vectors'].tolist()
     
     print(f"recip_lattice_vectors: {recip_lattice_vectors}")
 
@@ -57,136 +86,24 @@ def calculate():
     #bcc_vectors = [[0, 1, 1], [1, 0, 1], [1, 1, 0]]
 
 
-    # Initialize everything to "P"
-    SG_BRAVAIS_MAP = {i: "P" for i in range(1, 231)}
-
-    # Overwrite with exceptions
-    overrides = {
-        5: "C", 8: "C", 9: "C", 12: "C", 15: "C", 20: "C", 21: "C",
-        22: "F",
-        23: "I", 24: "I",
-        35: "C", 36: "C", 37: "C",
-        38: "A", 39: "A", 40: "A", 41: "A",
-        42: "F", 43: "F",
-        44: "I", 45: "I", 46: "I",
-        63: "C", 64: "C", 65: "C", 66: "C", 67: "C", 68: "C",
-        69: "F", 70: "F",
-        71: "I", 72: "I", 73: "I", 74: "I",
-        79: "I", 80: "I",
-        82: "I",
-        87: "I", 88: "I",
-        97: "I", 98: "I",
-        107: "I", 108: "I", 109: "I", 110: "I",
-        119: "I", 120: "I", 121: "I", 122: "I",
-        139: "I", 140: "I", 141: "I", 142: "I",
-        146: "R",
-        148: "R",
-        155: "R",
-        160: "R", 161: "R",
-        166: "R", 167: "R",
-        196: "Fc",
-        197: "Ic",
-        199: "Ic",
-        202: "Fc", 203: "Fc",
-        204: "Ic",
-        206: "Ic",
-        209: "Fc", 210: "Fc",
-        211: "Ic",
-        214: "Ic",
-        216: "Fc",
-        217: "Ic",
-        219: "Fc",
-        220: "Ic",
-        225: "Fc", 226: "Fc", 227: "Fc", 228: "Fc",
-        229: "Ic", 230: "Ic"
-    }
-
-    # Apply overrides
-    SG_BRAVAIS_MAP.update(overrides)
 
     # Determine Bravais lattice type
     bravais_type = SG_BRAVAIS_MAP.get(space_group, "P")
 
-    # Default: use the reciprocal lattice basis directly
-    kvector = np.array(recip_lattice_vectors)
-
-    # Apply transformation for C-centered lattice
-    if bravais_type == "C":
-        # Transformation matrix from screenshot
-        T_C = np.array([
-            [0.5, -0.5, 0],
-            [0.5,  0.5, 0],
-            [0.0,  0.0, 1]
-        ])
-        kvector = (T_C @ kvector)
-        print(f"Applied C-centered transform, kvector = {kvector}")
-    elif bravais_type == "A":
-        # Transformation matrix for A-centered lattice
-        T_A = np.array([
-            [0.5, -0.5, 0],
-            [0.5, 0.5, 0],
-            [0, 0, 1]
-        ])
-        # Transform the basis
-        kvector = (T_A @ kvector)
-        print(f"Applied A-centered transform, kvector = {kvector}")
-    elif bravais_type == "F":
-        # Transformation matrix for F-centered lattice
-        T_F = np.array([
-            [-0.5, 0.5, 0.5],
-            [0.5,  -0.5, 0.5],
-            [0.5, 0.5, -0.5]
-        ])
-        # Transform the basis
-        kvector = (T_F @ kvector)
-        print(f"Applied F-centered transform, kvector = {kvector}")
-    elif bravais_type == "I":
-        # Transformation matrix for I-centered lattice
-        T_I = np.array([
-            [0, 0.5, 0.5],
-            [0.5, 0, 0.5],
-            [0.5, 0.5, 0]
-        ])
-        kvector = (T_I @ kvector)
-        print(f"Applied I-centered transform, kvector = {kvector}")
-    elif bravais_type == "R":
-        # Transformation matrix for R-centered lattice
-        T_R = np.array([
-            [0.666, 0.333, 0.333],
-            [-0.333, 0.333, 0.333],
-            [-0.333, -0.666, 0.333]
-        ])
-        kvector = (T_R @ kvector)
-        print(f"Applied R-centered transform, kvector = {kvector}")
-    elif bravais_type == "Fc":
-        # Transformation matrix for face-centered cubic lattice
-        T_Fc = np.array([
-            [-0.5, 0.5, 0.5],
-            [0.5, -0.5, 0.5],
-            [0.5, 0.5, -0.5]
-        ])
-        kvector = (T_Fc @ kvector)
-        print(f"Applied Fc-centered transform, kvector = {kvector}")
-    elif bravais_type == "Ic":
-        # Transformation matrix for body-centered cubic lattice
-        T_Ic = np.array([
-            [0, 0.5, 0.5],
-            [0.5, 0, 0.5],
-            [0.5, 0.5, 0]
-        ])
-        kvector = (T_Ic @ kvector)
-        print(f"Applied Ic-centered transform, kvector = {kvector}")
+    # Default: use the reciprocal lattice basis directly, otherwise the primitive basis of the centred lattice
+    kvector = lu.primitive_kvector(np.array(recip_lattice_vectors), bravais_type)
+    if bravais_type in lu.CENTRING_TRANSFORMS:
+        print(f"Applied {bravais_type}-centered transform, kvector = {kvector}")
     else:
         print(f"Using default reciprocal lattice for {bravais_type}, kvector = {kvector}")
 
-    # Now compute BZ from the chosen primitive reciprocal lattice
-    brillouin_zone = BZ(kvector)
-    brillouin_zone.bulkBZ()
+    # Now compute BZ from the chosen primitive reciprocal lattice, or reuse it from the store
+    brillouin_zone = result_store.get_or_compute('bz', kvector, lambda: compute_bz(kvector))
 
 
-    bz_vertices = [p.tolist() for p in brillouin_zone.hs_points]
+    bz_vertices = [p.tolist() for p in brillouin_zone['hs_points']]
     bz_edges = []
-    for line in brillouin_zone.hs_lines_f:
+    for line in brillouin_zone['hs_lines_f']:
         d = line[:3]       # direction vector
         p0 = line[3:6]     # a point on the line
         t_min = line[6]
@@ -195,15 +112,53 @@ def calculate():
         end   = (p0 + t_max * d).tolist()
         bz_edges.append({'start': start, 'end': end})
 
+    # labelled special points, and an evenly spaced k-path through them when one is requested
+    special_points = kpath.special_points(kvector, brillouin_zone, conventional=np.array(recip_lattice_vectors),
+                                          centring=bravais_type)
+    bz_special_points = [{'label': label, 'point': point.tolist()}
+                         for label, point in zip(special_points['labels'], special_points['points'])]
+    k_path = None
+    if data.get('kpath_points'):
+        path = kpath.k_path(kvector, int(data['kpath_points']), data.get('kpath'), np.array(recip_lattice_vectors),
+                            brillouin_zone, bravais_type)
+        k_path = {'k': path['k'].tolist(), 'hkl': path['hkl'].tolist(), 'distance': path['distance'].tolist(),
+                  'ticks': path['ticks'].tolist(), 'tick_labels': path['tick_labels'], 'path': path['path']}
+
     #print(f"bz stuff: {bz_vertices} {bz_edges}")
     #print(f"Lattice Vectors {lattice_vectors}")
     #print(f"Recipricol Lattice Vectors {recip_lattice_vectors}")
 
     angle_between = lu.angle(u, v, recip_lattice)
 
-    theta_cut_plot = get_theta_cut_plot_data(w, r, lattice, recip_lattice, wl, two_theta)
+    # with a tolerance the curves are sampled adaptively to this fraction of the plot extent; by default, or
+    # with null, on the fixed 5 degree grid
+    tolerance = data.get('tolerance')
+    tolerance = None if tolerance is None else float(tolerance)
+    theta_cut_plot = get_theta_cut_plot_data(w, r, lattice, recip_lattice, wl, two_theta, tolerance)
+
+    # optional elastic resolution ellipses along every theta cut; the value may override instrument parameters
+    instrument = data.get('resolution')
+    if instrument:
+        instrument = instrument if isinstance(instrument, dict) else None
+        for trace in list(theta_cut_plot["traces"]):
+            ellipses = res.plane_resolution(lattice, w, r, trace["x"], trace["y"], "Ei", (9.044/wl)**2,
+                                            instrument=instrument)
+            theta_cut_plot["traces"].append(get_resolution_trace(trace["x"], trace["y"], ellipses,
+                                                                 trace["line"]["color"], f"resolution, {trace['name']}"))
     #dynamic_result = pla.dynamic_range("Ef", 10, 50)
 
+    # accidental Bragg scattering at wl, wl/2 and wl/3 from the sample environment, and from the sample itself
+    # only on request: its powder lines matter for polycrystals, not for a single crystal
+    contaminants = dict(spurions.CONTAMINANTS)
+    if data.get('spurion_sample'):
+        contaminants['sample'] = (lattice, bravais_type)
+    spurion_check = spurions.check(np.asarray(two_theta, dtype=float), wl, contaminants=contaminants,
+                                   tolerance=float(data.get('spurion_tolerance', 0.5)))
+    spurion_list = [{'two_theta': tth, 'material': str(spurion_check['name'][i]),
+                     'hkl': spurion_check['hkl'][i].tolist(), 'order': int(spurion_check['order'][i]),
+                     'delta': round(float(spurion_check['delta'][i]), 3)}
+                    for i, tth in enumerate(two_theta) if spurion_check['flagged'][i]]
+
     return jsonify({
         "lattice": str(lattice),
         "reciprocal_lattice": str(recip_lattice),
@@ -214,7 +169,82 @@ def calculate():
         "reciprocal_lattice_visual": recip_lattice_vectors,
         'bz_vertices': bz_vertices,
         'bz_edges': bz_edges,
+        'spurions': spurion_list,
+        'bz_special_points': bz_special_points,
+        # false when the points only have generic names (F1, E1, V1, ...)
+        'bz_labelled': bool(special_points['labelled']),
+        'bz_family': special_points['family'],
+        'k_path': k_path,
     })
 
+@app.route('/coverage', methods=['POST'])
+@profiling.profiled
+def coverage():
+    data = request.json
+    space_group = float(data['space_group'])
+    lattice = lu.lattice(float(data['param1']), float(data['param2']), float(data['param3']),
+                         float(data['param4']), float(data['param5']), float(data['param6']))
+    wl = float(data['param7'])
+    # same scattering plane as the theta cut plot
+    u = data['w']
+    v = data['r']
+    tth_range = (float(data.get('tth_min', 5)), float(data.get('tth_max', 135)))
+    th_range = (float(data.get('th_min', -180)), float(data.get('th_max', 180)))
+    n = int(data.get('n', 200))
+    if not 1 <= n <= MAX_COVERAGE_N:
+        return jsonify({"error": f"n must be between 1 and {MAX_COVERAGE_N}"}), 400
+
+    coverage_map = cov.coverage_map(lattice, u, v, wl=wl, tth_range=tth_range, th_range=th_range,
+                                    n=(n, n), centring=SG_BRAVAIS_MAP.get(space_group, "P"))
+
+    return jsonify({"coverage": get_coverage_plot_data(u, v, coverage_map)})
+
+@app.route('/index', methods=['POST'])
+@profiling.profiled
+def index_peaks():
+    data = request.json
+    space_group = float(data['space_group'])
+    lattice = lu.lattice(float(data['param1']), float(data['param2']), float(data['param3']),
+                         float(data['param4']), float(data['param5']), float(data['param6']))
+    wl = float(data['param7'])
+    peaks = np.asarray(data['peaks'], dtype=float)
+    found = indexing.index_peaks(lattice, peaks, wl, tolerance=float(data.get('tolerance', 0.1)),
+                                 centring=SG_BRAVAIS_MAP.get(space_group, "P"), n_fom=int(data.get('n_fom', 20)))
+
+    offsets = found['offsets']
+    candidates = [{
+        'hkl': found['hkl'][start:stop].tolist(),
+        'd': found['d'][start:stop].tolist(),
+        'two_theta': found['two_theta'][start:stop].tolist(),
+        'residual': found['residual'][start:stop].tolist(),
+    } for start, stop in zip(offsets[:-1], offsets[1:])]
+    fom = found['fom']
+    return jsonify({
+        'peaks': peaks.tolist(),
+        'candidates': candidates,
+        'fom': fom if np.isfinite(fom) else None,
+        'mean_residual': found['mean_residual'] if found['N'] else None,
+        'N': found['N'],
+        'N_poss': found['N_poss'],
+    })
+
+@app.route('/scan', methods=['POST'])
+def scan():
+    data = request.json
+    lattice = lu.lattice(float(data['param1']), float(data['param2']), float(data['param3']),
+                         float(data['param4']), float(data['param5']), float(data['param6']))
+    # same scattering plane as the theta cut plot
+    u = data['w']
+    v = data['r']
+    tth_range = (float(data.get('tth_min', 5)), float(data.get('tth_max', 135)))
+    th_range = (float(data.get('th_min', -180)), float(data.get('th_max', 180)))
+    specs = data['scans']
+    for spec in specs:
+        scans.trajectory(spec, 0, 0)  # reject malformed specs before the response starts
+
+    blocks = scans.iter_scans(lattice, u, v, specs, data.get('Efixed', 'Ef'), float(data['E']), tth_range, th_range)
+    return Response(stream_with_context(scans.csv_chunks(blocks)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=scan.csv'})
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
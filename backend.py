@@ -1,19 +1,18 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from math import sin, cos, asin, acos, pi
+import crystal
+import lattice_utils as lu
+import planning as pla
+from planning import dynamic_range
 
-class Lattice:
+class Lattice(crystal.Cell):
     def __init__(self, a=1.0, b=1.0, c=1.0, aa=90.0, bb=90.0, cc=90.0):
         """
         Class representing a crystallographic lattice.
         """
-        self.a = a
-        self.b = b
-        self.c = c
-        self.aa = np.deg2rad(aa)
-        self.bb = np.deg2rad(bb)
-        self.cc = np.deg2rad(cc)
-        self.gtensor = self.compute_gtensor()
+        super().__init__(a, b, c, aa, bb, cc)
+        self.gtensor = self.G
     
     def __str__(self):
         return f"""
@@ -26,49 +25,26 @@ class Lattice:
         """
         Compute and return the metric tensor of the lattice.
         """
-        g = np.empty((3, 3))
-        g[0, 0] = self.a ** 2
-        g[0, 1] = self.a * self.b * np.cos(self.cc)
-        g[0, 2] = self.a * self.c * np.cos(self.bb)
-        g[1, 0] = g[0, 1]
-        g[1, 1] = self.b ** 2
-        g[1, 2] = self.b * self.c * np.cos(self.aa)
-        g[2, 0] = g[0, 2]
-        g[2, 1] = g[1, 2]
-        g[2, 2] = self.c ** 2
-        return g
+        return crystal.metric_tensor(self.a, self.b, self.c, self.aa, self.bb, self.cc)
     
     def compute_volume(self):
         """
         Compute the unit cell volume.
         """
-        return self.a * self.b * self.c * np.sqrt(1 - cos(self.aa)**2 - cos(self.bb)**2 - cos(self.cc)**2 + 2 * cos(self.aa) * cos(self.bb) * cos(self.cc))
+        return self.volume
 
 
 def compute_reciprocal_lattice(lattice):
     """
     Compute and return the reciprocal lattice parameters.
     """
-    volume = lattice.compute_volume()
-    a_star = 2 * pi * lattice.b * lattice.c * sin(lattice.aa) / volume
-    b_star = 2 * pi * lattice.a * lattice.c * sin(lattice.bb) / volume
-    c_star = 2 * pi * lattice.a * lattice.b * sin(lattice.cc) / volume
-    
-    aa_star = acos((cos(lattice.bb) * cos(lattice.cc) - cos(lattice.aa)) / (sin(lattice.bb) * sin(lattice.cc)))
-    bb_star = acos((cos(lattice.aa) * cos(lattice.cc) - cos(lattice.bb)) / (sin(lattice.aa) * sin(lattice.cc)))
-    cc_star = acos((cos(lattice.aa) * cos(lattice.bb) - cos(lattice.cc)) / (sin(lattice.aa) * sin(lattice.bb)))
-    
-    return Lattice(a_star, b_star, c_star, np.rad2deg(aa_star), np.rad2deg(bb_star), np.rad2deg(cc_star))
+    return lattice.reciprocal()
 
 def angle(V1, V2, lattice):
     """
     Compute the angle between two vectors in degrees.
     """
-    g = lattice.gtensor
-    dot_product = np.dot(V1, np.dot(g, V2))
-    norm1 = np.sqrt(np.dot(V1, np.dot(g, V1)))
-    norm2 = np.sqrt(np.dot(V2, np.dot(g, V2)))
-    return np.degrees(np.arccos(dot_product / (norm1 * norm2)))
+    return lattice.angle(V1, V2)
 
 def run_cases(lattice, theta_angles, directions, wl, tth):
     """
@@ -84,20 +60,11 @@ def dynamic_range_plot(Efixed, E, E_max, theta_range=[10, 120], step=10):
     """
     Plot the accessible dynamic range in momentum-energy space.
     """
-    omega = np.linspace(0, E_max, 100)
-    theta_s = np.arange(theta_range[0], theta_range[1], step) * pi / 180
-    Q = np.empty([theta_s.size, omega.size], float)
+    result = dynamic_range(Efixed, E, E_max, theta_range, step)
+    omega = result["omega"]
 
-    if Efixed == "Ef":
-        kf = np.sqrt(E / 2.072)
-        ki = np.sqrt((omega + E) / 2.072)
-    elif Efixed == "Ei":
-        ki = np.sqrt(E / 2.072)
-        kf = np.sqrt((E - omega) / 2.072)
-
-    for i, theta in enumerate(theta_s):
-        Q[i] = np.sqrt(ki**2 + kf**2 - 2 * ki * kf * np.cos(theta))
-        plt.plot(Q[i], omega, '--', label=r"$2\theta_s$ =" f"{np.round(theta * 180 / pi, 1)}$^o$")
+    for theta, Q in zip(result["theta_angles"], result["Q"]):
+        plt.plot(Q, omega, '--', label=r"$2\theta_s$ =" f"{np.round(theta * 180 / pi, 1)}$^o$")
     
     plt.xlabel(r'Q ($\AA^{-1}$)')
     plt.ylabel('Energy Transfer (meV)')
@@ -126,17 +93,13 @@ def miller_indices(V, lattice):
     """
     Compute Miller indices from fractional coordinates.
     """
-    g = lattice.gtensor
-    h = (g[0, 0] * V[0] + g[1, 0] * V[1] + g[2, 0] * V[2]) / (2. * pi)
-    k = (g[0, 1] * V[0] + g[1, 1] * V[1] + g[2, 1] * V[2]) / (2. * pi)
-    l = (g[0, 2] * V[0] + g[1, 2] * V[1] + g[2, 2] * V[2]) / (2. * pi)
-    return [h, k, l]
+    return lu.Miller(V, lattice)
 
 def vector_magnitude(V, lattice):
     """
     Compute magnitude of a vector given its Miller indices.
     """
-    return np.sqrt(np.dot(V, np.dot(lattice.gtensor, V)))
+    return lattice.norm(V)
 
 def d_spacing(V, reciprocal_lattice):
     """
@@ -161,44 +124,9 @@ def calc_q(lattice, tth, th, wl=651, u=[1, 0, 0], v=[0, 0, 1], eV=True):
     if eV:
         wl = 12.398 / wl  # Convert eV to inverse Angstroms
     
-    modQ = 4 * pi / wl * sin(np.radians(tth / 2))
-    alpha = (180 - tth) / 2 + th
-    
-    reciprocal_lattice = compute_reciprocal_lattice(lattice)
-    u, v = np.array(u, dtype=np.float64), np.array(v, dtype=np.float64)
-    
-    u /= np.linalg.norm(u)
-    v -= np.dot(v, u) * u
-    v /= np.linalg.norm(v)
-    
-    qx, qy = modQ * cos(np.radians(alpha)) * u, modQ * sin(np.radians(alpha)) * v
-    return qx + qy
-
+    modQ, alpha, X, Y = pla.calcQ(lattice, tth, th, wl, u, v)
+    return modQ * cos(np.radians(alpha)) * X + modQ * sin(np.radians(alpha)) * Y
 
-def dynamic_range(Efixed, E, E_max, theta_range=[10, 120], step=10, color='k', showplot=True):
-    """
-    Plot the accessible dynamic range in momentum-energy space.
-    """
-    omega = np.linspace(0, E_max, 100)
-    theta_s = np.arange(theta_range[0] * np.pi / 180, theta_range[1] * np.pi / 180, step * np.pi / 180)
-    Q = []
-
-    if Efixed == "Ef":
-        kf = np.sqrt(E / 2.072)
-        ki = np.sqrt((omega + E) / 2.072)
-    elif Efixed == "Ei":
-        ki = np.sqrt(E / 2.072)
-        kf = np.sqrt((E - omega) / 2.072)
-
-    for i, theta in enumerate(theta_s):
-        Q_row = np.sqrt(ki ** 2 + kf ** 2 - 2 * ki * kf * np.cos(theta))
-        Q.append(Q_row.tolist())
-    
-    return {
-        "theta_angles": theta_s.tolist(),
-        "omega": omega.tolist(),
-        "Q": Q
-    }
 
 if __name__ == "__main__":
     lattice, recip_lattice = user_input_lattice()
@@ -0,0 +1,47 @@
+"""
+Chunked evaluation helpers for very large grids.
+
+Large results are written block by block into an output array that is
+allocated once, either in memory or as a memory-mapped .npy file, so that
+the temporaries of a calculation never exceed a memory budget regardless of
+the grid size. The default budget is taken from QPC_MEMORY_BUDGET (bytes).
+"""
+
+import os
+
+import numpy as np
+
+DEFAULT_BUDGET = int(os.environ.get('QPC_MEMORY_BUDGET', 256 * 1024**2))
+
+
+def rows_per_chunk(row_bytes, budget=None):
+    """
+    Return how many rows of row_bytes each fit in the memory budget, at least one.
+    """
+    budget = DEFAULT_BUDGET if budget is None else budget
+    return max(1, int(budget // max(row_bytes, 1)))
+
+
+def chunks(n_rows, row_bytes, budget=None):
+    """
+    Yield slices covering n_rows rows in blocks that fit in the memory budget.
+    """
+    step = rows_per_chunk(row_bytes, budget)
+    for start in range(0, n_rows, step):
+        yield slice(start, min(start + step, n_rows))
+
+
+def empty(shape, dtype=np.float64, out=None):
+    """
+    Return an output array of the given shape and dtype.
+    Arguments:
+    out -- None for an in-memory array, an existing array to reuse, or a path
+           for a memory-mapped .npy file created with that shape and dtype
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(out, np.ndarray):
+        if out.shape != tuple(shape):
+            raise ValueError(f'output array has shape {out.shape}, expected {tuple(shape)}')
+        return out
+    return np.lib.format.open_memmap(os.fspath(out), mode='w+', dtype=dtype, shape=tuple(shape))
@@ -0,0 +1,169 @@
+"""
+Reciprocal space coverage maps in the (u, v) scattering plane.
+
+The accessible region is rasterized on a regular grid in r.l.u. of u and v,
+following the same conventions as planning.calcQ: the x axis lies along u,
+the y axis is the in-plane direction perpendicular to u, and the sample
+angle theta is zero when u is along ki.
+"""
+
+import os
+
+import numpy as np
+import lattice_utils as lu
+import chunking
+def scattering_plane(rlatt,u,v):
+    """
+    Returns |u|, |v| and the orthonormal in-plane directions X and Y in Miller indicies
+    Arguments:
+    rlatt -- reciprocal space lattice object
+    u -- reciprocal lattice vector defining the x axis of the scattering plane
+    v -- second reciprocal lattice vector in the scattering plane
+    """
+    u = np.array(u,dtype=float)
+    v = np.array(v,dtype=float)
+    modu = lu.modVec(u,rlatt)
+    modv = lu.modVec(v,rlatt)
+    X = u/modu
+    Y = v - X*lu.scalar(v,X,rlatt)
+    Y = Y/lu.modVec(Y,rlatt)
+    return modu,modv,X,Y
+def wavevectors(wl=None,Efixed=None,E=None,omega=0.):
+    """
+    Returns the incident and final wavevectors, in inverse angstroms
+    Arguments:
+    wl -- neutron wavelength for elastic scattering, in angstroms
+    Efixed -- "Ei" or "Ef", used when wl is not given
+    E -- the fixed energy, in meV
+    omega -- energy transfer, in meV
+    """
+    if wl is not None:
+        k = 2*np.pi/wl
+        return k,k
+    if Efixed == "Ef":
+        return np.sqrt((E + omega)/2.072),np.sqrt(E/2.072)
+    elif Efixed == "Ei":
+        return np.sqrt(E/2.072),np.sqrt(max(E - omega,0.)/2.072)
+    raise ValueError('either wl or Efixed and E must be given')
+def accessible(qx,qy,ki,kf,tth_range=(5.,135.),th_range=(-180.,180.)):
+    """
+    Evaluates the spectrometer angles needed to reach in-plane momentum transfers
+    Returns the scattering angle, the sample angle (both in degrees, NaN where
+    unreachable) and a boolean mask of the reachable points
+    Arguments:
+    qx,qy -- arrays of Q components along X and Y, in inverse angstroms
+    ki,kf -- incident and final wavevectors, in inverse angstroms
+    tth_range -- [min, max] scattering angle in degrees
+    th_range -- [min, max] sample angle in degrees
+    """
+    # keep float32 inputs in float32
+    qx = np.asarray(qx)
+    qy = np.asarray(qy)
+    if not np.issubdtype(qx.dtype,np.floating):
+        qx = qx.astype(float)
+    if not np.issubdtype(qy.dtype,np.floating):
+        qy = qy.astype(float)
+    modQ = np.hypot(qx,qy)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        cos_tth = (ki**2 + kf**2 - modQ**2)/(2*ki*kf)
+        closes = np.abs(cos_tth) <= 1
+        tth = np.rad2deg(np.arccos(np.clip(cos_tth,-1,1)))
+        # angle between ki and Q; reduces to (180 - tth)/2 for elastic scattering
+        cos_psi = (ki - kf*np.cos(np.deg2rad(tth)))/modQ
+        psi = np.rad2deg(np.arccos(np.clip(np.nan_to_num(cos_psi,nan=1.),-1,1)))
+    alpha = np.rad2deg(np.arctan2(qy,qx))
+    th = alpha - psi
+    # bring the sample angle into the window [th_min, th_min + 360)
+    th = th_range[0] + np.mod(th - th_range[0],360.)
+    mask = closes & (tth >= tth_range[0]) & (tth <= tth_range[1]) & (th <= th_range[1])
+    tth = np.where(closes,tth,np.nan)
+    th = np.where(closes,th,np.nan)
+    return tth,th,mask
+def bragg_overlay(latt,u,v,q_max,centring='P'):
+    """
+    Returns the allowed reflections lying in the plane spanned by u and v
+    together with their (x, y) coordinates in r.l.u. of u and v
+    Arguments:
+    latt -- real space lattice object
+    u,v -- reciprocal lattice vectors defining the scattering plane
+    q_max -- largest momentum transfer, in inverse angstroms
+    centring -- centring letter used to remove systematically absent reflections
+    """
+    rlatt = lu.recip_lattice(latt)
+    modu,modv,X,Y = scattering_plane(rlatt,u,v)
+    hkl,modQ = lu.hkl_list(latt,q_max,centring)
+    # hkl lies in the plane when it is linearly dependent on u and v
+    normal = np.cross(np.asarray(u),np.asarray(v))
+    in_plane = np.abs(hkl @ normal) < 1e-9
+    hkl = hkl[in_plane]
+    qx = lu.scalar(hkl.T,X,rlatt)
+    qy = lu.scalar(hkl.T,Y,rlatt)
+    return {
+        "hkl": hkl,
+        "modQ": modQ[in_plane],
+        "qx": qx,
+        "qy": qy,
+        "x": qx/modu,
+        "y": qy/modv,
+    }
+def coverage_map(latt,u,v,wl=None,Efixed=None,E=None,omega=0.,tth_range=(5.,135.),
+                 th_range=(-180.,180.),x_range=None,y_range=None,n=(400,400),centring='P',
+                 dtype=np.float64,budget=None,out_dir=None):
+    """
+    Rasterizes the accessible region of the (u, v) scattering plane
+    Returns a dictionary with the grid axes in r.l.u., the coverage mask with
+    shape (ny, nx), the scattering and sample angle of every grid point and the
+    in-plane Bragg reflections
+    Arguments:
+    latt -- real space lattice object
+    u,v -- reciprocal lattice vectors defining the scattering plane
+    wl -- wavelength in angstroms, for elastic scattering
+    Efixed, E, omega -- fixed "Ei" or "Ef", its energy and the energy transfer in meV, used when wl is None
+    tth_range -- [min, max] scattering angle in degrees
+    th_range -- [min, max] sample angle in degrees
+    x_range, y_range -- [min, max] extent of the map in r.l.u., defaults to the whole accessible region
+    n -- number of grid points (nx, ny)
+    centring -- centring letter for the Bragg peak overlay
+    dtype -- floating point type of the computation and of the angle maps, e.g. np.float32
+    budget -- memory budget in bytes for the temporaries of each block of rows, see chunking
+    out_dir -- directory in which mask.npy, two_theta.npy and theta.npy are written as
+               memory-mapped arrays instead of being held in memory
+    """
+    rlatt = lu.recip_lattice(latt)
+    modu,modv,X,Y = scattering_plane(rlatt,u,v)
+    ki,kf = wavevectors(wl,Efixed,E,omega)
+    q_max = np.sqrt(ki**2 + kf**2 - 2*ki*kf*np.cos(np.deg2rad(tth_range[1])))
+    if x_range is None:
+        x_range = (-q_max/modu,q_max/modu)
+    if y_range is None:
+        y_range = (-q_max/modv,q_max/modv)
+    x = np.linspace(x_range[0],x_range[1],n[0])
+    y = np.linspace(y_range[0],y_range[1],n[1])
+
+    paths = dict.fromkeys(("mask","two_theta","theta"))
+    if out_dir is not None:
+        paths = {name: os.path.join(out_dir,name + '.npy') for name in paths}
+    mask = chunking.empty((n[1],n[0]),bool,paths["mask"])
+    tth = chunking.empty((n[1],n[0]),dtype,paths["two_theta"])
+    th = chunking.empty((n[1],n[0]),dtype,paths["theta"])
+
+    # about 16 full-size temporaries per row are alive inside accessible()
+    ftype = np.dtype(dtype).type
+    qx = (x*modu).astype(dtype)[np.newaxis,:]
+    qy = (y*modv).astype(dtype)[:,np.newaxis]
+    for rows in chunking.chunks(n[1],16*n[0]*np.dtype(dtype).itemsize,budget):
+        tth[rows],th[rows],mask[rows] = accessible(qx,qy[rows],ftype(ki),ftype(kf),tth_range,th_range)
+
+    peaks = bragg_overlay(latt,u,v,q_max,centring)
+    p_tth,p_th,p_mask = accessible(peaks["qx"],peaks["qy"],ki,kf,tth_range,th_range)
+    peaks["two_theta"] = p_tth
+    peaks["theta"] = p_th
+    peaks["accessible"] = p_mask
+    return {
+        "x": x,
+        "y": y,
+        "mask": mask,
+        "two_theta": tth,
+        "theta": th,
+        "peaks": peaks,
+    }
@@ -0,0 +1,176 @@
+"""
+Matrix-based crystallography core.
+
+A Cell precomputes its metric tensor G, its Cartesian basis A (rows are the
+basis vectors, a along x and b in the xy plane) and the reciprocal basis
+B = 2 pi inv(A).T expressed in the same Cartesian frame. Vectors are given in
+components of the cell basis with the components on the last axis, so that
+conversions, scalar products, norms and angles of any number of vectors are
+single matrix products.
+
+lattice_utils.lattice and backend.Lattice are thin subclasses of Cell.
+"""
+
+import numpy as np
+
+
+def metric_tensor(a, b, c, alpha, beta, gamma):
+    """
+    Return the metric tensor of a cell, angles in radians.
+    """
+    ca, cb, cg = np.cos(alpha), np.cos(beta), np.cos(gamma)
+    return np.array([[a*a,    a*b*cg, a*c*cb],
+                     [a*b*cg, b*b,    b*c*ca],
+                     [a*c*cb, b*c*ca, c*c]])
+
+
+def basis_matrix(a, b, c, alpha, beta, gamma):
+    """
+    Return the Cartesian basis of a cell as rows, with a along x and b in the xy plane, angles in radians.
+    """
+    cx = c*np.cos(beta)
+    cy = c*(np.cos(alpha) - np.cos(beta)*np.cos(gamma))/np.sin(gamma)
+    cz = np.sqrt(c**2 - cx**2 - cy**2)
+    return np.array([[a, 0, 0],
+                     [b*np.cos(gamma), b*np.sin(gamma), 0],
+                     [cx, cy, cz]])
+
+
+def parameters(G):
+    """
+    Return (a, b, c, alpha, beta, gamma) of the cell with metric tensor G, angles in degrees.
+    """
+    a, b, c = np.sqrt(np.diag(G))
+    alpha = np.rad2deg(np.arccos(np.clip(G[1, 2]/(b*c), -1, 1)))
+    beta = np.rad2deg(np.arccos(np.clip(G[0, 2]/(a*c), -1, 1)))
+    gamma = np.rad2deg(np.arccos(np.clip(G[0, 1]/(a*b), -1, 1)))
+    return a, b, c, alpha, beta, gamma
+
+
+class Cell:
+    """
+    Unit cell with precomputed metric and basis matrices.
+
+    Attributes:
+        a, b, c: cell lengths
+        aa, bb, cc: cell angles in radians
+        G: metric tensor
+        A: Cartesian basis, rows are the basis vectors
+        B: reciprocal basis in the frame of A, rows are the reciprocal basis vectors (including 2 pi)
+        volume: cell volume
+    """
+
+    def __init__(self, a=1., b=1., c=1., aa=90., bb=90., cc=90.):
+        """
+        a, b, c -- cell lengths
+        aa, bb, cc -- cell angles in degrees
+        """
+        self.a = a
+        self.b = b
+        self.c = c
+        self.aa = np.deg2rad(aa)
+        self.bb = np.deg2rad(bb)
+        self.cc = np.deg2rad(cc)
+        self.G = metric_tensor(a, b, c, self.aa, self.bb, self.cc)
+        self.A = basis_matrix(a, b, c, self.aa, self.bb, self.cc)
+        self.B = 2*np.pi*np.linalg.inv(self.A).T
+        self.volume = np.sqrt(np.linalg.det(self.G))
+        self._reciprocal = None
+
+    def reciprocal(self):
+        """
+        Return the reciprocal cell (including 2 pi) as an instance of the same class.
+        """
+        if self._reciprocal is None:
+            self._reciprocal = self.__class__(*parameters(self.B @ self.B.T))
+        return self._reciprocal
+
+    def to_cartesian(self, V):
+        """
+        Convert components in the cell basis to Cartesian coordinates in the frame of A.
+        """
+        return np.asarray(V) @ self.A
+
+    def from_cartesian(self, X):
+        """
+        Convert Cartesian coordinates in the frame of A to components in the cell basis.
+        """
+        return np.asarray(X) @ self.B.T/(2*np.pi)
+
+    def reciprocal_to_cartesian(self, hkl):
+        """
+        Convert Miller indicies to Cartesian reciprocal vectors in the frame of A.
+        """
+        return np.asarray(hkl) @ self.B
+
+    def dot(self, V1, V2):
+        """
+        Scalar product of vectors given by their components in the cell basis.
+        """
+        return np.einsum('...i,ij,...j->...', np.asarray(V1, dtype=float), self.G, np.asarray(V2, dtype=float))
+
+    def norm(self, V):
+        """
+        Length of vectors given by their components in the cell basis.
+        """
+        return np.sqrt(self.dot(V, V))
+
+    def angle(self, V1, V2):
+        """
+        Angle in degrees between vectors given by their components in the cell basis.
+        """
+        cos = self.dot(V1, V2)/(self.norm(V1)*self.norm(V2))
+        return np.rad2deg(np.arccos(np.clip(cos, -1, 1)))
+
+
+def selling_reduce(bases, tol=1e-10, max_iter=1000):
+    """
+    Selling (Delaunay) reduction of lattice bases, vectorized over any number of them.
+    Returns reduced bases of the same lattices, shape (...,3,3), rows b1, b2, b3 with the
+    handedness of the input, such that the superbase b0 = -(b1+b2+b3), b1, b2, b3 is obtuse:
+    every scalar product bi.bj (i != j) is <= 0
+    Arguments:
+    bases -- basis vectors as rows, in Cartesian coordinates, shape (...,3,3)
+    tol -- relative tolerance below which a positive scalar product counts as zero
+    max_iter -- largest number of reduction steps
+    """
+    bases = np.asarray(bases, dtype=float)
+    shape = bases.shape
+    B = bases.reshape(-1, 3, 3)
+    superbase = np.concatenate([-B.sum(axis=1, keepdims=True), B], axis=1)
+    i, j = np.triu_indices(4, 1)
+    # the two other vectors of every pair (i,j)
+    others = np.array([[k for k in range(4) if k not in pair] for pair in zip(i, j)])
+    scale = tol*np.einsum('nij,nij->n', B, B)
+
+    for _ in range(max_iter):
+        s = np.einsum('npk,npk->np', superbase[:, i], superbase[:, j])
+        worst = np.argmax(s, axis=1)
+        active = np.flatnonzero(s[np.arange(len(s)), worst] > scale)
+        if not active.size:
+            break
+        # b_i -> -b_i and b_k -> b_k + b_i for the two other vectors; b_j is unchanged
+        pair = worst[active]
+        b_i = superbase[active, i[pair]].copy()
+        for column in range(2):
+            superbase[active, others[pair, column]] += b_i
+        superbase[active, i[pair]] = -b_i
+    else:
+        raise RuntimeError('Selling reduction did not converge')
+
+    reduced = superbase[:, 1:]
+    # b0..b3 and -b0..-b3 are both obtuse, so keep the handedness of the input
+    flip = np.sign(np.linalg.det(reduced)) != np.sign(np.linalg.det(B))
+    reduced[flip] *= -1
+    return reduced.reshape(shape)
+
+
+def voronoi_vectors(basis):
+    """
+    Return the 14 lattice vectors +-b0..+-b3 and +-(bi+bj) of the obtuse superbase of a Selling-reduced basis,
+    shape (14,3). The bisecting planes of these vectors bound the Voronoi cell (Wigner-Seitz cell) of the lattice.
+    """
+    B = np.asarray(basis, dtype=float)
+    superbase = np.vstack([-B.sum(axis=0), B])
+    vectors = np.vstack([superbase, superbase[0] + superbase[1:]])
+    return np.vstack([vectors, -vectors])
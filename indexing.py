@@ -0,0 +1,147 @@
+"""
+Indexing of observed powder peaks against the reflections of a cell.
+
+Observed 2theta positions are converted to |Q| windows, and the candidates of
+every peak are found by binary search on the |Q| column of the cell's
+reflection table from reflection_cache, which is sorted, memory-mapped and
+shared between processes. All peaks are searched in one vectorized call and
+the candidates are returned flattened, with offsets per peak, so thousands of
+peaks against million-reflection tables take milliseconds.
+
+The quality of the assignment is given by the Smith & Snyder figure of merit
+F_N = N/(<|delta 2theta|> N_poss) (J. Appl. Cryst. 12, 60 (1979)), where
+<|delta 2theta|> is the mean residual of the best candidates of the first N
+peaks and N_poss the number of distinct d spacings possible up to the last of
+them, or up to the line assigned to it when that is further out. The mean
+residual is floored at RESIDUAL_FLOOR, so an exact indexing gets the largest
+finite F_N instead of infinity.
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+import reflection_cache
+
+# smallest mean residual in degrees used by the figure of merit, well below any measured 2theta precision
+RESIDUAL_FLOOR = 1e-4
+CACHE_SIZE = 32
+
+_lines = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def _q(two_theta, wavelength):
+    # |Q| of a scattering angle in degrees; the inverse of reflection_cache.two_theta
+    return 4*np.pi*np.sin(np.deg2rad(np.clip(two_theta, 0., 180.))/2)/wavelength
+
+
+def line_q(rows, rel_tol=1e-9):
+    """
+    |Q| of the distinct lines of a reflection table, sorted, counting reflections with equal d once.
+    The result is kept for the CACHE_SIZE most recently used stored tables.
+    """
+    key = (getattr(rows, 'filename', None), rows.shape, rel_tol)
+    with _lock:
+        if key[0] is not None and key in _lines:
+            _lines.move_to_end(key)
+            return _lines[key]
+    modQ = reflection_cache.sorted_q(rows)
+    starts = np.flatnonzero(np.diff(modQ) > rel_tol*modQ[1:]) + 1
+    lines = np.concatenate([modQ[:1], modQ[starts]])
+    if key[0] is not None:
+        with _lock:
+            _lines[key] = lines
+            while len(_lines) > CACHE_SIZE:
+                _lines.popitem(last=False)
+    return lines
+
+
+def candidates(rows, two_theta, wavelength, tolerance=0.1):
+    """
+    All reflections of a table within tolerance of every observed peak
+    Returns a dictionary with the flattened candidates of all peaks (index of the 'peak', 'hkl',
+    'd', calculated 'two_theta' and 'residual' observed minus calculated, in degrees) and the
+    'offsets' such that the candidates of peak i are offsets[i]:offsets[i+1]
+    Arguments:
+    rows -- reflection table sorted by |Q|, see reflection_cache.table
+    two_theta -- observed scattering angles in degrees, shape (N,)
+    wavelength -- neutron wavelength in angstroms
+    tolerance -- largest |observed - calculated| 2theta in degrees
+    """
+    two_theta = np.asarray(two_theta, dtype=float).ravel()
+    modQ = reflection_cache.sorted_q(rows)
+    lo = np.searchsorted(modQ, _q(two_theta - tolerance, wavelength), side='left')
+    hi = np.searchsorted(modQ, _q(two_theta + tolerance, wavelength), side='right')
+    counts = hi - lo
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    # position in the table of every candidate, without a loop over the peaks
+    peak = np.repeat(np.arange(two_theta.size), counts)
+    index = lo[peak] + np.arange(offsets[-1]) - offsets[peak]
+    found = rows[index]
+    calc = reflection_cache.two_theta(found, wavelength)
+    return {
+        'peak': peak,
+        'hkl': np.asarray(found['hkl']),
+        'd': np.asarray(found['d']),
+        'two_theta': calc,
+        'residual': two_theta[peak] - calc,
+        'offsets': offsets,
+    }
+
+
+def figure_of_merit(rows, two_theta, wavelength, found, n=20):
+    """
+    Smith & Snyder figure of merit F_N of an indexing
+    Returns F_N, the mean absolute residual in degrees, N and N_poss. Only the first n peaks in
+    order of 2theta that have a candidate are counted; F_N is NaN when none of them has one and
+    at most N/(RESIDUAL_FLOOR N_poss) when the residuals vanish.
+    Arguments:
+    rows -- reflection table sorted by |Q|
+    two_theta -- observed scattering angles in degrees
+    wavelength -- neutron wavelength in angstroms
+    found -- result of candidates() for these peaks
+    n -- number of peaks used, 20 by convention
+    """
+    two_theta = np.asarray(two_theta, dtype=float).ravel()
+    offsets = found['offsets']
+    has = np.diff(offsets) > 0
+    if not has.any():
+        return np.nan, np.nan, 0, 0
+    # residual of the best candidate of every peak
+    best = np.full(two_theta.size, np.nan)
+    best[has] = np.minimum.reduceat(np.abs(found['residual']), offsets[:-1][has])
+    indexed = np.flatnonzero(has)
+    indexed = indexed[np.argsort(two_theta[indexed], kind='stable')][:n]
+    mean = best[indexed].mean()
+    # lines up to the last peak, including the line it is assigned to when that lies just beyond it
+    last = indexed[np.argmax(two_theta[indexed])]
+    start, stop = offsets[last], offsets[last + 1]
+    assigned = found['two_theta'][start + np.argmin(np.abs(found['residual'][start:stop]))]
+    n_poss = int(np.searchsorted(line_q(rows), _q(max(two_theta[last], assigned), wavelength)*(1 + 1e-12),
+                                 side='right'))
+    fom = indexed.size/(max(mean, RESIDUAL_FLOOR)*n_poss) if n_poss else np.nan
+    return float(fom), float(mean), int(indexed.size), n_poss
+
+
+def index_peaks(latt, two_theta, wavelength, tolerance=0.1, centring='P', n_fom=20, directory=None):
+    """
+    Candidate hkl of observed powder peaks with residuals and the figure of merit of the cell
+    Returns the dictionary of candidates() with 'fom', 'mean_residual', 'N' and 'N_poss' added
+    Arguments:
+    latt -- real space lattice object
+    two_theta -- observed scattering angles in degrees
+    wavelength -- neutron wavelength in angstroms
+    tolerance -- largest |observed - calculated| 2theta in degrees
+    centring -- centring letter used to remove systematically absent reflections
+    n_fom -- number of peaks used for the figure of merit
+    directory -- reflection cache directory, defaults to QPC_REFLECTION_CACHE
+    """
+    two_theta = np.asarray(two_theta, dtype=float).ravel()
+    q_max = _q(two_theta.max() + tolerance, wavelength) if two_theta.size else 0.
+    rows = reflection_cache.table(latt, q_max, centring, directory)
+    found = candidates(rows, two_theta, wavelength, tolerance)
+    fom, mean, n, n_poss = figure_of_merit(rows, two_theta, wavelength, found, n_fom)
+    found.update({'fom': fom, 'mean_residual': mean, 'N': n, 'N_poss': n_poss})
+    return found
@@ -0,0 +1,417 @@
+"""
+High-symmetry points and k-paths of a computed Brillouin zone.
+
+Candidate points (Gamma, face centres, edge midpoints and vertices) are
+taken from the BZ geometry of BZdrawer and grouped into classes of points
+related by the holohedry of the reciprocal lattice. For the cubic P, F and I,
+tetragonal P, orthorhombic P and hexagonal lattices the classes are given
+their standard names (Setyawan & Curtarolo, Comp. Mat. Sci. 49, 299 (2010)).
+When the conventional cell and its centring are known, the body-centred
+tetragonal (BCT1/2), face-, body- and base-centred orthorhombic (ORCF1-3,
+ORCI, ORCC) and rhombohedral (RHL1/2) lattices get the points of the same
+paper, placed from their coordinates in its primitive reciprocal basis.
+Other lattices are marked unlabelled and their classes are named F1, F2, ...
+(faces), E1, ... (edge midpoints) and V1, ... (vertices) in order of
+distance from Gamma.
+
+A path such as 'G-X-W-K-G-L|U-X' visits, for every label, the point of its
+class closest to the previous one, and is sampled evenly by arc length.
+Special points are cached per primitive reciprocal basis, rounded to 10
+decimals, so repeated paths through the same zone reuse the geometry.
+"""
+
+import collections
+import itertools
+import threading
+
+import numpy as np
+
+import crystal
+import lattice_utils as lu
+from BZdrawer import BZ
+
+GAMMA = 'G'
+CACHE_SIZE = 256
+
+# labels by (kind, size of the class) for each lattice family
+FAMILY_LABELS = {
+    'cP': {('face', 6): 'X', ('edge', 12): 'M', ('vertex', 8): 'R'},
+    'cF': {('face', 8): 'L', ('face', 6): 'X', ('edge', 12): 'K', ('edge', 24): 'U', ('vertex', 24): 'W'},
+    'cI': {('face', 12): 'N', ('vertex', 6): 'H', ('vertex', 8): 'P'},
+    'tP': {('face', 4): 'X', ('face', 2): 'Z', ('edge', 4): 'M', ('edge', 8): 'R', ('vertex', 8): 'A'},
+    'hP': {('face', 6): 'M', ('face', 2): 'A', ('edge', 6): 'K', ('edge', 12): 'L', ('vertex', 12): 'H'},
+    # orthorhombic classes all have the same size and are told apart by the axes they lie along
+    'oP': {('face', (1, 0, 0)): 'X', ('face', (0, 1, 0)): 'Y', ('face', (0, 0, 1)): 'Z',
+           ('edge', (1, 1, 0)): 'S', ('edge', (1, 0, 1)): 'U', ('edge', (0, 1, 1)): 'T', ('vertex', (1, 1, 1)): 'R'},
+}
+
+PATHS = {
+    'cP': 'G-X-M-G-R-X|M-R',
+    'cF': 'G-X-W-K-G-L-U-W-L-K|U-X',
+    'cI': 'G-H-N-G-P-H|P-N',
+    'tP': 'G-X-M-G-Z-R-A-Z|X-R|M-A',
+    'oP': 'G-X-S-Y-G-Z-U-R-T-Z|Y-T|U-X|S-R',
+    'hP': 'G-M-K-G-A-L-H-A|L-M|K-H',
+    'BCT1': 'G-X-M-G-Z-P-N-Z1-M|X-P',
+    'BCT2': 'G-X-Y-S-G-Z-S1-N-P-Y1-Z|X-P',
+    'ORCF1': 'G-Y-T-Z-G-X-A1-Y|T-X1|X-A-Z|L-G',
+    'ORCF2': 'G-Y-C-D-X-G-Z-D1-H-C|C1-Z|X-H1|H-Y|L-G',
+    'ORCF3': 'G-Y-T-Z-G-X-A1-Y|X-A-Z|L-G',
+    'ORCI': 'G-X-L-T-W-R-X1-Z-G-Y-S-W|L1-Y|Y1-Z',
+    'ORCC': 'G-X-S-R-A-Z-G-Y-X1-A1-T-Y|Z-T',
+    'RHL1': 'G-L-B1|B-Z-G-X|Q-F-P1-Z|L-P',
+    'RHL2': 'G-P-Z-Q-G-F-P1-Q1-L-Z',
+}
+
+
+# special points of the centred lattices in the primitive reciprocal basis of Setyawan & Curtarolo, as functions
+# of the conventional a, b, c (a < b < c for ORCF and ORCI, a < b for ORCC) and the rhombohedral angle alpha;
+# Sigma is written S
+def _bct1(a, b, c, alpha):
+    eta = (1 + c**2/a**2)/4
+    return {'M': (-1/2, 1/2, 1/2), 'N': (0, 1/2, 0), 'P': (1/4, 1/4, 1/4), 'X': (0, 0, 1/2),
+            'Z': (eta, eta, -eta), 'Z1': (-eta, 1 - eta, eta)}
+
+
+def _bct2(a, b, c, alpha):
+    eta = (1 + a**2/c**2)/4
+    zeta = a**2/(2*c**2)
+    return {'N': (0, 1/2, 0), 'P': (1/4, 1/4, 1/4), 'S': (-eta, eta, eta), 'S1': (eta, 1 - eta, -eta),
+            'X': (0, 0, 1/2), 'Y': (-zeta, zeta, 1/2), 'Y1': (1/2, 1/2, -zeta), 'Z': (1/2, 1/2, -1/2)}
+
+
+def _orcf13(a, b, c, alpha):
+    zeta = (1 + a**2/b**2 - a**2/c**2)/4
+    eta = (1 + a**2/b**2 + a**2/c**2)/4
+    return {'A': (1/2, 1/2 + zeta, zeta), 'A1': (1/2, 1/2 - zeta, 1 - zeta), 'L': (1/2, 1/2, 1/2),
+            'T': (1, 1/2, 1/2), 'X': (0, eta, eta), 'X1': (1, 1 - eta, 1 - eta), 'Y': (1/2, 0, 1/2),
+            'Z': (1/2, 1/2, 0)}
+
+
+def _orcf2(a, b, c, alpha):
+    eta = (1 + a**2/b**2 - a**2/c**2)/4
+    phi = (1 + c**2/b**2 - c**2/a**2)/4
+    delta = (1 + b**2/a**2 - b**2/c**2)/4
+    return {'C': (1/2, 1/2 - eta, 1 - eta), 'C1': (1/2, 1/2 + eta, eta), 'D': (1/2 - delta, 1/2, 1 - delta),
+            'D1': (1/2 + delta, 1/2, delta), 'L': (1/2, 1/2, 1/2), 'H': (1 - phi, 1/2 - phi, 1/2),
+            'H1': (phi, 1/2 + phi, 1/2), 'X': (0, 1/2, 1/2), 'Y': (1/2, 0, 1/2), 'Z': (1/2, 1/2, 0)}
+
+
+def _orci(a, b, c, alpha):
+    zeta = (1 + a**2/c**2)/4
+    eta = (1 + b**2/c**2)/4
+    delta = (b**2 - a**2)/(4*c**2)
+    mu = (a**2 + b**2)/(4*c**2)
+    return {'L': (-mu, mu, 1/2 - delta), 'L1': (mu, -mu, 1/2 + delta), 'L2': (1/2 - delta, 1/2 + delta, -mu),
+            'R': (0, 1/2, 0), 'S': (1/2, 0, 0), 'T': (0, 0, 1/2), 'W': (1/4, 1/4, 1/4), 'X': (-zeta, zeta, zeta),
+            'X1': (zeta, 1 - zeta, -zeta), 'Y': (eta, -eta, eta), 'Y1': (1 - eta, eta, -eta), 'Z': (1/2, 1/2, -1/2)}
+
+
+def _orcc(a, b, c, alpha):
+    zeta = (1 + a**2/b**2)/4
+    return {'A': (zeta, zeta, 1/2), 'A1': (-zeta, 1 - zeta, 1/2), 'R': (0, 1/2, 1/2), 'S': (0, 1/2, 0),
+            'T': (-1/2, 1/2, 1/2), 'X': (zeta, zeta, 0), 'X1': (-zeta, 1 - zeta, 0), 'Y': (-1/2, 1/2, 0),
+            'Z': (0, 0, 1/2)}
+
+
+def _rhl1(a, b, c, alpha):
+    eta = (1 + 4*np.cos(alpha))/(2 + 4*np.cos(alpha))
+    nu = 3/4 - eta/2
+    return {'B': (eta, 1/2, 1 - eta), 'B1': (1/2, 1 - eta, eta - 1), 'F': (1/2, 1/2, 0), 'L': (1/2, 0, 0),
+            'L1': (0, 0, -1/2), 'P': (eta, nu, nu), 'P1': (1 - nu, 1 - nu, 1 - eta), 'P2': (nu, nu, eta - 1),
+            'Q': (1 - nu, nu, 0), 'X': (nu, 0, -nu), 'Z': (1/2, 1/2, 1/2)}
+
+
+def _rhl2(a, b, c, alpha):
+    eta = 1/(2*np.tan(alpha/2)**2)
+    nu = 3/4 - eta/2
+    return {'F': (1/2, -1/2, 0), 'L': (1/2, 0, 0), 'P': (1 - nu, -nu, 1 - nu), 'P1': (nu, nu - 1, nu - 1),
+            'Q': (eta, eta, eta), 'Q1': (1 - eta, -eta, -eta), 'Z': (1/2, -1/2, 1/2)}
+
+
+STANDARD_POINTS = {'BCT1': _bct1, 'BCT2': _bct2, 'ORCF1': _orcf13, 'ORCF2': _orcf2, 'ORCF3': _orcf13,
+                   'ORCI': _orci, 'ORCC': _orcc, 'RHL1': _rhl1, 'RHL2': _rhl2}
+
+
+def holohedry(kvector, tol=1e-6):
+    """
+    Return the Cartesian point-group operations of the lattice spanned by the rows of kvector,
+    as matrices O acting on row vectors (k' = k @ O), shape (N,3,3)
+    """
+    K = crystal.selling_reduce(np.asarray(kvector, dtype=float))
+    M = K @ K.T
+    # a symmetry maps every vector of a reduced basis to a lattice vector of the same length, which has small
+    # coefficients; zero Selling parameters allow equally short vectors with coefficients of 2
+    C = np.array(list(itertools.product(range(-3, 4), repeat=3)), dtype=float)
+    lengths = np.einsum('ni,ij,nj->n', C, M, C)
+    images = [C[np.abs(lengths - M[i, i]) <= tol*M[i, i]] for i in range(3)]
+    R = np.array(list(itertools.product(*images)))
+    R = R[np.abs(np.abs(np.linalg.det(R)) - 1) < 0.5]
+    keep = np.all(np.abs(R @ M @ np.swapaxes(R, 1, 2) - M) <= tol*np.abs(M).max(), axis=(1, 2))
+    return np.linalg.inv(K) @ R[keep] @ K
+
+
+def _candidates(kvector, hs_points, hs_lines_f, tol):
+    # face centres, edge midpoints and vertices of the zone
+    vertices = np.reshape(np.asarray(hs_points, dtype=float), (-1, 3))
+    lines = np.reshape(np.asarray(hs_lines_f, dtype=float), (-1, 8))
+    edges = lines[:, 3:6] + 0.5*(lines[:, 6] + lines[:, 7])[:, np.newaxis]*lines[:, :3]
+
+    G = crystal.voronoi_vectors(crystal.selling_reduce(np.asarray(kvector, dtype=float)))
+    half = 0.5*np.sum(G**2, axis=1)
+    scale = np.sqrt(half.max())
+    on_plane = np.abs(vertices @ G.T - half) <= tol*scale**2
+    faces = []
+    for g in np.flatnonzero(on_plane.sum(axis=0) >= 3):
+        centre = G[g]/2
+        # G/2 is the usual face point; use the vertex centroid when it is not on the face itself
+        if np.any(centre @ G.T - half > tol*scale**2):
+            centre = vertices[on_plane[:, g]].mean(axis=0)
+        faces.append(centre)
+    faces = np.reshape(faces, (-1, 3))
+    points = np.vstack([faces, edges, vertices])
+    kinds = np.array(['face']*len(faces) + ['edge']*len(edges) + ['vertex']*len(vertices))
+    return points, kinds
+
+
+def _classes(points, ops, tol):
+    # index of the class of every point under the operations
+    images = np.einsum('ni,gij->gnj', points, ops)
+    scale = max(np.abs(points).max(), 1e-12)
+    close = np.any(np.linalg.norm(images[:, :, np.newaxis, :] - points[np.newaxis, np.newaxis, :, :], axis=-1)
+                   <= tol*scale, axis=0)
+    classes = np.full(len(points), -1)
+    for i in range(len(points)):
+        if classes[i] < 0:
+            classes[close[i] & (classes < 0)] = classes.max() + 1
+    return classes
+
+
+def _family(n_ops, n_vertices):
+    return {(48, 8): 'cP', (48, 24): 'cF', (48, 14): 'cI', (16, 8): 'tP', (24, 12): 'hP', (8, 8): 'oP'}.get(
+        (n_ops, n_vertices), None)
+
+
+def _standard_cell(n_ops, conventional, centring, tol):
+    # variant name, conventional reciprocal basis in the axis order of Setyawan & Curtarolo and the lattice parameters
+    B = np.asarray(conventional, dtype=float)
+    lengths = np.linalg.norm(2*np.pi*np.linalg.inv(B).T, axis=1)
+    letter = (centring or 'P')[0]
+
+    def close(x, y):
+        return abs(x - y) <= tol*max(abs(x), abs(y))
+
+    if n_ops == 16 and letter == 'I':
+        # the two equal axes first
+        unique = next(i for i in range(3) if close(*np.delete(lengths, i)))
+        perm = [i for i in range(3) if i != unique] + [unique]
+        a, _, c = lengths[perm]
+        return ('BCT1' if c < a else 'BCT2'), B[perm], letter, (a, a, c, None)
+    if n_ops == 8 and letter in 'FI':
+        perm = list(np.argsort(lengths, kind='stable'))
+        a, b, c = lengths[perm]
+        if letter == 'I':
+            return 'ORCI', B[perm], letter, (a, b, c, None)
+        left, right = 1/a**2, 1/b**2 + 1/c**2
+        variant = 'ORCF3' if close(left, right) else ('ORCF1' if left > right else 'ORCF2')
+        return variant, B[perm], letter, (a, b, c, None)
+    if n_ops == 8 and letter in 'CA':
+        # the centred face becomes ab, with a < b
+        centred = [0, 1] if letter == 'C' else [1, 2]
+        perm = sorted(centred, key=lambda i: lengths[i]) + [3 - sum(centred)]
+        a, b, c = lengths[perm]
+        return 'ORCC', B[perm], 'C', (a, b, c, None)
+    if n_ops == 12 and letter == 'R':
+        A = lu.CENTRING_TRANSFORMS['R'] @ (2*np.pi*np.linalg.inv(B).T)
+        alpha = np.arccos(A[0] @ A[1]/(A[0] @ A[0]))
+        a = np.sqrt(A[0] @ A[0])
+        return ('RHL1' if alpha < np.pi/2 else 'RHL2'), B, letter, (a, a, a, alpha)
+    return None
+
+
+def _standard_points(ops, variant, B, letter, parameters, tol):
+    # every point of the paper and its images under the holohedry, in Cartesian coordinates
+    basis = lu.primitive_hkl(letter) @ B
+    labels, points = [], []
+    for label, fractional in STANDARD_POINTS[variant](*parameters).items():
+        images = np.asarray(fractional, dtype=float) @ basis @ ops
+        scale = max(np.abs(images).max(), 1e-12)
+        keep = []
+        for image in images:
+            if all(np.linalg.norm(image - other) > tol*scale for other in keep):
+                keep.append(image)
+        labels += [label]*len(keep)
+        points += keep
+    return {
+        'family': variant,
+        'labelled': True,
+        'labels': np.array([GAMMA] + labels).astype(str),
+        'points': np.vstack([np.zeros((1, 3)), np.reshape(points, (-1, 3))]),
+    }
+
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _special_points(K, bz, tol, conventional=None, centring=None):
+    ops = holohedry(K)
+    if conventional is not None:
+        standard = _standard_cell(len(ops), conventional, centring, tol)
+        if standard is not None:
+            return _standard_points(ops, *standard, tol)
+
+    if bz is None:
+        brillouin_zone = BZ(K)
+        brillouin_zone.bulkBZ()
+        bz = {'hs_points': brillouin_zone.hs_points, 'hs_lines_f': brillouin_zone.hs_lines_f}
+    hs_points, hs_lines_f = bz['hs_points'], bz['hs_lines_f']
+    points, kinds = _candidates(K, hs_points, hs_lines_f, tol)
+    classes = _classes(points, ops, tol)
+    family = _family(len(ops), int(np.sum(kinds == 'vertex')))
+
+    fractional = points @ np.linalg.inv(K)
+    labels = np.empty(len(points), dtype=object)
+    generic = {'face': 'F', 'edge': 'E', 'vertex': 'V'}
+    counters = dict.fromkeys(generic, 0)
+    # generic names are numbered in order of distance from Gamma
+    order = np.argsort([np.linalg.norm(points[classes == c][0]) for c in range(classes.max() + 1)], kind='stable')
+    for c in order:
+        members = np.flatnonzero(classes == c)
+        kind = kinds[members[0]]
+        if family == 'oP':
+            key = (kind, tuple(int(x) for x in np.abs(fractional[members[0]]) > tol))
+        else:
+            key = (kind, len(members))
+        if family is not None:
+            label = FAMILY_LABELS[family].get(key)
+        else:
+            counters[kind] += 1
+            label = f'{generic[kind]}{counters[kind]}'
+        labels[members] = label
+
+    named = np.array([label is not None for label in labels], dtype=bool)
+    return {
+        'family': family,
+        'labelled': family is not None,
+        'labels': np.concatenate([[GAMMA], labels[named]]).astype(str),
+        'points': np.vstack([np.zeros((1, 3)), points[named]]),
+    }
+
+
+def special_points(kvector, bz=None, tol=1e-6, conventional=None, centring=None):
+    """
+    Labelled high-symmetry points of the Brillouin zone of a primitive reciprocal basis
+    Returns a dictionary with the lattice family ('cP', 'cF', 'cI', 'tP', 'oP', 'hP', a variant of
+    STANDARD_POINTS or None), whether the points have standard names ('labelled'), the label of
+    every point and the points themselves in Cartesian coordinates, shape (N,3); every label
+    appears once for each equivalent point of its class
+    Arguments:
+    kvector -- primitive reciprocal basis vectors as rows, in inverse angstroms, as used by BZdrawer.BZ
+    bz -- optional dictionary with the 'hs_points' and 'hs_lines_f' of an already computed zone
+    tol -- relative tolerance of the geometric comparisons
+    conventional -- optional conventional reciprocal basis rows, needed to name the points of centred lattices
+    centring -- centring letter of the conventional cell, see lattice_utils.SG_BRAVAIS_MAP
+    """
+    K = np.asarray(kvector, dtype=float)
+    C = None if conventional is None else np.asarray(conventional, dtype=float)
+    key = (K.round(10).tobytes(), tol, None if C is None else C.round(10).tobytes(), centring)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    result = _special_points(K, bz, tol, C, centring)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def default_path(points):
+    """
+    Return the standard path of the lattice family, or for other lattices a path from Gamma
+    to the centre of every class of face and back.
+    """
+    if points['family'] in PATHS:
+        return PATHS[points['family']]
+    # out to the centre of every kind of face and back
+    faces = [label for label in dict.fromkeys(points['labels'][1:]) if label.startswith('F')]
+    return '-'.join([GAMMA] + [f'{label}-{GAMMA}' for label in faces])
+
+
+def path_nodes(points, path):
+    """
+    Choose the points visited by a path such as 'G-X-M|R-G'
+    Returns a list of continuous pieces, each a list of (label, point) pairs
+    """
+    labels, coords = points['labels'], points['points']
+    # ties between equally close points go to the one with the largest components
+    preference = np.lexsort(-np.round(coords, 8).T[::-1])
+    labels, coords = labels[preference], coords[preference]
+    pieces = []
+    current = np.zeros(3)
+    for piece in path.split('|'):
+        nodes = []
+        for label in piece.split('-'):
+            candidates = coords[labels == label]
+            if not len(candidates):
+                raise ValueError(f'no special point labelled {label} in this zone')
+            distance = np.round(np.linalg.norm(candidates - current, axis=1), 8)
+            current = candidates[np.argmin(distance)]
+            nodes.append((label, current))
+        pieces.append(nodes)
+    return pieces
+
+
+def k_path(kvector, n=200, path=None, basis=None, bz=None, centring=None):
+    """
+    Evenly spaced points along a path through the high-symmetry points
+    Returns a dictionary with the points k in Cartesian coordinates, shape (n,3), their
+    components hkl in basis (defaults to kvector), the distance along the path, and the
+    tick positions and labels of the special points; labels at a jump are joined as 'K|U'
+    Arguments:
+    kvector -- primitive reciprocal basis vectors as rows, in inverse angstroms
+    n -- number of points along the whole path
+    path -- labels joined by '-' and pieces separated by '|', defaults to default_path()
+    basis -- reciprocal basis rows in which hkl are expressed, e.g. the conventional one
+    bz -- optional already computed zone, see special_points()
+    centring -- centring letter of the conventional cell whose reciprocal basis is basis, see special_points()
+    """
+    points = special_points(kvector, bz, conventional=basis, centring=centring)
+    pieces = path_nodes(points, path or default_path(points))
+
+    # arc length at every node; no distance is travelled when jumping from one piece to the next
+    distances, ticks, tick_labels = [], [], []
+    total = 0.
+    for i, piece in enumerate(pieces):
+        nodes = np.array([point for _, point in piece])
+        along = total + np.concatenate([[0.], np.cumsum(np.linalg.norm(np.diff(nodes, axis=0), axis=1))])
+        distances.append(along)
+        total = along[-1]
+        for j, (label, _) in enumerate(piece):
+            if j == 0 and i > 0:
+                tick_labels[-1] += '|' + label
+            else:
+                ticks.append(along[j])
+                tick_labels.append(label)
+
+    s = np.linspace(0, total, n)
+    k = np.empty((n, 3))
+    # each point belongs to the first piece whose end it does not pass
+    piece_of = np.searchsorted([along[-1] for along in distances], s, side='left')
+    for i, (piece, along) in enumerate(zip(pieces, distances)):
+        inside = piece_of == i
+        nodes = np.array([point for _, point in piece])
+        for axis in range(3):
+            k[inside, axis] = np.interp(s[inside], along, nodes[:, axis])
+
+    basis = np.asarray(kvector if basis is None else basis, dtype=float)
+    return {
+        'k': k,
+        'hkl': k @ np.linalg.inv(basis),
+        'distance': s,
+        'ticks': np.array(ticks),
+        'tick_labels': tick_labels,
+        'path': path or default_path(points),
+    }
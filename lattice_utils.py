@@ -1,6 +1,9 @@
 import numpy as np
+import crystal
+import chunking
 """
 A set of utilities for simple calculations involving crystal lattices
+The lattice class and the vector algebra are thin wrappers over the matrix core in crystal
 """
 def check_vecs(V1,V2):
     """
@@ -19,27 +22,12 @@ def gtensor(latt):
     Arguments:
     latt -- is a lattice object
     """
-    g = np.empty([3,3])
-    
-    g[0,0] = latt.a**2
-    g[0,1] = latt.a*latt.b*np.cos(latt.cc)
-    g[0,2] = latt.a*latt.c*np.cos(latt.bb)
-    g[1,0] = g[0,1]
-    g[1,1] = latt.b**2
-    g[1,2] = latt.c*latt.b*np.cos(latt.aa)
-    g[2,0] = g[0,2]
-    g[2,1] = g[1,2]
-    g[2,2] = latt.c**2
-    return g
+    return crystal.metric_tensor(latt.a,latt.b,latt.c,latt.aa,latt.bb,latt.cc)
 def Miller(V,latt):
     """
     Calculates the Miller indicies of a vector given by its fractional coordinates 
     """
-    g = latt.gtensor
-    
-    h = (g[0,0]*V[0] + g[1,0]*V[1] + g[2,0]*V[2])/(2.*np.pi)
-    k = (g[0,1]*V[0] + g[1,1]*V[1] + g[2,1]*V[2])/(2.*np.pi)
-    l = (g[0,2]*V[0] + g[1,2]*V[1] + g[2,2]*V[2])/(2.*np.pi)
+    [h,k,l] = np.tensordot(latt.gtensor,np.asarray(V,dtype=float),axes=1)/(2.*np.pi)
     return [h,k,l]
 def recip_lattice(latt):
     """
@@ -47,26 +35,7 @@ def recip_lattice(latt):
     Arguments:
     latt -- is a lattice object
     """
-    a_vect = np.array([latt.a, 0, 0])
-    b_vect = np.array([latt.b*np.cos(latt.cc), latt.b*np.sin(latt.cc), 0])
-    c_vect =latt.c*np.array([np.cos(latt.bb), 
-			np.sin(latt.bb)*np.cos(latt.aa)*np.sin(latt.cc), 
-			np.sin(latt.aa)*np.sin(latt.bb)])
-   
-    vol = np.sum(a_vect * np.cross(b_vect,c_vect))
-    
-    a_star = 2*np.pi*latt.b*latt.c*np.sin(latt.aa)/vol
-    b_star = 2*np.pi*latt.a*latt.c*np.sin(latt.bb)/vol
-    c_star = 2*np.pi*latt.a*latt.b*np.sin(latt.cc)/vol
-    aa_star = np.arccos((np.cos(latt.bb)*np.cos(latt.cc)-np.cos(latt.aa))/(np.sin(latt.bb)*np.sin(latt.cc)))
-    bb_star = np.arccos((np.cos(latt.aa)*np.cos(latt.cc)-np.cos(latt.bb))/(np.sin(latt.aa)*np.sin(latt.cc)))
-    cc_star = np.arccos((np.cos(latt.aa)*np.cos(latt.bb)-np.cos(latt.cc))/(np.sin(latt.aa)*np.sin(latt.bb)))
-    
-    aa_star = np.rad2deg(aa_star)
-    bb_star = np.rad2deg(bb_star)
-    cc_star = np.rad2deg(cc_star)
-    r_latt = lattice(a_star,b_star,c_star,aa_star,bb_star,cc_star)
-    return r_latt
+    return latt.reciprocal()
 def angle(V1,V2,latt):
     """
     Calculate the angle, in degress, between two vectors defined by miller indicies in the space of the lattice.
@@ -75,22 +44,8 @@ def angle(V1,V2,latt):
     V2 -- miller indicies defining a second vector
     latt -- lattice object, can be either a real space or reciprocal space lattice
     """
-    
-   # if not isinstance(latt_,lattice)
-   #     # some sort of error
-    #V1,V2 = check_vecs(V1,V2) 
-    a_vect = np.array([latt.a, 0, 0])
-    b_vect = np.array([latt.b*np.cos(latt.cc), latt.b*np.sin(latt.cc), 0])
-    c_vect =latt.c*np.array([np.cos(latt.bb), 
-			np.sin(latt.bb)*np.cos(latt.aa)*np.sin(latt.cc), 
-			np.sin(latt.aa)*np.sin(latt.bb)])
-    vect1 = a_vect[:,np.newaxis]*V1[0] + b_vect[:,np.newaxis]*V1[1] + c_vect[:,np.newaxis]*V1[2]
-    vect2 = a_vect[:,np.newaxis]*V2[0] + b_vect[:,np.newaxis]*V2[1] + c_vect[:,np.newaxis]*V2[2]
-    nrmV1 = np.sqrt(np.sum(vect1**2))
-    nrmV2 = np.sqrt(np.sum(vect2**2))
-    # exploit broadcasting to deal with V1 and V2 of different sizes
-    angle = np.rad2deg(np.arccos((vect1[0]*vect2[0]+vect1[1]*vect2[1]+vect1[2]*vect2[2])/(nrmV1*nrmV2)))
-    return angle
+    # components are on the first axis here and on the last axis in the core
+    return latt.angle(np.moveaxis(np.asarray(V1),0,-1),np.moveaxis(np.asarray(V2),0,-1))
 def angle2(V1,V2,lattice):
     """
     Calculate the angle, in radian, between two vectors in real space and in reciprocal space.
@@ -102,7 +57,8 @@ def angle2(V1,V2,lattice):
     lattice -- lattice object, defines a real space lattice
     """
     rlatt = recip_lattice(lattice)
-    phi = np.arccos((2*np.pi*(V1[0]*V2[0]+V1[1]*V2[1]+V1[2]*V2[2]))/modVec(V1,lattice)/modVec(V2,rlatt))
+    cos = (2*np.pi*(V1[0]*V2[0]+V1[1]*V2[1]+V1[2]*V2[2]))/modVec(V1,lattice)/modVec(V2,rlatt)
+    phi = np.arccos(np.clip(cos,-1,1))
     
     return phi
 def scalar(V1,V2,latt):
@@ -113,17 +69,7 @@ def scalar(V1,V2,latt):
     V2 -- miller indicies defining a second vector
     latt -- lattice object, can be either a real space or reciprocal space lattice
     """
-    # calculate the scalar product of two vectors defined by their Miller indicies
-    [x1,y1,z1] = V1
-    [x2,y2,z2] = V2
-    #(latt.cc,latt.bb,latt.aa)
-    s1 = x1*x2*latt.a**2 + y1*y2*latt.b**2 + z1*z2*latt.c**2
-    s2 = (x1*y2 + x2* y1) * latt.a *latt.b*np.cos(latt.cc)
-    s3 = (x1*z2 + x2* z1) * latt.a *latt.c*np.cos(latt.bb)
-    s4 = (z1*y2 + z2* y1) * latt.c *latt.b*np.cos(latt.aa)
-    s = s1+s2+s3+s4
-    
-    return s    
+    return latt.dot(np.moveaxis(np.asarray(V1),0,-1),np.moveaxis(np.asarray(V2),0,-1))
 def vector(V1,V2,latt):
     """
     Calculates the vector product of two vectors defined by their Miller indicies
@@ -147,8 +93,7 @@ def modVec(V1,latt):
     V1 -- Miller indicies defining a vector
     latt -- lattice object, can be either a real of reciprocal space lattice
     """
-    mod = np.sqrt(scalar(V1,V1,latt))
-    return mod
+    return latt.norm(np.moveaxis(np.asarray(V1),0,-1))
 def dspacing(V1,r_latt):
     """
     Calculates the d spacing corresponding to a given set of Miller indicies
@@ -159,32 +104,180 @@ def dspacing(V1,r_latt):
     d = 2*np.pi/modVec(V1,r_latt)
     return d
 def basis_vectors(latt):
-    a = latt.a
-    b = latt.b
-    c = latt.c
-    alpha = latt.aa
-    beta = latt.bb
-    gamma = latt.cc
+    """
+    Returns the Cartesian basis vectors of the lattice as rows, a along x and b in the xy plane
+    """
+    return latt.A.copy()
+def centring_allowed(hkl,centring='P'):
+    """
+    Returns a boolean mask of the reflections allowed by the lattice centring
+    Arguments:
+    hkl -- array of Miller indicies with shape (N,3)
+    centring -- centring letter, one of P, A, B, C, I, F, R (the cubic variants Fc and Ic are accepted)
+    """
+    hkl = np.asarray(hkl)
+    h,k,l = hkl[...,0],hkl[...,1],hkl[...,2]
+    centring = centring[0] if centring else 'P'
+    if centring == 'A':
+        return (k+l) % 2 == 0
+    if centring == 'B':
+        return (h+l) % 2 == 0
+    if centring == 'C':
+        return (h+k) % 2 == 0
+    if centring == 'I':
+        return (h+k+l) % 2 == 0
+    if centring == 'F':
+        return ((h+k) % 2 == 0) & ((k+l) % 2 == 0)
+    if centring == 'R':
+        # obverse setting of the hexagonal cell
+        return (-h+k+l) % 3 == 0
+    return np.ones(h.shape,dtype=bool)
+def hkl_list(latt,q_max,centring='P',include_origin=False,dtype=np.float64,budget=None):
+    """
+    Enumerates all Miller indicies with |Q| <= q_max
+    Returns an integer array of shape (N,3) and the corresponding |Q| in inverse angstroms
+    Arguments:
+    latt -- real space lattice object
+    q_max -- largest momentum transfer, in inverse angstroms
+    centring -- centring letter used to remove systematically absent reflections
+    include_origin -- keep the (0,0,0) reflection
+    dtype -- floating point type of the returned |Q|
+    budget -- memory budget in bytes for the temporaries of each block of h, see chunking
+    """
+    rlatt = recip_lattice(latt)
+    # h = Q.a/2pi, so |h| can never exceed |Q||a|/2pi
+    h_max = int(np.floor(q_max*latt.a/(2*np.pi)))
+    k_max = int(np.floor(q_max*latt.b/(2*np.pi)))
+    l_max = int(np.floor(q_max*latt.c/(2*np.pi)))
+    h_all = np.arange(-h_max,h_max+1)
+    k_all = np.arange(-k_max,k_max+1)
+    l_all = np.arange(-l_max,l_max+1)
 
-    va = np.array([a, 0, 0])
-    vb = np.array([b * np.cos(gamma), b * np.sin(gamma), 0])
-    
-    cx = c * np.cos(beta)
-    cy = c * (np.cos(alpha) - np.cos(beta) * np.cos(gamma)) / np.sin(gamma)
-    cz = np.sqrt(c**2 - cx**2 - cy**2)
-    vc = np.array([cx, cy, cz])
+    # only one slab of h values is expanded to a full box at a time
+    hkl_out,modQ_out = [],[]
+    for rows in chunking.chunks(h_all.size,k_all.size*l_all.size*96,budget):
+        h,k,l = np.meshgrid(h_all[rows],k_all,l_all,indexing='ij')
+        hkl = np.stack([h.ravel(),k.ravel(),l.ravel()],axis=1)
+        modQ = modVec(hkl.T,rlatt)
+        keep = (modQ <= q_max) & centring_allowed(hkl,centring)
+        if not include_origin:
+            keep &= np.any(hkl != 0,axis=1)
+        hkl_out.append(hkl[keep])
+        modQ_out.append(modQ[keep].astype(dtype))
+    return np.concatenate(hkl_out),np.concatenate(modQ_out)
+# Initialize everything to "P"
+SG_BRAVAIS_MAP = {i: "P" for i in range(1, 231)}
 
-    return np.array([va, vb, vc])
-class lattice:
+# Overwrite with exceptions
+_overrides = {
+    5: "C", 8: "C", 9: "C", 12: "C", 15: "C", 20: "C", 21: "C",
+    22: "F",
+    23: "I", 24: "I",
+    35: "C", 36: "C", 37: "C",
+    38: "A", 39: "A", 40: "A", 41: "A",
+    42: "F", 43: "F",
+    44: "I", 45: "I", 46: "I",
+    63: "C", 64: "C", 65: "C", 66: "C", 67: "C", 68: "C",
+    69: "F", 70: "F",
+    71: "I", 72: "I", 73: "I", 74: "I",
+    79: "I", 80: "I",
+    82: "I",
+    87: "I", 88: "I",
+    97: "I", 98: "I",
+    107: "I", 108: "I", 109: "I", 110: "I",
+    119: "I", 120: "I", 121: "I", 122: "I",
+    139: "I", 140: "I", 141: "I", 142: "I",
+    146: "R",
+    148: "R",
+    155: "R",
+    160: "R", 161: "R",
+    166: "R", 167: "R",
+    196: "Fc",
+    197: "Ic",
+    199: "Ic",
+    202: "Fc", 203: "Fc",
+    204: "Ic",
+    206: "Ic",
+    209: "Fc", 210: "Fc",
+    211: "Ic",
+    214: "Ic",
+    216: "Fc",
+    217: "Ic",
+    219: "Fc",
+    220: "Ic",
+    225: "Fc", 226: "Fc", 227: "Fc", 228: "Fc",
+    229: "Ic", 230: "Ic"
+}
+
+# Apply overrides
+SG_BRAVAIS_MAP.update(_overrides)
+
+# Primitive cells of the centred lattices: rows are the primitive direct basis vectors in units of the
+# conventional ones, with exact rational entries. The primitive reciprocal basis is inv(T).T applied to the
+# conventional one, whose rows are then integer hkl allowed by centring_allowed.
+# BZdrawer reduces the resulting primitive basis before building the zone
+CENTRING_TRANSFORMS = {
+    "C": np.array([
+        [0.5, -0.5, 0],
+        [0.5,  0.5, 0],
+        [0.0,  0.0, 1]
+    ]),
+    "A": np.array([
+        [1, 0, 0],
+        [0, 0.5, -0.5],
+        [0, 0.5, 0.5]
+    ]),
+    "F": np.array([
+        [0, 0.5, 0.5],
+        [0.5, 0, 0.5],
+        [0.5, 0.5, 0]
+    ]),
+    "I": np.array([
+        [-0.5, 0.5, 0.5],
+        [0.5, -0.5, 0.5],
+        [0.5, 0.5, -0.5]
+    ]),
+    # obverse setting of the hexagonal cell, as in centring_allowed
+    "R": np.array([
+        [2, 1, 1],
+        [-1, 1, 1],
+        [-1, -2, 1]
+    ])/3,
+    "Fc": np.array([
+        [0, 0.5, 0.5],
+        [0.5, 0, 0.5],
+        [0.5, 0.5, 0]
+    ]),
+    "Ic": np.array([
+        [-0.5, 0.5, 0.5],
+        [0.5, -0.5, 0.5],
+        [0.5, 0.5, -0.5]
+    ]),
+}
+def primitive_hkl(bravais_type):
+    """
+    Returns the primitive reciprocal basis of a centring type as integer rows of Miller indicies
+    of the conventional cell, the identity for primitive lattices
+    Arguments:
+    bravais_type -- centring type from SG_BRAVAIS_MAP
+    """
+    T = CENTRING_TRANSFORMS.get(bravais_type)
+    if T is None:
+        return np.eye(3,dtype=int)
+    return np.rint(np.linalg.inv(T).T).astype(int)
+def primitive_kvector(kvector,bravais_type):
+    """
+    Returns the primitive reciprocal basis (rows) used to build the Brillouin zone
+    Arguments:
+    kvector -- conventional reciprocal basis vectors as rows, in Cartesian coordinates
+    bravais_type -- centring type from SG_BRAVAIS_MAP
+    """
+    return primitive_hkl(bravais_type) @ np.asarray(kvector,dtype=float)
+class lattice(crystal.Cell):
     def __init__(self,a=1.,b=1.,c=1.,aa=90.,bb=90.,cc=90.):
-        self.a = a
-        self.b = b
-        self.c = c
-        self.aa = np.deg2rad(aa)
-        self.bb = np.deg2rad(bb)
-        self.cc = np.deg2rad(cc)
+        crystal.Cell.__init__(self,a,b,c,aa,bb,cc)
         self.lvec = [a,b,c,np.deg2rad(aa),np.deg2rad(bb),np.deg2rad(cc)]
-        self.gtensor = gtensor(self)
+        self.gtensor = self.G
     def __str__(self):
         out1 = '\ta = {0:.4f}, b = {1:.4f}, c = {2:.4f} \n'.format(self.a,self.b,self.c)
         out2 = '\talpha = {0:.3f},  beta = {1:.3f}, gamma = {2:.3f} \n'.format(self.aa,self.bb,self.cc)
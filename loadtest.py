@@ -0,0 +1,250 @@
+"""
+Load generator and latency report for the /calculate endpoint.
+
+Requests are drawn from a realistic mix: every centring type of
+SG_BRAVAIS_MAP is equally likely, the space group is picked among those of
+that type and the cell parameters follow its crystal system, with varying
+scattering planes, wavelengths and theta-cut angles. Requests are sent by a
+pool of threads, optionally paced to a fixed rate, and the report gives
+throughput, error rate and p50/p95/p99 latencies overall and per centring
+type. Requests with their outcomes can be recorded to JSONL and replayed.
+
+Examples:
+    python loadtest.py --serve --requests 500 --concurrency 8
+    python loadtest.py --url http://127.0.0.1:5000/calculate --rate 20 --duration 60 --record run.jsonl
+    python loadtest.py --serve --replay run.jsonl --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import lattice_utils as lu
+
+PERCENTILES = (50, 95, 99)
+
+SPACE_GROUPS_BY_CENTRING = {}
+for _space_group, _centring in lu.SG_BRAVAIS_MAP.items():
+    SPACE_GROUPS_BY_CENTRING.setdefault(_centring, []).append(_space_group)
+
+
+def _crystal_system(space_group):
+    for last, system in ((2, 'triclinic'), (15, 'monoclinic'), (74, 'orthorhombic'), (142, 'tetragonal'),
+                         (167, 'trigonal'), (194, 'hexagonal'), (230, 'cubic')):
+        if space_group <= last:
+            return system
+
+
+def _cell(rng, system):
+    a, b, c = (round(rng.uniform(3., 12.), 3) for _ in range(3))
+    if system == 'triclinic':
+        return a, b, c, round(rng.uniform(70, 110), 2), round(rng.uniform(70, 110), 2), round(rng.uniform(70, 110), 2)
+    if system == 'monoclinic':
+        return a, b, c, 90., round(rng.uniform(92, 120), 2), 90.
+    if system == 'orthorhombic':
+        return a, b, c, 90., 90., 90.
+    if system == 'tetragonal':
+        return a, a, c, 90., 90., 90.
+    if system in ('trigonal', 'hexagonal'):
+        return a, a, c, 90., 90., 120.
+    return a, a, a, 90., 90., 90.
+
+
+def _plane(rng):
+    # two non-parallel small integer vectors
+    while True:
+        u, v = ([rng.randint(-2, 2) for _ in range(3)] for _ in range(2))
+        if np.linalg.norm(np.cross(u, v)) > 0:
+            return u, v
+
+
+def random_request(rng):
+    """
+    Draw one /calculate request body from the mix, returned with its centring type.
+    """
+    centring = rng.choice(sorted(SPACE_GROUPS_BY_CENTRING))
+    space_group = rng.choice(SPACE_GROUPS_BY_CENTRING[centring])
+    cell = _cell(rng, _crystal_system(space_group))
+    u, v = _plane(rng)
+    r, w = _plane(rng)
+    body = {'space_group': str(space_group), 'param7': str(round(rng.uniform(1., 5.), 3)),
+            'u': u, 'v': v, 'r': r, 'w': w,
+            'two_theta': sorted(rng.sample(range(20, 141, 5), rng.randint(1, 4)))}
+    body.update({f'param{i + 1}': str(value) for i, value in enumerate(cell)})
+    return body, centring
+
+
+def send(url, body, timeout=60.):
+    """
+    POST one request and return (status, latency in seconds, error message or None).
+    """
+    data = json.dumps(body).encode()
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status, error = response.status, None
+    except urllib.error.HTTPError as exc:
+        status, error = exc.code, exc.reason
+    except (urllib.error.URLError, OSError) as exc:
+        status, error = 0, str(exc)
+    return status, time.perf_counter() - start, error
+
+
+def run(url, requests, concurrency=4, rate=None, duration=None, timeout=60., record=None):
+    """
+    Send (body, centring) pairs from an iterable and return one result dictionary per request.
+    With a rate, request i is not sent before i/rate seconds after the start; with a duration,
+    no request is started after it has elapsed.
+    """
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def one(i, body, centring):
+        if rate:
+            time.sleep(max(0., start + i/rate - time.perf_counter()))
+        if duration is not None and time.perf_counter() - start > duration:
+            return
+        status, latency, error = send(url, body, timeout)
+        result = {'request': body, 'centring': centring, 'status': status, 'latency': latency,
+                  'error': error, 'time': time.time()}
+        with lock:
+            results.append(result)
+            if record is not None:
+                record.write(json.dumps(result) + '\n')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # submit in bounded batches so that an unbounded request stream is never materialised
+        pending = []
+        for i, (body, centring) in enumerate(requests):
+            if duration is not None and time.perf_counter() - start > duration:
+                break
+            pending.append(pool.submit(one, i, body, centring))
+            if len(pending) >= 4*concurrency:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    """
+    Summarize results as throughput, error rate and latency percentiles, overall and per centring type.
+    """
+    def summary(subset):
+        latency = np.array([r['latency'] for r in subset if r['status'] == 200])
+        errors = sum(r['status'] != 200 for r in subset)
+        out = {'requests': len(subset), 'errors': errors, 'error_rate': errors/len(subset) if subset else 0.}
+        if latency.size:
+            out.update({f'p{p}': float(np.percentile(latency, p)) for p in PERCENTILES})
+            out['max'] = float(latency.max())
+        return out
+
+    overall = summary(results)
+    overall['elapsed'] = elapsed
+    overall['throughput'] = len(results)/elapsed if elapsed > 0 else 0.
+    by_type = {}
+    for result in results:
+        by_type.setdefault(result['centring'], []).append(result)
+    return {'overall': overall, 'by_centring': {key: summary(value) for key, value in sorted(by_type.items())}}
+
+
+def _print_report(summary):
+    overall = summary['overall']
+    print(f"{overall['requests']} requests in {overall['elapsed']:.1f} s, {overall['throughput']:.1f} req/s, "
+          f"{overall['errors']} errors ({100*overall['error_rate']:.2f}%)")
+    print('latency in ms')
+    print(f"{'':>8} {'n':>6} {'err':>5}" + ''.join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'max':>9}")
+    for name, row in [('all', overall)] + list(summary['by_centring'].items()):
+        cells = ''.join(f"{1000*row[key]:9.1f}" if key in row else f"{'-':>9}"
+                        for key in [f'p{p}' for p in PERCENTILES] + ['max'])
+        print(f"{name:>8} {row['requests']:>6} {row['errors']:>5}{cells}")
+
+
+def _generated(seed, count):
+    rng = random.Random(seed)
+    i = 0
+    while count is None or i < count:
+        yield random_request(rng)
+        i += 1
+
+
+def _replayed(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['request'], entry.get('centring', '?')
+
+
+def _serve(port):
+    # the app in a child process, without the debug reloader
+    server = subprocess.Popen([sys.executable, '-c',
+                               f'from app import app; app.run(port={port}, threaded=True)'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return server
+        except (urllib.error.URLError, OSError):
+            if server.poll() is not None:
+                raise SystemExit('the server exited during start-up')
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('the server did not start within 30 s')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--url', default=None, help='endpoint, defaults to /calculate of the local server')
+    parser.add_argument('--serve', action='store_true', help='start the app locally for the test')
+    parser.add_argument('--port', type=int, default=5057, help='port of the server started with --serve')
+    parser.add_argument('--requests', type=int, default=None, help='number of generated requests')
+    parser.add_argument('--duration', type=float, default=None, help='stop starting requests after this many seconds')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    parser.add_argument('--rate', type=float, default=None, help='requests per second, default as fast as possible')
+    parser.add_argument('--timeout', type=float, default=60., help='timeout of one request in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the request mix')
+    parser.add_argument('--record', default=None, help='write every request and its outcome to this JSONL file')
+    parser.add_argument('--replay', default=None, help='send the requests of a recorded JSONL file instead')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None and args.replay is None:
+        args.requests = 200
+
+    server = _serve(args.port) if args.serve else None
+    url = args.url or f'http://127.0.0.1:{args.port if args.serve else 5000}/calculate'
+    record = open(args.record, 'w') if args.record else None
+    try:
+        requests = _replayed(args.replay) if args.replay else _generated(args.seed, args.requests)
+        results, elapsed = run(url, requests, args.concurrency, args.rate, args.duration, args.timeout, record)
+    finally:
+        if record is not None:
+            record.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = report(results, elapsed)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        _print_report(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,104 @@
 import numpy as np
 from math import pi,asin,sin
 import lattice_utils as lu
+import chunking
+import sampling
 import matplotlib.pyplot as plt
 from math import pi,asin,sin, cos
 # from mpl_toolkits.axes_grid.grid_helper_curvelinear import GridHelperCurveLinear
 # from mpl_toolkits.axes_grid.axislines import Subplot
 
-def dynamic_range(Efixed,E,E_max,theta_range = [10,120],step = 10, color = 'k',showplot = True):
+def _wavevectors(Efixed,E,E_T):
+    # incident and final wavevectors with a mask of the energy transfers that are kinematically allowed
+    E_T = np.asarray(E_T,dtype=float)
+    if Efixed == "Ef":
+        Ei,Ef = E_T + E,np.full_like(E_T,E)
+    elif Efixed == "Ei":
+        Ei,Ef = np.full_like(E_T,E),E - E_T
+    else:
+        raise ValueError('Efixed must be "Ei" or "Ef"')
+    valid = (Ei > 0) & (Ef > 0)
+    ki = np.sqrt(np.maximum(Ei,0)/2.072)
+    kf = np.sqrt(np.maximum(Ef,0)/2.072)
+    return ki,kf,valid
+
+def dynamic_range(Efixed,E,E_max,theta_range = [10,120],step = 10, color = 'k',showplot = True,tolerance = None):
     #modify to allow fixed Ef or fixed Ei, and input of scattering
     #angles
-    omega = np.linspace(0,E_max,100)
     theta_s = np.arange(theta_range[0]*np.pi/180,theta_range[1]*np.pi/180,step*np.pi/180)
-    Q = []
+    if tolerance is not None:
+        return _dynamic_range_adaptive(Efixed,E,E_max,theta_s,tolerance)
+    omega = np.linspace(0,E_max,100)
 
-    if Efixed == "Ef":
-        kf = np.sqrt(E / 2.072)
-        ki = np.sqrt((omega + E) / 2.072)
-    elif Efixed == "Ei":
-        ki = np.sqrt(E / 2.072)
-        kf = np.sqrt((E - omega) / 2.072)
+    ki,kf,valid = _wavevectors(Efixed,E,omega)
+    Q = np.sqrt(ki**2 + kf**2 - 2*ki*kf*np.cos(theta_s)[:,np.newaxis])
+    valid = np.broadcast_to(valid,Q.shape)
 
-    for i, theta in enumerate(theta_s):
-        Q_row = np.sqrt(ki ** 2 + kf ** 2 - 2 * ki * kf * np.cos(theta))
-        Q.append(Q_row.tolist())
-    
+    # unreachable energy transfers (Ei < omega) are returned as null
     return {
         "theta_angles": theta_s.tolist(),
         "omega": omega.tolist(),
-        "Q": Q
+        "Q": np.where(valid,Q,None).tolist(),
+        "valid": valid.tolist()
     }
 
-def spec_twoTheta(Efixed,E,E_T,Q):
-    
-    if Efixed == "Ef": 
-        kf = np.sqrt((E)/2.072)
-        ki = np.sqrt((E_T+E)/2.072)
-    elif Efixed =="Ei":
-        ki = np.sqrt((E)/2.072)
-        kf = np.sqrt((E-E_T)/2.072)
-    theta =np.arccos(-(Q**2 - ki**2 - kf**2)/ki/kf/2.)
+def _dynamic_range_adaptive(Efixed,E,E_max,theta_s,tolerance):
+    # every boundary gets its own omega axis, refined where Q(omega) bends, e.g. close to Ef = 0
+    omegas,Qs,valids = [],[],[]
+    for theta in theta_s:
+        def boundary(omega):
+            ki,kf,valid = _wavevectors(Efixed,E,omega)
+            Q = np.sqrt(ki**2 + kf**2 - 2*ki*kf*np.cos(theta))
+            return np.stack([np.where(valid,Q,np.nan),omega],axis=-1)
+        omega,points = sampling.adaptive_sample(boundary,0,E_max,tolerance)
+        valid = ~np.isnan(points[:,0])
+        omegas.append(omega.tolist())
+        Qs.append(np.where(valid,points[:,0],None).tolist())
+        valids.append(valid.tolist())
+    return {
+        "theta_angles": theta_s.tolist(),
+        "omega": omegas,
+        "Q": Qs,
+        "valid": valids
+    }
+
+def dynamic_range_grid(Efixed,E,omega,tth,dtype=np.float64,budget=None,out=None):
+    """
+    Momentum transfer on a dense (scattering angle, energy transfer) grid
+    Returns an array of shape (len(tth), len(omega)) with NaN where the energy transfer is forbidden
+    Arguments:
+    Efixed -- "Ei" or "Ef"
+    E -- the fixed energy, in meV
+    omega -- energy transfers, in meV
+    tth -- scattering angles, in degrees
+    dtype -- floating point type of the computation and of the result, e.g. np.float32
+    budget -- memory budget in bytes for the temporaries of each block of rows, see chunking
+    out -- optional output array, or a path for a memory-mapped .npy result
+    """
+    ki,kf,valid = _wavevectors(Efixed,E,omega)
+    ki2 = (ki**2).astype(dtype)
+    kf2 = (kf**2).astype(dtype)
+    kikf = (2*ki*kf).astype(dtype)
+    cos_tth = np.cos(np.deg2rad(np.asarray(tth,dtype=float))).astype(dtype)
+
+    Q = chunking.empty((cos_tth.size,kikf.size),dtype,out)
+    for rows in chunking.chunks(cos_tth.size,4*kikf.size*np.dtype(dtype).itemsize,budget):
+        Q[rows] = np.where(valid,np.sqrt(ki2 + kf2 - kikf*cos_tth[rows,np.newaxis]),np.nan)
+    return Q
+
+def spec_twoTheta(Efixed,E,E_T,Q,return_mask=False):
+    """
+    Scattering angle, in degrees, needed to reach momentum transfer Q at energy transfer E_T
+    Unreachable points are NaN; with return_mask=True a boolean mask of the reachable points is also returned
+    """
+    ki,kf,valid = _wavevectors(Efixed,E,E_T)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        cos_tth = -(np.asarray(Q)**2 - ki**2 - kf**2)/ki/kf/2.
+    valid = valid & (np.abs(cos_tth) <= 1)
+    theta = np.where(valid,np.arccos(np.clip(cos_tth,-1,1)),np.nan)
     
+    if return_mask:
+        return theta*180./np.pi,valid
     return theta*180./np.pi
 
 def Bragg_angle(wavelength,q,rlatt):
@@ -58,6 +117,40 @@ def TOF_par(q,tth,rlatt):
     print('Q = [{:.2f} {:.2f} {:.2f}]\n d = {:.3f} \n Two-theta = {:.2f}\n wavelength = {:.3f} Angstrom\n Energy = {:3f} meV\n Velocity = {:3f} m/s'.format(q[0],q[1],q[2],d,tth,wavelength,E,velocity)) 
     
     return d,wavelength,E,velocity
+TOF_dtype = np.dtype([('hkl',int,(3,)),('two_theta',float),('L',float),('d',float),
+                      ('wavelength',float),('energy',float),('velocity',float),('tof',float),('valid',bool)])
+def TOF_table(q,tth,L,rlatt):
+    """
+    Time-of-flight parameters for many reflections seen by many detector banks
+    Returns a structured array of shape (len(q), len(tth)) with fields hkl, two_theta,
+    L, d (angstrom), wavelength (angstrom), energy (meV), velocity (m/s), tof (microseconds)
+    and valid, which is False for banks at 2theta = 0 where no time-of-flight is defined
+    Arguments:
+    q -- Miller indicies of the reflections, shape (N,3)
+    tth -- scattering angle of every detector bank, in degrees
+    L -- total flight path (moderator-sample-detector) of every bank, in metres
+    rlatt -- reciprocal space lattice object
+    """
+    q = np.atleast_2d(q)
+    tth = np.atleast_1d(np.asarray(tth,dtype=float))
+    L = np.broadcast_to(np.asarray(L,dtype=float),tth.shape)
+
+    d = lu.dspacing(q.T,rlatt)[:,np.newaxis]
+    wavelength = 2*d*np.sin(np.deg2rad(tth)/2)
+
+    out = np.empty((q.shape[0],tth.size),dtype=TOF_dtype)
+    out['hkl'] = q[:,np.newaxis,:]
+    out['two_theta'] = tth
+    out['L'] = L
+    out['d'] = d
+    out['wavelength'] = wavelength
+    with np.errstate(divide='ignore'):
+        velocity = 629.62*2*pi/wavelength # m/s
+        out['energy'] = (9.044/wavelength)**2
+        out['velocity'] = velocity
+        out['tof'] = 1e6*L/velocity
+    out['valid'] = wavelength > 0
+    return out
 def Recip_space(sample):
     """
     Set up general reciprocal space grid for plotting Miller indicies in a general space.
@@ -87,28 +180,22 @@ def calcQ(lattice, tth, th, wl=5, u=[1, 0, 0], v=[0, 0, 1]):
     lattice - a lattice object
     tth - scattering angle, in degrees
     th - sample angle, defined such that theta =0 when u is along ki
+    tth and th may be arrays, in which case modQ and alpha are arrays
     wl - wavelength in angstroms
     u - reciprocal lattice vector in scattering plane, theta is 0 when u is along ki
     v - second reciprocal lattice vector in scattering plane
     '''
-    modQ = 4*pi/wl*sin(tth/360*pi)
-    alpha = (180 - tth)/2 + th
+    tth = np.asarray(tth,dtype=float)
+    modQ = 4*pi/wl*np.sin(tth/360*pi)
+    alpha = (180 - tth)/2 + np.asarray(th,dtype=float)
     rlatt = lu.recip_lattice(lattice)
-    u = np.array(u)
-    v = np.array(v)
+    u = np.array(u,dtype=float)
+    v = np.array(v,dtype=float)
 
-    modu = lu.modVec(u, rlatt)
-    modv = lu.modVec(v, rlatt)
     # create cartesian coordinate system from reciprocal lattice vectors
-    X = u/modu
-    proj = lu.scalar(v,X,rlatt)
-    Y = v - X*proj
-    modY = lu.modVec(Y, rlatt)
-    Y = Y/modY
-    qx = modQ*cos(alpha/180*pi)*X
-    qy = modQ*sin(alpha/180*pi)*Y
-    Q = qx + qy
-    #print(tth,th,wl,np.round(Q,2))
+    X = u/rlatt.norm(u)
+    Y = v - X*rlatt.dot(v,X)
+    Y = Y/rlatt.norm(Y)
     return modQ, alpha, X, Y
 
 def Al_peaks(wavelength = 1.0):
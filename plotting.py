@@ -1,27 +1,41 @@
 import lattice_utils as lu
 import numpy as np
 import planning as pla
+import resolution as res
+import sampling
 from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 from math import pi,asin,sin, cos
 import matplotlib.gridspec as gridspec
 from matplotlib.ticker import MultipleLocator,StrMethodFormatter
 
-def get_theta_cut_plot_data(u, v, lat, rlat, wl, two_theta):
+def get_theta_cut_plot_data(u, v, lat, rlat, wl, two_theta, tolerance=None):
+    """
+    Build Plotly traces of the elastic theta cuts at each scattering angle
+    With a tolerance, theta is sampled adaptively so that every curve is followed to within that
+    fraction of the extent of the plot, the largest |Q| of all cuts along u and v, otherwise on a
+    fixed 5 degree grid. Cuts below 2theta = 10 have no more than the single point of the fixed grid.
+    """
     plot_data = {"traces": [], "layout": {}}
     colors = ['maroon', 'blue', 'black']
     modu = lu.modVec(u, rlat)
     modv = lu.modVec(v, rlat)
+    # one absolute scale for all cuts, so that small and large cuts are followed equally closely
+    q_max = 4*np.pi/wl*np.sin(np.deg2rad(min(max(two_theta, default=0.), 180.))/2)
+    scale = np.array([q_max/modu, q_max/modv])
 
     for j, tth in enumerate(two_theta):
-        th = np.arange(5,tth-5+1,5)
-        x_vals = []
-        y_vals = []
-        
-        for n in th:
-            modQ, angle, X, Y = pla.calcQ(lat, tth, n, wl=wl, u=u, v=v)
-            x_vals.append(float(modQ * cos(angle / 180 * pi) / modu))
-            y_vals.append(float(modQ * sin(angle / 180 * pi) / modv))
+        def cut(th):
+            modQ, angle, X, Y = pla.calcQ(lat, tth, th, wl=wl, u=u, v=v)
+            return np.stack([modQ * np.cos(np.deg2rad(angle)) / modu,
+                             modQ * np.sin(np.deg2rad(angle)) / modv], axis=-1)
+
+        if tolerance is None or tth - 5 <= 5:
+            points = cut(np.arange(5,tth-5+1,5))
+        else:
+            _, points = sampling.adaptive_sample(cut, 5, tth-5, tolerance, initial=5, scale=scale)
+        x_vals = points[:, 0].tolist()
+        y_vals = points[:, 1].tolist()
         
 
         trace = {
@@ -44,4 +58,53 @@ def get_theta_cut_plot_data(u, v, lat, rlat, wl, two_theta):
         "hovermode": False,
     }
               
-    return plot_data
\ No newline at end of file
+    return plot_data
+
+def get_coverage_plot_data(u, v, coverage):
+    """
+    Build Plotly traces for a coverage map from coverage.coverage_map
+    """
+    peaks = coverage["peaks"]
+    heatmap = {
+        "type": "heatmap",
+        "x": coverage["x"].tolist(),
+        "y": coverage["y"].tolist(),
+        "z": coverage["mask"].astype(np.uint8).tolist(),
+        "colorscale": [[0, "white"], [1, "lightsteelblue"]],
+        "showscale": False,
+        "name": "coverage",
+    }
+    bragg = {
+        "type": "scatter",
+        "x": peaks["x"].tolist(),
+        "y": peaks["y"].tolist(),
+        "mode": "markers",
+        "marker": {"color": np.where(peaks["accessible"], "maroon", "gray").tolist(), "size": 6},
+        "text": [f"({h} {k} {l})" for h, k, l in peaks["hkl"].tolist()],
+        "name": "Bragg peaks",
+    }
+
+    layout = {
+        "xaxis": {"title": f"{u} (r.l.u.)"},
+        "yaxis": {"title": f"{v} (r.l.u.)", "scaleanchor": "x"},
+        "title": "Reciprocal Space Coverage",
+        "hovermode": "closest",
+    }
+    return {"traces": [heatmap, bragg], "layout": layout}
+
+def get_resolution_trace(x, y, ellipses, color="gray", name="resolution"):
+    """
+    Build a single Plotly trace outlining the in-plane resolution ellipses from resolution.plane_resolution
+    """
+    xs, ys = res.ellipse_outline(x, y, ellipses["ellipse"])
+    xs = xs[ellipses["valid"]]
+    ys = ys[ellipses["valid"]]
+    # outlines are separated by gaps so that one trace draws all of them
+    gap = np.full((xs.shape[0], 1), None)
+    return {
+        "x": np.hstack([xs, gap]).ravel().tolist(),
+        "y": np.hstack([ys, gap]).ravel().tolist(),
+        "mode": "lines",
+        "line": {"color": color, "width": 1},
+        "name": name,
+    }
@@ -0,0 +1,185 @@
+"""
+Powder diffraction patterns for arbitrary lattices.
+
+Reflections are enumerated with lattice_utils.hkl_list, merged into powder
+lines with their multiplicities, and each line is spread onto the 2theta or
+d grid only over a window of a few FWHM around its centre, never as a
+full-length profile.
+"""
+
+import numpy as np
+import lattice_utils as lu
+
+
+def caglioti(U=0.01, V=-0.01, W=0.02):
+    """
+    Returns the Caglioti resolution function FWHM(2theta), both in degrees
+    FWHM^2 = U tan^2(theta) + V tan(theta) + W
+    """
+    def fwhm(tth):
+        t = np.tan(np.deg2rad(tth)/2)
+        return np.sqrt(np.maximum(U*t**2 + V*t + W, 1e-12))
+    return fwhm
+
+
+def reflections(latt, wavelength, centring='P', tth_max=180., decimals=6):
+    """
+    Enumerates the powder lines of a lattice
+    Returns a dictionary of representative hkl, d spacing, 2theta and multiplicity,
+    sorted by increasing 2theta
+    Arguments:
+    latt -- real space lattice object
+    wavelength -- neutron wavelength in angstroms
+    centring -- centring letter used to remove systematically absent reflections
+    tth_max -- largest scattering angle in degrees
+    decimals -- reflections whose d spacings agree to this many decimals are merged
+    """
+    q_max = 4*np.pi/wavelength*np.sin(np.deg2rad(min(tth_max, 180.))/2)
+    hkl, modQ = lu.hkl_list(latt, q_max, centring)
+    d = 2*np.pi/modQ
+    # within one line keep the hkl with the largest indicies as representative
+    order = np.lexsort((-hkl[:, 2], -hkl[:, 1], -hkl[:, 0], -np.round(d, decimals)))
+    _, first, multiplicity = np.unique(-np.round(d[order], decimals), return_index=True, return_counts=True)
+    first = order[first]
+    d = d[first]
+    tth = 2*np.rad2deg(np.arcsin(np.clip(wavelength/(2*d), -1, 1)))
+    return {
+        "hkl": hkl[first],
+        "d": d,
+        "two_theta": tth,
+        "multiplicity": multiplicity,
+    }
+
+
+def _windowed(centres, fwhm, weights, grid, cutoff, chunk):
+    # evaluate every peak exactly on the grid points inside its window
+    pattern = np.zeros(grid.size)
+    lo = np.searchsorted(grid, centres - cutoff*fwhm)
+    hi = np.searchsorted(grid, centres + cutoff*fwhm)
+    counts = hi - lo
+    ends = np.cumsum(counts)
+
+    start = 0
+    while start < centres.size:
+        # take as many peaks as fit in the chunk, but always at least one
+        stop = max(np.searchsorted(ends, ends[start] - counts[start] + chunk, side='right'), start + 1)
+        n = counts[start:stop]
+        peak = np.repeat(np.arange(start, stop), n)
+        offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        index = lo[peak] + offset
+
+        sigma = fwhm[peak]/np.sqrt(8*np.log(2))
+        values = weights[peak]*np.exp(-0.5*((grid[index] - centres[peak])/sigma)**2)/(sigma*np.sqrt(2*np.pi))
+        pattern += np.bincount(index, weights=values, minlength=grid.size)
+        start = stop
+    return pattern
+
+
+def _binned(centres, fwhm, weights, grid, cutoff, rtol):
+    # split the peaks into groups whose widths agree to rtol, bin each group
+    # onto the grid as sticks and convolve with one truncated kernel per group
+    pattern = np.zeros(grid.size)
+    step = grid[1] - grid[0]
+    pos = (centres - grid[0])/step
+    group = np.floor(np.log(fwhm)/np.log1p(rtol)).astype(int)
+    order = np.argsort(group, kind='stable')
+    for members in np.split(order, np.flatnonzero(np.diff(group[order])) + 1):
+        width = np.mean(fwhm[members])/step
+        sigma = width/np.sqrt(8*np.log(2))
+        half = int(np.ceil(cutoff*width))
+        kernel = np.exp(-0.5*(np.arange(-half, half + 1)/sigma)**2)/(sigma*np.sqrt(2*np.pi)*step)
+
+        i0 = np.floor(pos[members]).astype(int)
+        frac = pos[members] - i0
+        base = i0.min()
+        span = i0.max() - base + 2
+        sticks = (np.bincount(i0 - base, weights=weights[members]*(1 - frac), minlength=span)
+                  + np.bincount(i0 - base + 1, weights=weights[members]*frac, minlength=span))
+
+        n = span + kernel.size - 1
+        conv = np.fft.irfft(np.fft.rfft(sticks, n)*np.fft.rfft(kernel, n), n)
+        # conv[0] lies on grid index base - half
+        first = base - half
+        lo = max(first, 0)
+        hi = min(first + n, grid.size)
+        if hi > lo:
+            pattern[lo:hi] += conv[lo - first:hi - first]
+    return pattern
+
+
+def accumulate(centres, fwhm, weights, grid, cutoff=3., rtol=0.01, chunk=1000000):
+    """
+    Sums unit-area Gaussian peaks onto a sorted grid, evaluating each peak only
+    within +/- cutoff*FWHM of its centre
+    On uniform grids with many points per peak the peaks are binned as sticks and
+    convolved with one kernel per group of peaks whose widths agree to rtol
+    Arguments:
+    centres -- peak positions, in the units of grid
+    fwhm -- full width at half maximum of every peak
+    weights -- integrated intensity of every peak
+    grid -- sorted 1D array of positions
+    cutoff -- half-width of the evaluation window in units of FWHM
+    rtol -- relative width tolerance used to group peaks on uniform grids
+    chunk -- maximum number of (peak, grid point) pairs evaluated at once
+    """
+    centres = np.asarray(centres, dtype=float)
+    fwhm = np.broadcast_to(np.asarray(fwhm, dtype=float), centres.shape)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), centres.shape)
+    grid = np.asarray(grid, dtype=float)
+
+    # peaks whose window misses the grid entirely contribute nothing
+    keep = (centres + cutoff*fwhm >= grid[0]) & (centres - cutoff*fwhm <= grid[-1])
+    centres, fwhm, weights = centres[keep], fwhm[keep], weights[keep]
+    if centres.size == 0:
+        return np.zeros(grid.size)
+
+    step = np.diff(grid)
+    uniform = grid.size > 1 and np.allclose(step, step[0], rtol=1e-6, atol=0)
+    if uniform and np.median(fwhm)/step[0] > 16:
+        return _binned(centres, fwhm, weights, grid, cutoff, rtol)
+    return _windowed(centres, fwhm, weights, grid, cutoff, chunk)
+
+
+def powder_pattern(latt, wavelength, grid, axis='2theta', resolution=None, centring='P',
+                   intensity=None, lorentz=True, cutoff=3.):
+    """
+    Simulates a powder diffraction pattern
+    Returns the pattern on the grid and the reflection table used to build it
+    Arguments:
+    latt -- real space lattice object
+    wavelength -- neutron wavelength in angstroms
+    grid -- sorted 1D array of 2theta (degrees) or d (angstroms) values
+    axis -- '2theta' or 'd'
+    resolution -- callable returning the FWHM in degrees for an array of 2theta, defaults to caglioti()
+    centring -- centring letter used to remove systematically absent reflections
+    intensity -- optional callable returning |F|^2 for an (N,3) array of hkl
+    lorentz -- apply the Lorentz factor 1/(sin(theta) sin(2theta))
+    cutoff -- half-width of the peak window in units of FWHM
+    """
+    if resolution is None:
+        resolution = caglioti()
+    grid = np.asarray(grid, dtype=float)
+    if axis == '2theta':
+        tth_max = grid[-1] + cutoff*np.max(resolution(grid[-1:]))
+    elif axis == 'd':
+        tth_max = 2*np.rad2deg(np.arcsin(min(wavelength/(2*grid[0]), 1.)))
+    else:
+        raise ValueError("axis must be '2theta' or 'd'")
+    table = reflections(latt, wavelength, centring, tth_max)
+
+    tth = table["two_theta"]
+    weights = table["multiplicity"].astype(float)
+    if intensity is not None:
+        weights = weights*intensity(table["hkl"])
+    if lorentz:
+        theta = np.deg2rad(tth)/2
+        weights = weights/(np.sin(theta)*np.sin(2*theta))
+    fwhm = resolution(tth)
+
+    if axis == '2theta':
+        pattern = accumulate(tth, fwhm, weights, grid, cutoff)
+    else:
+        # |dd| = d cot(theta) dtheta
+        fwhm_d = table["d"]/np.tan(np.deg2rad(tth)/2)*np.deg2rad(fwhm)/2
+        pattern = accumulate(table["d"], fwhm_d, weights, grid, cutoff)
+    return pattern, table
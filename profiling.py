@@ -0,0 +1,165 @@
+"""
+Opt-in call profiling of individual requests.
+
+A view wrapped with @profiled runs under cProfile when the request carries
+the profiling token (X-Profile-Token header or ?profile=<token>) or when it
+is picked by random sampling. The profile covers everything the view does,
+including the Brillouin zone construction, calcQ and the JSON
+serialization. Each profile is written as a pstats file with a JSON summary
+to a directory that keeps only the most recent profiles, and the /profiles
+endpoints list the slowest of them and serve the full statistics.
+
+Configuration (environment variables):
+    QPC_PROFILE_TOKEN -- secret that enables profiling and the endpoints; unset disables both
+    QPC_PROFILE_SAMPLE_RATE -- fraction of requests profiled without a token, default 0
+    QPC_PROFILE_DIR -- directory of the profile ring, default ./profiles next to this file
+    QPC_PROFILE_KEEP -- number of profiles kept, default 200
+"""
+
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from urllib.parse import urlencode
+
+from flask import abort, jsonify, request, send_file
+
+TOKEN = os.environ.get('QPC_PROFILE_TOKEN')
+SAMPLE_RATE = float(os.environ.get('QPC_PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('QPC_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+KEEP = int(os.environ.get('QPC_PROFILE_KEEP', 200))
+
+
+def authorized():
+    """
+    True when the current request presents the profiling token.
+    """
+    given = request.headers.get('X-Profile-Token') or request.args.get('profile')
+    return bool(TOKEN) and given is not None and hmac.compare_digest(given, TOKEN)
+
+
+def _wanted():
+    return authorized() or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE)
+
+
+def _summary(profile, top=25):
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, name), (calls, _, tottime, cumtime, _) in stats.stats.items():
+        rows.append({'function': f'{os.path.basename(filename)}:{line}({name})', 'calls': calls,
+                     'tottime': round(tottime, 6), 'cumtime': round(cumtime, 6)})
+    rows.sort(key=lambda row: row['cumtime'], reverse=True)
+    return rows[:top]
+
+
+def _public_path():
+    # the request path without the profiling token, which must never reach the stored profiles
+    query = urlencode([(key, value) for key, value in request.args.items(multi=True) if key != 'profile'])
+    return request.path + ('?' + query if query else '')
+
+
+def _save(profile, endpoint, duration):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f'{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    meta = {
+        'id': profile_id,
+        'endpoint': endpoint,
+        'path': _public_path(),
+        'duration': duration,
+        'time': time.time(),
+        'sampled': not authorized(),
+        'top': _summary(profile),
+    }
+    # write under temporary names and rename, so that readers never see partial files
+    base = os.path.join(PROFILE_DIR, profile_id)
+    profile.dump_stats(base + '.prof.tmp')
+    os.replace(base + '.prof.tmp', base + '.prof')
+    with open(base + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(base + '.json.tmp', base + '.json')
+    _prune()
+
+
+def _prune():
+    # the ring keeps the KEEP most recent profiles
+    entries = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.json')),
+                     key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:max(len(entries) - KEEP, 0)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(entry.path[:-len('.json')] + suffix)
+            except FileNotFoundError:
+                pass  # removed by another worker
+
+
+def profiled(view):
+    """
+    Decorator running a Flask view under cProfile for requests that opt in or are sampled.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _wanted():
+            return view(*args, **kwargs)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(view, *args, **kwargs)
+        finally:
+            _save(profile, request.endpoint, time.perf_counter() - start)
+    return wrapper
+
+
+def _load(profile_id):
+    # ids are generated here; anything else could point outside the ring
+    if not all(c.isalnum() or c == '-' for c in profile_id):
+        abort(404)
+    path = os.path.join(PROFILE_DIR, profile_id + '.json')
+    if not os.path.exists(path):
+        abort(404)
+    with open(path) as f:
+        return json.load(f)
+
+
+def register(app):
+    """
+    Add the /profiles endpoints to a Flask app. They answer 404 unless the request presents the token.
+    """
+    @app.route('/profiles')
+    def profiles():
+        if not authorized():
+            abort(404)
+        limit = int(request.args.get('limit', 20))
+        metas = []
+        if os.path.isdir(PROFILE_DIR):
+            for entry in os.scandir(PROFILE_DIR):
+                if entry.name.endswith('.json'):
+                    try:
+                        with open(entry.path) as f:
+                            meta = json.load(f)
+                    except (FileNotFoundError, ValueError):
+                        continue  # pruned or being written
+                    meta.pop('top', None)
+                    metas.append(meta)
+        metas.sort(key=lambda meta: meta['duration'], reverse=True)
+        return jsonify({'profiles': metas[:limit]})
+
+    @app.route('/profiles/<profile_id>')
+    def profile(profile_id):
+        if not authorized():
+            abort(404)
+        meta = _load(profile_id)
+        if request.args.get('format') == 'prof':
+            return send_file(os.path.join(PROFILE_DIR, profile_id + '.prof'), as_attachment=True,
+                             download_name=profile_id + '.prof')
+        if request.args.get('format') == 'text':
+            text = io.StringIO()
+            stats = pstats.Stats(os.path.join(PROFILE_DIR, profile_id + '.prof'), stream=text)
+            stats.sort_stats(request.args.get('sort', 'cumulative')).print_stats(int(request.args.get('limit', 60)))
+            return text.getvalue(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+        return jsonify(meta)
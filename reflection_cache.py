@@ -0,0 +1,170 @@
+"""
+Memory-mapped on-disk cache of reflection tables.
+
+A table lists every allowed hkl of a cell up to some |Q| with its |Q| and d
+spacing, as a structured .npy file sorted by |Q|, next to a .q.npy file
+holding the sorted |Q| alone as a contiguous key array. Files are keyed by a
+hash of the canonical cell and centring and by |Q|_max rounded up to a whole
+inverse angstrom, written once under a temporary name and renamed into
+place, and then opened read-only with np.load(mmap_mode='r'), so every
+worker process shares the same pages through the operating system cache.
+Range queries in |Q| or d are binary searches on the key array and return
+views, touching only the pages the search visits. The CACHE_SIZE most
+recently used tables stay mapped; evicted maps are released, and their file
+descriptors closed, once no caller holds a view of them.
+
+The cache directory is taken from QPC_REFLECTION_CACHE.
+"""
+
+import collections
+import glob
+import os
+import threading
+
+import numpy as np
+
+import crystal
+import lattice_utils as lu
+from result_store import canonical_key
+
+REFLECTION_dtype = np.dtype([('hkl', np.int32, (3,)), ('modQ', np.float64), ('d', np.float64)], align=True)
+# version of the file layout, part of the key so that tables of another layout are never opened
+FORMAT = 2
+CACHE_SIZE = 32
+DEFAULT_DIR = os.environ.get('QPC_REFLECTION_CACHE',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reflection_cache'))
+
+_open = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def cell_key(latt, centring='P'):
+    """
+    Hash identifying the reflection tables of a cell and centring.
+    """
+    return canonical_key('reflections', {'cell': list(crystal.parameters(latt.G)), 'centring': centring,
+                                         'format': FORMAT})
+
+
+def build(latt, q_max, centring='P', budget=None):
+    """
+    Compute a reflection table of a cell up to q_max, sorted by |Q|, as a structured array.
+    """
+    hkl, modQ = lu.hkl_list(latt, q_max, centring, budget=budget)
+    order = np.argsort(modQ, kind='stable')
+    table = np.empty(order.size, dtype=REFLECTION_dtype)
+    table['hkl'] = hkl[order]
+    table['modQ'] = modQ[order]
+    table['d'] = 2*np.pi/modQ[order]
+    return table
+
+
+def _files(directory, key):
+    # existing tables of a cell with the |Q|_max they cover; the key files end in .q.npy and are skipped
+    found = []
+    for path in glob.glob(os.path.join(directory, key + '-q*.npy')):
+        try:
+            found.append((int(os.path.basename(path)[len(key) + 2:-4]), path))
+        except ValueError:
+            pass
+    return sorted(found)
+
+
+def _write(path, array):
+    # unique temporary name so concurrent builders never write the same file
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.lib.format.write_array(f, array)
+    os.replace(tmp, path)
+
+
+def table(latt, q_max, centring='P', directory=None, budget=None):
+    """
+    Return a read-only memory-mapped reflection table covering |Q| <= q_max (possibly more),
+    building and storing it on the first request
+    Arguments:
+    latt -- real space lattice object
+    q_max -- largest momentum transfer needed, in inverse angstroms
+    centring -- centring letter used to remove systematically absent reflections
+    directory -- cache directory, defaults to QPC_REFLECTION_CACHE
+    budget -- memory budget of the table construction, see chunking
+    """
+    directory = DEFAULT_DIR if directory is None else directory
+    key = cell_key(latt, centring)
+    bucket = max(int(np.ceil(q_max)), 1)
+    for covered, path in _files(directory, key):
+        if covered >= bucket:
+            return _map(path)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{key}-q{bucket}.npy')
+    rows = build(latt, bucket, centring, budget)
+    # the key array goes first, so a table that can be found always has one
+    _write(_key_path(path), np.ascontiguousarray(rows['modQ']))
+    _write(path, rows)
+    return _map(path)
+
+
+def _key_path(path):
+    return path[:-len('.npy')] + '.q.npy'
+
+
+def _map(path):
+    with _lock:
+        if path in _open:
+            _open.move_to_end(path)
+        else:
+            _open[path] = (np.load(path, mmap_mode='r'), np.load(_key_path(path), mmap_mode='r'))
+            # dropping the last reference unmaps the file and closes its descriptor
+            while len(_open) > CACHE_SIZE:
+                _open.popitem(last=False)
+        return _open[path][0]
+
+
+def sorted_q(rows):
+    """
+    Return the sorted |Q| of a table as a contiguous array: the mapped key array for a table
+    returned by table() that is still cached, otherwise a copy of the 'modQ' field.
+    """
+    with _lock:
+        for mapped, keys in _open.values():
+            if mapped is rows:
+                return keys
+    return np.ascontiguousarray(rows['modQ'])
+
+
+def q_range(rows, q_min=0., q_max=np.inf):
+    """
+    Return the view of a table with q_min <= |Q| <= q_max.
+    """
+    modQ = sorted_q(rows)
+    return rows[np.searchsorted(modQ, q_min, side='left'):np.searchsorted(modQ, q_max, side='right')]
+
+
+def d_range(rows, d_min=0., d_max=np.inf):
+    """
+    Return the view of a table with d_min <= d <= d_max, in order of decreasing d.
+    """
+    with np.errstate(divide='ignore'):
+        return q_range(rows, 2*np.pi/d_max, 2*np.pi/d_min)
+
+
+def two_theta(rows, wavelength):
+    """
+    Scattering angle of every row in degrees, NaN beyond the Ewald sphere.
+    """
+    sin_theta = wavelength*np.asarray(rows['modQ'])/(4*np.pi)
+    return np.where(sin_theta <= 1, 2*np.rad2deg(np.arcsin(np.minimum(sin_theta, 1))), np.nan)
+
+
+def clear(latt=None, centring='P', directory=None):
+    """
+    Remove the stored tables of one cell, or all of them.
+    """
+    directory = DEFAULT_DIR if directory is None else directory
+    pattern = '*-q*.npy' if latt is None else cell_key(latt, centring) + '-q*.npy'
+    with _lock:
+        # tables before their key arrays, so that no table is ever found without one
+        for path in sorted(glob.glob(os.path.join(directory, pattern)), key=lambda path: path.endswith('.q.npy')):
+            _open.pop(path, None)
+            os.remove(path)
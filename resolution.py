@@ -0,0 +1,236 @@
+"""
+Triple-axis resolution ellipsoids.
+
+Cooper-Nathans resolution matrices (Acta Cryst. 23, 357 (1967)) in the
+matrix form of Popovici (Acta Cryst. A31, 507 (1975)), evaluated for any
+number of (Q, omega) points in one pass. The covariance and resolution
+matrix M of every point are given in the frame (Q parallel, Q perpendicular
+in the scattering plane, Q vertical, omega) in inverse angstroms and meV, so
+that the resolution function is proportional to exp(-dX^T M dX / 2) and its
+half-maximum surface is dX^T M dX = 2 ln 2. Collimations and mosaics are
+full widths at half maximum in arcminutes. The spatial terms of the full
+Popovici treatment (source, crystal and detector sizes) are not included.
+
+The sample scattering sense defaults to kf on the clockwise side of ki, the
+convention of planning.calcQ, so that ellipses projected with in_plane()
+overlay the theta cut and coverage plots directly.
+"""
+
+import numpy as np
+
+import chunking
+import lattice_utils as lu
+import planning as pla
+
+CONV = 2.072 # meV A^2, E = CONV k^2
+SIGMA = np.sqrt(8*np.log(2)) # FWHM of a gaussian in units of its standard deviation
+ARCMIN = np.pi/(180*60)
+
+DEFAULT_INSTRUMENT = {
+    'dm': 3.355, # monochromator d-spacing, PG(002)
+    'da': 3.355, # analyser d-spacing
+    'eta_m': 30., # monochromator, analyser and sample mosaics
+    'eta_a': 30.,
+    'eta_s': 30.,
+    'eta_m_v': None, # vertical mosaics, default to the horizontal ones
+    'eta_a_v': None,
+    'eta_s_v': None,
+    'alpha': (60., 60., 60., 60.), # horizontal collimations: source-mono, mono-sample, sample-analyser, analyser-detector
+    'beta': (120., 120., 120., 120.), # vertical collimations in the same order
+    'senses': (1, -1, 1), # scattering senses of monochromator, sample and analyser
+}
+
+
+def instrument_parameters(instrument=None):
+    """
+    Return a complete instrument description, filling in DEFAULT_INSTRUMENT for missing entries.
+    """
+    par = dict(DEFAULT_INSTRUMENT)
+    par.update(instrument or {})
+    for name in ('eta_m', 'eta_a', 'eta_s'):
+        if par[name + '_v'] is None:
+            par[name + '_v'] = par[name]
+    return par
+
+
+def _covariance(ki, kf, modQ, tth, par):
+    # covariance of (dQ_par, dQ_perp, dQ_z, d omega) for N points, shape (N,4,4)
+    n = ki.size
+    sm, ss, sa = par['senses']
+    theta_m = sm*np.arcsin(np.pi/(par['dm']*ki))
+    theta_a = sa*np.arcsin(np.pi/(par['da']*kf))
+    two_theta_s = ss*tth
+    # angle between ki and Q
+    phi = np.arctan2(-kf*np.sin(two_theta_s), ki - kf*np.cos(two_theta_s))
+
+    # weights of the eight beam divergence angles (horizontal and vertical, four legs)
+    alpha, beta = par['alpha'], par['beta']
+    divergences = np.array([alpha[0], alpha[1], beta[0], beta[1], alpha[2], alpha[3], beta[2], beta[3]], dtype=float)
+    G = np.diag((SIGMA/(divergences*ARCMIN))**2)
+    mosaics = np.array([par['eta_m'], par['eta_m_v'], par['eta_a'], par['eta_a_v']], dtype=float)
+    F = np.diag((SIGMA/(mosaics*ARCMIN))**2)
+
+    # divergence angles -> deviations of ki and kf, each in its own (parallel, perpendicular, vertical) frame
+    A = np.zeros((n, 6, 8))
+    A[:, 0, 0] = ki/(2*np.tan(theta_m))
+    A[:, 0, 1] = -A[:, 0, 0]
+    A[:, 1, 1] = ki
+    A[:, 2, 3] = ki
+    A[:, 3, 4] = kf/(2*np.tan(theta_a))
+    A[:, 3, 5] = -A[:, 3, 4]
+    A[:, 4, 4] = kf
+    A[:, 5, 6] = kf
+
+    # divergence angles -> mosaic block tilts of monochromator and analyser
+    C = np.zeros((n, 4, 8))
+    C[:, 0, 0] = C[:, 0, 1] = 0.5
+    C[:, 1, 2] = 1/(2*np.sin(theta_m))
+    C[:, 1, 3] = -C[:, 1, 2]
+    C[:, 2, 4] = C[:, 2, 5] = 0.5
+    C[:, 3, 6] = 1/(2*np.sin(theta_a))
+    C[:, 3, 7] = -C[:, 3, 6]
+
+    # deviations of ki and kf -> (dQ_par, dQ_perp, dQ_z, d omega) with Q = ki - kf
+    B = np.zeros((n, 4, 6))
+    B[:, 0, 0] = np.cos(phi)
+    B[:, 0, 1] = np.sin(phi)
+    B[:, 0, 3] = -np.cos(phi - two_theta_s)
+    B[:, 0, 4] = -np.sin(phi - two_theta_s)
+    B[:, 1, 0] = -np.sin(phi)
+    B[:, 1, 1] = np.cos(phi)
+    B[:, 1, 3] = np.sin(phi - two_theta_s)
+    B[:, 1, 4] = -np.cos(phi - two_theta_s)
+    B[:, 2, 2] = 1.
+    B[:, 2, 5] = -1.
+    B[:, 3, 0] = 2*CONV*ki
+    B[:, 3, 3] = -2*CONV*kf
+
+    H = G + np.swapaxes(C, 1, 2) @ F @ C
+    BA = B @ A
+    cov = BA @ np.linalg.solve(H, np.swapaxes(BA, 1, 2))
+    # sample mosaic spreads Q perpendicular to itself
+    cov[:, 1, 1] += (modQ*par['eta_s']*ARCMIN/SIGMA)**2
+    cov[:, 2, 2] += (modQ*par['eta_s_v']*ARCMIN/SIGMA)**2
+    return cov, phi
+
+
+def resolution(ki, kf, modQ, instrument=None, budget=None):
+    """
+    Cooper-Nathans resolution of many spectrometer configurations at once
+    Returns a dictionary of arrays with the broadcast shape S of the inputs:
+    cov and M -- covariance and resolution matrices, shape S + (4,4), NaN where invalid
+    fwhm -- Bragg widths (projections) along Q_par, Q_perp, Q_z and omega, shape S + (4,)
+    two_theta -- scattering angle in degrees
+    phi -- angle between ki and Q in degrees
+    valid -- False where the scattering triangle does not close or a Bragg angle cannot be reached
+    Arguments:
+    ki,kf -- incident and final wavevectors, in inverse angstroms
+    modQ -- momentum transfer, in inverse angstroms
+    instrument -- dictionary overriding entries of DEFAULT_INSTRUMENT
+    budget -- memory budget in bytes for the temporaries of each block of points, see chunking
+    """
+    par = instrument_parameters(instrument)
+    ki, kf, modQ = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (ki, kf, modQ)])
+    shape = modQ.shape
+    ki, kf, modQ = ki.ravel(), kf.ravel(), modQ.ravel()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_tth = (ki**2 + kf**2 - modQ**2)/(2*ki*kf)
+        valid = ((ki > 0) & (kf > 0) & (modQ > 0) & (np.abs(cos_tth) <= 1)
+                 & (np.pi/(par['dm']*ki) <= 1) & (np.pi/(par['da']*kf) <= 1))
+    tth = np.arccos(np.clip(np.nan_to_num(cos_tth), -1, 1))
+
+    cov = np.full((modQ.size, 4, 4), np.nan)
+    M = np.full((modQ.size, 4, 4), np.nan)
+    phi = np.full(modQ.size, np.nan)
+    index = np.flatnonzero(valid)
+    # about 400 doubles of temporaries per point
+    for block in chunking.chunks(index.size, 400*8, budget):
+        rows = index[block]
+        cov[rows], phi[rows] = _covariance(ki[rows], kf[rows], modQ[rows], tth[rows], par)
+        M[rows] = np.linalg.inv(cov[rows])
+
+    fwhm = SIGMA*np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+    return {
+        'cov': cov.reshape(shape + (4, 4)),
+        'M': M.reshape(shape + (4, 4)),
+        'fwhm': fwhm.reshape(shape + (4,)),
+        'two_theta': np.where(valid, np.rad2deg(tth), np.nan).reshape(shape),
+        'phi': np.rad2deg(phi).reshape(shape),
+        'valid': valid.reshape(shape),
+    }
+
+
+def in_plane(cov, alpha, modu, modv, section=False):
+    """
+    Project resolution ellipsoids into the (u, v) scattering plane
+    Returns 2x2 covariance matrices of the in-plane ellipses in r.l.u. along the
+    x and y axes of the theta cut plot (x = qx/|u|, y = qy/|v|), shape S + (2,2)
+    Arguments:
+    cov -- covariance matrices from resolution(), shape S + (4,4)
+    alpha -- angle of Q from the u axis in degrees, shape S
+    modu,modv -- lengths of u and v in inverse angstroms
+    section -- if True, cut the ellipsoid at dQ_z = d omega = 0 instead of integrating over them
+    """
+    cov = np.asarray(cov)
+    if section:
+        with np.errstate(invalid='ignore'):
+            cov2 = np.linalg.inv(np.linalg.inv(cov)[..., :2, :2])
+    else:
+        cov2 = cov[..., :2, :2]
+    alpha = np.deg2rad(np.asarray(alpha, dtype=float))
+    c, s = np.cos(alpha), np.sin(alpha)
+    # columns are Q_par and Q_perp in the (X, Y) frame, scaled to r.l.u.
+    R = np.stack([np.stack([c/modu, -s/modu], -1),
+                  np.stack([s/modv, c/modv], -1)], -2)
+    return R @ cov2 @ np.swapaxes(R, -1, -2)
+
+
+def ellipse_outline(x, y, cov2, n=65):
+    """
+    Return the x and y coordinates of the half-maximum contours of in-plane ellipses, shape S + (n,)
+    Arguments:
+    x,y -- ellipse centres, shape S
+    cov2 -- 2x2 covariance matrices from in_plane(), shape S + (2,2)
+    n -- number of points on each closed outline
+    """
+    t = np.linspace(0, 2*np.pi, n)
+    circle = np.sqrt(2*np.log(2))*np.stack([np.cos(t), np.sin(t)])
+    # a symmetric square root keeps NaN matrices (invalid points) NaN instead of raising
+    w, V = np.linalg.eigh(np.nan_to_num(np.asarray(cov2)))
+    root = V*np.sqrt(np.clip(w, 0, None))[..., np.newaxis, :] @ np.swapaxes(V, -1, -2)
+    root = np.where(np.isnan(cov2).any(axis=(-2, -1))[..., np.newaxis, np.newaxis], np.nan, root)
+    offsets = root @ circle
+    return np.asarray(x)[..., np.newaxis] + offsets[..., 0, :], np.asarray(y)[..., np.newaxis] + offsets[..., 1, :]
+
+
+def plane_resolution(latt, u, v, x, y, Efixed, E, omega=0., instrument=None, section=False, budget=None):
+    """
+    Resolution ellipsoids at points of the (u, v) scattering plane, e.g. along a scan
+    trajectory or on the grid of a coverage map, together with their in-plane projections
+    Returns the dictionary of resolution() with in addition
+    alpha -- angle of Q from the u axis in degrees
+    ellipse -- in-plane covariance matrices in r.l.u., see in_plane()
+    Arguments:
+    latt -- real space lattice object
+    u,v -- reciprocal lattice vectors defining the scattering plane
+    x,y -- positions in r.l.u. of u and v, as in the theta cut and coverage plots
+    Efixed -- "Ei" or "Ef"
+    E -- the fixed energy, in meV
+    omega -- energy transfer of every point, in meV
+    instrument -- dictionary overriding entries of DEFAULT_INSTRUMENT
+    section -- cut instead of project the ellipsoids, see in_plane()
+    budget -- memory budget in bytes, see chunking
+    """
+    rlatt = lu.recip_lattice(latt)
+    modu = rlatt.norm(np.asarray(u, dtype=float))
+    modv = rlatt.norm(np.asarray(v, dtype=float))
+    qx = np.asarray(x, dtype=float)*modu
+    qy = np.asarray(y, dtype=float)*modv
+    ki, kf, allowed = pla._wavevectors(Efixed, E, omega)
+
+    result = resolution(ki, kf, np.hypot(qx, qy), instrument, budget)
+    result['valid'] &= allowed
+    result['alpha'] = np.rad2deg(np.arctan2(qy, qx))
+    result['ellipse'] = in_plane(result['cov'], result['alpha'], modu, modv, section)
+    return result
@@ -0,0 +1,192 @@
+"""
+Persistent on-disk store for expensive results shared between worker processes.
+
+Results are dictionaries of numpy arrays (reciprocal cells, Brillouin zone
+geometry, reflection tables) saved with np.savez in a single SQLite table,
+keyed by a hash of their canonicalised inputs. The database runs in WAL mode
+so many readers can work alongside one writer, and the least recently used
+rows are evicted once the stored payload exceeds a size budget.
+"""
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# bump whenever a stored computation changes, so that stale results are dropped
+# 2: Brillouin zones from Selling-reduced bases and integer primitive hkl
+SCHEMA_VERSION = 2
+DEFAULT_PATH = os.environ.get('QPC_RESULT_STORE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.sqlite'))
+DEFAULT_MAX_BYTES = int(os.environ.get('QPC_RESULT_STORE_MAX_BYTES', 256 * 1024**2))
+# access times are only refreshed once they are this many seconds old, so most reads never take the write lock
+DEFAULT_ACCESS_RESOLUTION = float(os.environ.get('QPC_RESULT_STORE_ACCESS_RESOLUTION', 60.0))
+
+
+def _canonical(value, decimals):
+    # floats are rounded so that inputs equal to within numerical noise share a key
+    if isinstance(value, dict):
+        return {str(k): _canonical(v, decimals) for k, v in sorted(value.items())}
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v, decimals) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = round(float(value), decimals)
+        return 0.0 if value == 0 else value
+    return value
+
+
+def canonical_key(kind, inputs, decimals=10):
+    """
+    Return the hex digest identifying a result of the given kind computed from inputs.
+    """
+    payload = json.dumps({'kind': kind, 'schema': SCHEMA_VERSION, 'inputs': _canonical(inputs, decimals)},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _dumps(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **{name: np.asarray(value) for name, value in arrays.items()})
+    return buffer.getvalue()
+
+
+def _loads(blob):
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+class ResultStore:
+    """
+    SQLite-backed cache of dictionaries of numpy arrays.
+
+    One store object may be used from several threads; every thread and every
+    forked process opens its own connection to the shared database file.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, timeout=30.0,
+                 access_resolution=DEFAULT_ACCESS_RESOLUTION):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.access_resolution = access_resolution
+        self._local = threading.local()
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # connections must not be shared across a fork
+            local.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            local.pid = os.getpid()
+            self._initialize(local.conn)
+        return local.conn
+
+    def _initialize(self, conn):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            if row is None or int(row[0]) != SCHEMA_VERSION:
+                # results written by another schema cannot be trusted, start over
+                conn.execute('DROP TABLE IF EXISTS results')
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+            conn.execute('''CREATE TABLE IF NOT EXISTS results (
+                                key TEXT PRIMARY KEY,
+                                kind TEXT NOT NULL,
+                                created REAL NOT NULL,
+                                accessed REAL NOT NULL,
+                                size INTEGER NOT NULL,
+                                value BLOB NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_kind ON results (kind)')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get(self, key):
+        """
+        Return the stored dictionary of arrays for key, or None.
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT value, accessed FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        # eviction only needs a coarse recency order
+        if now - row[1] >= self.access_resolution:
+            conn.execute('UPDATE results SET accessed = ? WHERE key = ? AND accessed < ?',
+                         (now, key, now - self.access_resolution))
+        return _loads(row[0])
+
+    def put(self, key, kind, arrays):
+        """
+        Store a dictionary of arrays under key, evicting old rows if the store is over budget.
+        """
+        blob = _dumps(arrays)
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, kind, now, now, len(blob), blob))
+            self._evict(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop least recently used rows down to 90% of the budget so that not every put evicts
+        excess = total - int(0.9 * self.max_bytes)
+        freed = 0
+        stale = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed'):
+            if freed >= excess:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def get_or_compute(self, kind, inputs, compute):
+        """
+        Return the cached result for (kind, inputs), calling compute() and storing its result on a miss.
+        """
+        key = canonical_key(kind, inputs)
+        result = self.get(key)
+        if result is None:
+            result = {name: np.asarray(value) for name, value in compute().items()}
+            self.put(key, kind, result)
+        return result
+
+    def clear(self, kind=None):
+        """
+        Remove all results, or only those of one kind.
+        """
+        conn = self._connect()
+        if kind is None:
+            conn.execute('DELETE FROM results')
+        else:
+            conn.execute('DELETE FROM results WHERE kind = ?', (kind,))
+
+    def stats(self):
+        """
+        Return the number of rows and stored bytes per kind.
+        """
+        conn = self._connect()
+        rows = conn.execute('SELECT kind, COUNT(*), SUM(size) FROM results GROUP BY kind').fetchall()
+        return {kind: {'count': count, 'bytes': size} for kind, count, size in rows}
@@ -0,0 +1,55 @@
+"""
+Adaptive sampling of parametric curves for plotting.
+
+A curve is first sampled on a coarse uniform grid. Every interval whose
+midpoint lies further from the chord than the tolerance is then split, all
+intervals of one level in a single vectorized call, until the polyline
+follows the curve everywhere. Straight parts keep few points while sharp
+bends and the edges of undefined (NaN) regions are refined.
+"""
+
+import numpy as np
+
+
+def adaptive_sample(f, t0, t1, tolerance=1e-3, initial=9, max_depth=12, scale=None):
+    """
+    Sample a curve adaptively between parameters t0 and t1
+    Returns the parameters t, shape (N,), and the points, shape (N,d)
+    Arguments:
+    f -- function mapping an array of parameters to points, shape (N,d), NaN where undefined
+    t0,t1 -- parameter range
+    tolerance -- largest distance between the curve and its polyline, relative to scale
+    initial -- number of points of the starting uniform grid
+    max_depth -- largest number of times an interval of the starting grid is halved
+    scale -- extent of every coordinate used to normalize distances, defaults to the
+             extent of the starting grid so that tolerance is a fraction of the curve size
+    """
+    t = np.linspace(t0, t1, initial)
+    points = np.asarray(f(t), dtype=float)
+    if scale is None:
+        with np.errstate(invalid='ignore'):
+            scale = np.nanmax(points, axis=0) - np.nanmin(points, axis=0) if np.isfinite(points).any() else 1.
+    scale = np.where(np.asarray(scale, dtype=float) > 0, scale, 1.)
+
+    active = np.ones(t.size - 1, dtype=bool)
+    for _ in range(max_depth):
+        index = np.flatnonzero(active)
+        if not index.size:
+            break
+        t_mid = (t[index] + t[index + 1])/2
+        mid = np.asarray(f(t_mid), dtype=float)
+        chord = (points[index] + points[index + 1])/2
+        with np.errstate(invalid='ignore'):
+            error = np.linalg.norm((mid - chord)/scale, axis=1)
+        # intervals crossing into an undefined region are refined to locate its edge
+        defined = ~np.isnan(points).any(axis=1)
+        edge = (defined[index] != defined[index + 1]) | (defined[index] & np.isnan(mid).any(axis=1))
+        split = (error > tolerance) | edge
+
+        t = np.insert(t, index[split] + 1, t_mid[split])
+        points = np.insert(points, index[split] + 1, mid[split], axis=0)
+        # a split interval becomes two intervals that are both checked again
+        tested = np.zeros(active.size, dtype=bool)
+        tested[index[split]] = True
+        active = np.repeat(tested, np.where(tested, 2, 1))
+    return t, points
@@ -0,0 +1,127 @@
+"""
+Constant-Q and constant-E inelastic scans for a triple-axis spectrometer.
+
+A scan is described by trajectory specs in r.l.u. and meV. Spectrometer
+angles follow the conventions of coverage.accessible (theta = 0 when u is
+along ki), so the points can be checked against the coverage map. Points
+are generated in blocks, so scans of any length can be written to disk or
+streamed over HTTP without being held in memory.
+
+Trajectory specs are dictionaries:
+    {'mode': 'Q', 'hkl': [h, k, l], 'omega': [start, stop], 'n': points}
+    {'mode': 'E', 'hkl': [[h, k, l], [h, k, l]], 'omega': value, 'n': points}
+"""
+
+import io
+
+import numpy as np
+import lattice_utils as lu
+import planning as pla
+import coverage as cov
+
+SCAN_dtype = np.dtype([('scan', int), ('hkl', float, (3,)), ('omega', float), ('two_theta', float),
+                       ('theta', float), ('Ei', float), ('Ef', float), ('reachable', bool)])
+CSV_HEADER = 'scan,h,k,l,omega,two_theta,theta,Ei,Ef,reachable'
+
+
+def spec_length(spec):
+    """
+    Number of points of a trajectory spec.
+    """
+    return int(spec['n'])
+
+
+def trajectory(spec, start=0, stop=None):
+    """
+    Returns the hkl, shape (N,3), and energy transfers of points start to stop of a trajectory spec.
+    """
+    n = spec_length(spec)
+    stop = n if stop is None else min(stop, n)
+    # fraction along the trajectory, without building the whole scan
+    t = np.arange(start, stop)/max(n - 1, 1)
+    if spec['mode'] == 'Q':
+        omega = np.asarray(spec['omega'], dtype=float)
+        hkl = np.broadcast_to(np.asarray(spec['hkl'], dtype=float), (t.size, 3))
+        return hkl, omega[0] + t*(omega[-1] - omega[0])
+    elif spec['mode'] == 'E':
+        hkl = np.asarray(spec['hkl'], dtype=float)
+        return hkl[0] + t[:, np.newaxis]*(hkl[-1] - hkl[0]), np.full(t.size, float(spec['omega']))
+    raise ValueError('scan mode must be "Q" (constant Q) or "E" (constant energy transfer)')
+
+
+def scan_points(latt, u, v, hkl, omega, Efixed, E, tth_range=(5., 135.), th_range=(-180., 180.)):
+    """
+    Spectrometer settings for many (hkl, omega) points at once
+    Returns a structured array with fields scan, hkl, omega, two_theta and theta (degrees,
+    NaN where the scattering triangle does not close, the energy transfer is forbidden or
+    hkl is out of the (u, v) plane), Ei and Ef (meV) and reachable, which is in addition
+    False for points outside the angle ranges
+    Arguments:
+    latt -- real space lattice object
+    u,v -- reciprocal lattice vectors defining the scattering plane
+    hkl -- Miller indicies of every point, shape (N,3)
+    omega -- energy transfer of every point, in meV
+    Efixed -- "Ei" or "Ef"
+    E -- the fixed energy, in meV
+    tth_range -- [min, max] scattering angle in degrees
+    th_range -- [min, max] sample angle in degrees
+    """
+    rlatt = lu.recip_lattice(latt)
+    hkl = np.atleast_2d(np.asarray(hkl, dtype=float))
+    omega = np.broadcast_to(np.asarray(omega, dtype=float), hkl.shape[:1])
+    modu, modv, X, Y = cov.scattering_plane(rlatt, u, v)
+    qx = rlatt.dot(hkl, X)
+    qy = rlatt.dot(hkl, Y)
+    # the out-of-plane part of Q that the spectrometer cannot reach
+    q_out = np.sqrt(np.maximum(rlatt.dot(hkl, hkl) - qx**2 - qy**2, 0))
+    allowed = q_out < 1e-6*np.maximum(np.hypot(qx, qy), 1)
+    ki, kf, energy_allowed = pla._wavevectors(Efixed, E, omega)
+    allowed &= energy_allowed
+    tth, th, mask = cov.accessible(qx, qy, ki, kf, tth_range, th_range)
+
+    out = np.empty(hkl.shape[0], dtype=SCAN_dtype)
+    out['scan'] = 0
+    out['hkl'] = hkl
+    out['omega'] = omega
+    out['two_theta'] = np.where(allowed, tth, np.nan)
+    out['theta'] = np.where(allowed, th, np.nan)
+    out['Ei'] = 2.072*ki**2
+    out['Ef'] = 2.072*kf**2
+    out['reachable'] = mask & allowed
+    return out
+
+
+def iter_scans(latt, u, v, specs, Efixed, E, tth_range=(5., 135.), th_range=(-180., 180.), block=65536):
+    """
+    Yield the points of a list of trajectory specs as structured arrays of at most block points.
+    """
+    for number, spec in enumerate(specs):
+        for start in range(0, spec_length(spec), block):
+            hkl, omega = trajectory(spec, start, start + block)
+            points = scan_points(latt, u, v, hkl, omega, Efixed, E, tth_range, th_range)
+            points['scan'] = number
+            yield points
+
+
+def csv_chunks(blocks):
+    """
+    Yield CSV text, the header first and then one string per block of scan points.
+    """
+    yield CSV_HEADER + '\n'
+    for points in blocks:
+        buffer = io.StringIO()
+        columns = np.column_stack([points['scan'], points['hkl'], points['omega'], points['two_theta'],
+                                   points['theta'], points['Ei'], points['Ef'], points['reachable']])
+        np.savetxt(buffer, columns, fmt=['%d'] + ['%.6g']*4 + ['%.4f']*4 + ['%d'], delimiter=',')
+        yield buffer.getvalue()
+
+
+def write_scans(path, latt, u, v, specs, Efixed, E, tth_range=(5., 135.), th_range=(-180., 180.), block=65536):
+    """
+    Write the points of a list of trajectory specs to a CSV file block by block.
+    Returns the number of points written.
+    """
+    with open(path, 'w') as f:
+        for text in csv_chunks(iter_scans(latt, u, v, specs, Efixed, E, tth_range, th_range, block)):
+            f.write(text)
+    return sum(spec_length(spec) for spec in specs)
@@ -0,0 +1,175 @@
+"""
+Spurion and higher-order contamination checks for planned scans.
+
+Every scan point is described by its scattering angle and its incident and
+final wavelengths. A point is flagged when a powder line of a contaminant
+(sample environment aluminium or copper by default; the sample itself only
+on request, as a single crystal has no powder lines) satisfies the Bragg
+condition within a tolerance for lambda/n on the incident (ki) or the final
+(kf) side, the orders n that monochromator and analyser pass along with the
+fundamental. The powder lines of all contaminants are merged into one list
+sorted by d, so each (side, order) pair costs a single searchsorted over all
+scan points. The lines of every material are derived once per |Q| bucket from
+its reflection_cache table and kept in memory.
+"""
+
+import collections
+import threading
+
+import numpy as np
+import lattice_utils as lu
+import planning as pla
+import reflection_cache
+
+SIDES = ('ki', 'kf')
+
+# cubic cells of common sample environment materials with their centring
+CONTAMINANTS = {
+    'Al': (lu.lattice(4.0498, 4.0498, 4.0498, 90, 90, 90), 'F'),
+    'Cu': (lu.lattice(3.6149, 3.6149, 3.6149, 90, 90, 90), 'F'),
+}
+
+
+CACHE_SIZE = 64
+
+_lines = collections.OrderedDict()
+_lines_lock = threading.Lock()
+
+
+def _merge(rows, decimals):
+    # one line per distinct d, represented by the hkl with the largest indicies, sorted by increasing d
+    d = np.round(np.asarray(rows['d']), decimals)
+    hkl = np.asarray(rows['hkl'])
+    order = np.lexsort((-hkl[:, 2], -hkl[:, 1], -hkl[:, 0], d))
+    first = order[np.concatenate([[True], np.diff(d[order]) != 0])] if order.size else order
+    return np.asarray(rows['d'])[first], hkl[first]
+
+
+def material_lines(latt, centring='P', d_min=0.5, decimals=6):
+    """
+    Powder lines of one material with d >= d_min, sorted by increasing d
+    Returns the d spacings and representative hkl. Lines are computed from the reflection_cache
+    table of the material for |Q| up to 2 pi/d_min rounded up to a whole inverse angstrom, and
+    kept in memory for the CACHE_SIZE most recently used materials and buckets
+    Arguments:
+    latt -- real space lattice object
+    centring -- centring letter used to remove systematically absent reflections
+    d_min -- smallest d spacing, in angstroms
+    decimals -- reflections whose d spacings agree to this many decimals are merged
+    """
+    bucket = max(int(np.ceil(2*np.pi/d_min)), 1)
+    key = (reflection_cache.cell_key(latt, centring), bucket, decimals)
+    with _lines_lock:
+        found = _lines.get(key)
+        if found is not None:
+            _lines.move_to_end(key)
+    if found is None:
+        found = _merge(reflection_cache.q_range(reflection_cache.table(latt, bucket, centring), 0., bucket),
+                       decimals)
+        with _lines_lock:
+            _lines[key] = found
+            while len(_lines) > CACHE_SIZE:
+                _lines.popitem(last=False)
+    d, hkl = found
+    start = np.searchsorted(d, d_min, side='left')
+    return d[start:], hkl[start:]
+
+
+def contaminant_lines(contaminants=None, d_min=0.5):
+    """
+    Merge the powder lines of several materials into one table sorted by d spacing
+    Returns a dictionary of d, hkl, the index of the material of every line and the material names
+    Arguments:
+    contaminants -- dictionary of name: (lattice, centring), defaults to CONTAMINANTS
+    d_min -- smallest d spacing considered, in angstroms
+    """
+    contaminants = CONTAMINANTS if contaminants is None else contaminants
+    names = list(contaminants)
+    d, hkl, source = [np.empty(0)], [np.empty((0, 3), dtype=int)], [np.empty(0, dtype=int)]
+    for i, name in enumerate(names):
+        latt, centring = contaminants[name]
+        d_material, hkl_material = material_lines(latt, centring, d_min)
+        d.append(d_material)
+        hkl.append(hkl_material)
+        source.append(np.full(d_material.size, i))
+    d, hkl, source = np.concatenate(d), np.concatenate(hkl), np.concatenate(source)
+    order = np.argsort(d)
+    return {'d': d[order], 'hkl': hkl[order], 'source': source[order], 'names': names}
+
+
+def scan_wavelengths(Efixed, E, omega):
+    """
+    Return the incident and final wavelengths, in angstroms, of scan points with energy transfers omega
+    """
+    ki, kf, valid = pla._wavevectors(Efixed, E, omega)
+    with np.errstate(divide='ignore'):
+        return np.where(valid, 2*np.pi/ki, np.nan), np.where(valid, 2*np.pi/kf, np.nan)
+
+
+def check(two_theta, wl_i, wl_f=None, contaminants=None, orders=(1, 2, 3), tolerance=0.5, lines=None):
+    """
+    Flag scan points where a contaminant powder line is in Bragg condition at lambda/n
+    Returns a dictionary of arrays with the broadcast shape of the inputs:
+    flagged -- True where any line is within the tolerance
+    delta -- 2theta distance in degrees to the closest line over all sides and orders
+    name, hkl, d -- material, representative reflection and d spacing of the closest line
+    order, side -- harmonic n and 'ki' or 'kf' of the closest line
+    Arguments:
+    two_theta -- scattering angle of every point, in degrees
+    wl_i, wl_f -- incident and final wavelengths in angstroms, wl_f defaults to wl_i (elastic)
+    contaminants -- dictionary of name: (lattice, centring), defaults to CONTAMINANTS
+    orders -- harmonics n of lambda/n to check
+    tolerance -- largest 2theta distance in degrees that is flagged
+    lines -- precomputed contaminant_lines(), to reuse between calls
+    """
+    wl_f = wl_i if wl_f is None else wl_f
+    two_theta, wl_i, wl_f = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (two_theta, wl_i, wl_f)])
+    shape = two_theta.shape
+    sin_theta = np.sin(np.deg2rad(two_theta.ravel())/2)
+    wavelengths = {'ki': wl_i.ravel(), 'kf': wl_f.ravel()}
+    if lines is None:
+        # the shortest wavelength at 2theta = 180 bounds the smallest d that can diffract
+        shortest = np.nanmin(np.concatenate([wl_i.ravel(), wl_f.ravel(), [np.inf]]))/max(orders)
+        lines = contaminant_lines(contaminants, d_min=shortest/2 if np.isfinite(shortest) else 0.5)
+    d_lines = lines['d']
+
+    best = np.full(sin_theta.size, np.inf)
+    best_line = np.zeros(sin_theta.size, dtype=int)
+    best_order = np.zeros(sin_theta.size, dtype=int)
+    best_side = np.full(sin_theta.size, -1)
+    for side, name in enumerate(SIDES if d_lines.size else ()):
+        for n in orders:
+            wl = wavelengths[name]/n
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d_needed = wl/(2*sin_theta)
+            # the line closest in 2theta is one of the two neighbours of d_needed in the sorted list
+            upper = np.minimum(np.searchsorted(d_lines, d_needed), d_lines.size - 1)
+            lower = np.maximum(upper - 1, 0)
+            with np.errstate(invalid='ignore'):
+                delta_upper = np.abs(2*np.rad2deg(np.arcsin(wl/(2*d_lines[upper]))) - two_theta.ravel())
+                delta_lower = np.abs(2*np.rad2deg(np.arcsin(wl/(2*d_lines[lower]))) - two_theta.ravel())
+            # lines that cannot diffract at this wavelength give NaN and never win
+            use_lower = delta_lower < np.where(np.isnan(delta_upper), np.inf, delta_upper)
+            j = np.where(use_lower, lower, upper)
+            delta = np.where(use_lower, delta_lower, delta_upper)
+            closer = delta < best
+            best = np.where(closer, delta, best)
+            best_line = np.where(closer, j, best_line)
+            best_order = np.where(closer, n, best_order)
+            best_side = np.where(closer, side, best_side)
+
+    found = np.isfinite(best)
+    # index -1 picks the trailing empty entry for points without any line
+    pick = np.where(found, best_line, -1)
+    source = np.append(lines['source'], -1)[pick]
+    d = np.append(d_lines, np.nan)[pick]
+    hkl = np.vstack([lines['hkl'], np.zeros((1, 3), dtype=int)])[pick]
+    return {
+        'flagged': (best <= tolerance).reshape(shape),
+        'delta': np.where(found, best, np.nan).reshape(shape),
+        'name': np.array(lines['names'] + [''], dtype=object)[source].reshape(shape),
+        'hkl': hkl.reshape(shape + (3,)),
+        'd': d.reshape(shape),
+        'order': best_order.reshape(shape),
+        'side': np.array(SIDES + ('',), dtype=object)[best_side].reshape(shape),
+    }
@@ -0,0 +1,219 @@
+"""
+Non-interactive lattice-parameter sweeps.
+
+Each cell of a sweep (reciprocal cell, powder reflections with their Bragg
+angles, Brillouin zone) is processed in a worker process and the results are
+streamed to JSONL, CSV or Parquet in the order they finish.
+
+Examples:
+    python sweep.py --a 4.00:4.10:101 --b 4.05 --c 3.0 --wavelength 2.36 -o sweep.jsonl
+    python sweep.py --input cells.csv --space-group 225 --workers 8 -o cells.parquet
+
+Input files (CSV or JSONL) have one cell per row with the columns a, b, c,
+alpha, beta, gamma and optionally space_group, wavelength and any label
+columns (e.g. temperature), which are copied to the output unchanged.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import lattice_utils as lu
+import powder
+from BZdrawer import BZ
+
+CELL_FIELDS = ('a', 'b', 'c', 'alpha', 'beta', 'gamma')
+# input fields echoed to the output as numbers rather than as the strings read from CSV
+FLOAT_FIELDS = CELL_FIELDS + ('wavelength',)
+INTEGER_FIELDS = ('space_group', 'h', 'k', 'l')
+
+
+def process_cell(row, tth_max=150., max_peaks=50):
+    """
+    Compute the per-cell results for one row of the sweep and return them as a flat record.
+    """
+    lattice = lu.lattice(*(float(row[name]) for name in CELL_FIELDS))
+    recip_lattice = lu.recip_lattice(lattice)
+    space_group = int(float(row.get('space_group', 1)))
+    bravais_type = lu.SG_BRAVAIS_MAP.get(space_group, 'P')
+    wavelength = float(row['wavelength'])
+
+    lines = powder.reflections(lattice, wavelength, bravais_type, tth_max)
+    peaks = [{'hkl': hkl, 'd': round(d, 6), 'two_theta': round(tth, 4), 'multiplicity': m}
+             for hkl, d, tth, m in zip(lines['hkl'][:max_peaks].tolist(), lines['d'][:max_peaks].tolist(),
+                                       lines['two_theta'][:max_peaks].tolist(),
+                                       lines['multiplicity'][:max_peaks].tolist())]
+
+    kvector = lu.primitive_kvector(lu.basis_vectors(recip_lattice), bravais_type)
+    brillouin_zone = BZ(kvector)
+    brillouin_zone.bulkBZ()
+
+    record = dict(row)
+    record.update({
+        'a_star': recip_lattice.a, 'b_star': recip_lattice.b, 'c_star': recip_lattice.c,
+        'alpha_star': float(np.rad2deg(recip_lattice.aa)),
+        'beta_star': float(np.rad2deg(recip_lattice.bb)),
+        'gamma_star': float(np.rad2deg(recip_lattice.cc)),
+        'volume': float(lattice.volume),
+        'bravais_type': bravais_type,
+        'n_lines': int(lines['d'].size),
+        'n_reflections': int(lines['multiplicity'].sum()),
+        'bz_vertices': len(brillouin_zone.hs_points),
+        'bz_edges': len(brillouin_zone.hs_lines_f),
+        # the zone has the volume of the primitive reciprocal cell
+        'bz_volume': float(abs(np.linalg.det(kvector))),
+        'peaks': peaks,
+    })
+    return record
+
+
+def _parse_range(text):
+    # "start:stop:num" is a linspace, anything else a comma separated list of values
+    if ':' in text:
+        start, stop, num = text.split(':')
+        return np.linspace(float(start), float(stop), int(num)).tolist()
+    return [float(value) for value in text.split(',')]
+
+
+def _coerce(row):
+    # parameters read from files become numbers; label columns are kept as they are
+    row = dict(row)
+    for name in FLOAT_FIELDS:
+        if row.get(name) is not None:
+            row[name] = float(row[name])
+    for name in INTEGER_FIELDS:
+        if row.get(name) is not None:
+            row[name] = int(float(row[name]))
+    return row
+
+
+def sweep_rows(args):
+    """
+    Yield the input rows described by the command line arguments.
+    """
+    defaults = {'space_group': args.space_group, 'wavelength': args.wavelength}
+    if args.input:
+        with open(args.input, newline='') as f:
+            if args.input.endswith('.jsonl'):
+                rows = (json.loads(line) for line in f if line.strip())
+            else:
+                rows = csv.DictReader(f)
+            for row in rows:
+                yield _coerce({**defaults, **{k: v for k, v in row.items() if v not in (None, '')}})
+        return
+    ranges = [_parse_range(getattr(args, name)) for name in CELL_FIELDS]
+    for values in itertools.product(*ranges):
+        yield _coerce({**defaults, **dict(zip(CELL_FIELDS, values))})
+
+
+class _Writer:
+    # streams records to JSONL, CSV or Parquet depending on the file extension
+
+    def __init__(self, path, batch=1000):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lstrip('.').lower() if path != '-' else 'jsonl'
+        self.batch = batch
+        self.pending = []
+        self.fields = None
+        self._parquet = None
+        if self.format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise SystemExit('writing Parquet requires pyarrow')
+            self.file = None
+        elif self.format in ('jsonl', 'csv'):
+            self.file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        else:
+            raise SystemExit(f'unknown output format: {path}')
+
+    def write(self, record):
+        if self.format == 'jsonl':
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            return
+        record = {k: json.dumps(v) if isinstance(v, (list, dict)) else v for k, v in record.items()}
+        if self.format == 'csv':
+            if self.fields is None:
+                self.fields = list(record)
+                self._csv = csv.DictWriter(self.file, self.fields, extrasaction='ignore')
+                self._csv.writeheader()
+            self._csv.writerow(record)
+            self.file.flush()
+            return
+        self.pending.append(record)
+        if len(self.pending) >= self.batch:
+            self._flush_parquet()
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self.pending:
+            return
+        table = pa.Table.from_pylist(self.pending)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table.cast(self._parquet.schema))
+        self.pending = []
+
+    def close(self):
+        if self.format == 'parquet':
+            self._flush_parquet()
+            if self._parquet is not None:
+                self._parquet.close()
+        elif self.file is not sys.stdout:
+            self.file.close()
+
+
+def run(rows, writer, workers=None, tth_max=150., max_peaks=50):
+    """
+    Process rows on a pool of worker processes and write each record as soon as it is done.
+    Returns the number of cells processed.
+    """
+    workers = workers or os.cpu_count()
+    done_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = iter(rows)
+        pending = set()
+        # keep a bounded number of cells in flight so that huge sweeps are never materialised
+        for row in itertools.islice(rows, 4*workers):
+            pending.add(pool.submit(process_cell, row, tth_max, max_peaks))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                writer.write(future.result())
+                done_count += 1
+            for row in itertools.islice(rows, len(done)):
+                pending.add(pool.submit(process_cell, row, tth_max, max_peaks))
+    return done_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--input', help='CSV or JSONL file with one cell per row')
+    for name, default in zip(CELL_FIELDS, ('4.0', '4.0', '4.0', '90', '90', '90')):
+        parser.add_argument(f'--{name}', default=default, help='value, comma separated list or start:stop:num')
+    parser.add_argument('--space-group', type=int, default=1, help='default space group number')
+    parser.add_argument('--wavelength', type=float, default=2.36, help='default wavelength in angstroms')
+    parser.add_argument('--tth-max', type=float, default=150., help='largest 2theta of the reflection list')
+    parser.add_argument('--max-peaks', type=int, default=50, help='number of powder lines kept per cell')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to all cores')
+    parser.add_argument('-o', '--output', default='-', help='output .jsonl, .csv or .parquet file, - for stdout')
+    args = parser.parse_args(argv)
+
+    writer = _Writer(args.output)
+    try:
+        count = run(sweep_rows(args), writer, args.workers, args.tth_max, args.max_peaks)
+    finally:
+        writer.close()
+    print(f'{count} cells processed', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import crystal
+import kpath
+from BZdrawer import BZ
+import lattice_utils as lu
+
+CELLS = {
+    'P': (3.9, 4.3, 5.1, 88., 93., 97.),
+    'C': (5.2, 7.9, 4.4, 90., 104., 90.),
+    'A': (4.4, 5.2, 7.9, 90., 90., 90.),
+    'I': (4.1, 4.1, 6.3, 90., 90., 90.),
+    'F': (4.02, 4.02, 4.02, 90., 90., 90.),
+    'R': (4.9, 4.9, 13.8, 90., 90., 120.),
+}
+LATTICE_POINTS = {'P': 1, 'C': 2, 'A': 2, 'I': 2, 'F': 4, 'R': 3}
+
+
+def conventional(centring):
+    latt = lu.lattice(*CELLS[centring])
+    return latt, lu.basis_vectors(lu.recip_lattice(latt))
+
+
+@pytest.mark.parametrize('centring', sorted(CELLS))
+def test_primitive_kvector_volume(centring):
+    latt, B = conventional(centring)
+    kvector = lu.primitive_kvector(B, centring)
+    assert abs(np.linalg.det(kvector)) == pytest.approx((2*np.pi)**3*LATTICE_POINTS[centring]/latt.volume)
+
+
+@pytest.mark.parametrize('centring', sorted(CELLS))
+def test_primitive_kvector_is_allowed_hkl(centring):
+    _, B = conventional(centring)
+    hkl = lu.primitive_kvector(B, centring) @ np.linalg.inv(B)
+    assert np.allclose(hkl, np.rint(hkl))
+    assert lu.centring_allowed(np.rint(hkl).astype(int), centring).all()
+
+
+def test_fcc_path_points():
+    _, B = conventional('F')
+    points = kpath.special_points(lu.primitive_kvector(B, 'F'))
+    assert points['family'] == 'cF'
+    hkl = points['points'] @ np.linalg.inv(B)
+    for label, expected in (('X', (1, 0, 0)), ('L', (0.5, 0.5, 0.5))):
+        assert np.any(np.all(np.isclose(hkl[points['labels'] == label], expected), axis=1)), label
+
+
+@pytest.mark.parametrize('centring', ['P', 'I', 'F', 'C', 'R'])
+def test_fold_gives_lattice_vectors(centring):
+    _, B = conventional(centring)
+    brillouin_zone = BZ(lu.primitive_kvector(B, centring))
+    hkl = np.random.default_rng(0).uniform(-4, 4, (500, 3))
+    k, G = brillouin_zone.fold(hkl, basis=B)
+    assert np.allclose(G, np.rint(G), atol=1e-9)
+    assert lu.centring_allowed(np.rint(G).astype(int), centring).all()
+    assert np.allclose(k + G, hkl)
+
+
+@pytest.mark.parametrize('centring, family', [('P', None), ('C', None), ('A', 'ORCC'), ('I', 'BCT2'), ('F', 'cF'),
+                                               ('R', 'RHL1')])
+def test_special_points_of_centred_lattices(centring, family):
+    _, B = conventional(centring)
+    kvector = lu.primitive_kvector(B, centring)
+    points = kpath.special_points(kvector, conventional=B, centring=centring)
+    assert points['family'] == family
+    assert points['labelled'] == (family is not None)
+    # every special point lies on the zone boundary
+    N = crystal.voronoi_vectors(crystal.selling_reduce(kvector))
+    half = 0.5*np.sum(N**2, axis=1)
+    excess = (points['points'][1:] @ N.T - half).max(axis=1)
+    assert np.allclose(excess, 0, atol=1e-9*half.max())
+    kpath.k_path(kvector, 50, basis=B, centring=centring)
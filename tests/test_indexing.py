@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import indexing
+import lattice_utils as lu
+
+WAVELENGTH = 0.8
+ALUMINIUM = lu.lattice(4.0498, 4.0498, 4.0498, 90., 90., 90.)
+
+
+def first_lines(n):
+    # 2theta of the first n distinct fcc lines of aluminium, from h^2+k^2+l^2
+    s = sorted({h*h + k*k + l*l for h in range(12) for k in range(12) for l in range(12)
+                if (h + k) % 2 == 0 and (k + l) % 2 == 0 and h + k + l > 0})
+    d = 4.0498/np.sqrt(np.array(s, dtype=float))
+    d = d[WAVELENGTH/(2*d) <= 1]
+    assert d.size >= n
+    return 2*np.degrees(np.arcsin(WAVELENGTH/(2*d[:n])))
+
+
+def test_candidates_of_known_pattern(tmp_path):
+    tth = first_lines(3)
+    found = indexing.index_peaks(ALUMINIUM, tth, WAVELENGTH, 0.05, 'F', directory=str(tmp_path))
+    counts = np.diff(found['offsets'])
+    # 111, 200 and 220 with their multiplicities
+    assert counts.tolist() == [8, 6, 12]
+    assert np.allclose(found['residual'], 0, atol=1e-9)
+    assert sorted(np.abs(found['hkl'][0])) == [1, 1, 1]
+
+
+def test_m20(tmp_path):
+    tth = first_lines(20)
+    # alternating errors of 0.01 degrees
+    observed = tth + 0.01*(-1)**np.arange(20)
+    found = indexing.index_peaks(ALUMINIUM, observed, WAVELENGTH, 0.05, 'F', directory=str(tmp_path))
+    assert found['N'] == 20 and found['N_poss'] == 20
+    assert found['mean_residual'] == pytest.approx(0.01)
+    assert found['fom'] == pytest.approx(20/(0.01*20))
+
+
+def test_m20_zero_residual_is_finite(tmp_path):
+    found = indexing.index_peaks(ALUMINIUM, first_lines(20), WAVELENGTH, 0.05, 'F', directory=str(tmp_path))
+    assert found['mean_residual'] == pytest.approx(0, abs=1e-9)
+    assert found['fom'] == pytest.approx(20/(indexing.RESIDUAL_FLOOR*20))
+
+
+def test_unindexed_peaks(tmp_path):
+    found = indexing.index_peaks(ALUMINIUM, [5.], WAVELENGTH, 0.05, 'F', directory=str(tmp_path))
+    assert found['N'] == 0 and np.isnan(found['fom'])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import lattice_utils as lu
+import powder
+
+A = 4.0498
+WAVELENGTH = 1.5
+ALUMINIUM = lu.lattice(A, A, A, 90., 90., 90.)
+# the first fcc lines with their multiplicities
+LINES = [((1, 1, 1), 8), ((2, 0, 0), 6), ((2, 2, 0), 12), ((3, 1, 1), 24), ((2, 2, 2), 8)]
+
+
+def expected_two_theta(hkl):
+    d = A/np.sqrt(np.sum(np.square(hkl)))
+    return 2*np.degrees(np.arcsin(WAVELENGTH/(2*d)))
+
+
+def test_reflections_of_cubic_pattern():
+    table = powder.reflections(ALUMINIUM, WAVELENGTH, 'F', tth_max=90.)
+    assert np.allclose(table['two_theta'], [expected_two_theta(hkl) for hkl, _ in LINES])
+    assert table['multiplicity'].tolist() == [m for _, m in LINES]
+    assert [sorted(np.abs(hkl)) for hkl in table['hkl'].tolist()] == [sorted(hkl) for hkl, _ in LINES]
+
+
+def test_peak_positions_and_integrated_intensity():
+    grid = np.linspace(20., 140., 24001)
+    fwhm = 0.5
+    pattern, table = powder.powder_pattern(ALUMINIUM, WAVELENGTH, grid, centring='F',
+                                           resolution=lambda tth: np.full(np.shape(tth), fwhm))
+    step = grid[1] - grid[0]
+    for (hkl, multiplicity), tth in zip(LINES, table['two_theta']):
+        window = np.abs(grid - tth) <= 3*fwhm
+        assert grid[window][np.argmax(pattern[window])] == pytest.approx(expected_two_theta(hkl), abs=step)
+        theta = np.radians(tth)/2
+        lorentz = 1/(np.sin(theta)*np.sin(2*theta))
+        # a Gaussian cut at +-3 FWHM keeps all but ~1e-11 of its area
+        assert pattern[window].sum()*step == pytest.approx(multiplicity*lorentz, rel=1e-3)
+
+
+def test_d_axis_matches_two_theta_axis():
+    grid = np.linspace(1.0, 3.0, 4001)
+    pattern, table = powder.powder_pattern(ALUMINIUM, WAVELENGTH, grid, axis='d', centring='F', lorentz=False)
+    for d, multiplicity in zip(table['d'], table['multiplicity']):
+        if grid[0] < d < grid[-1]:
+            window = np.abs(grid - d) < 0.02
+            assert grid[window][np.argmax(pattern[window])] == pytest.approx(d, abs=grid[1] - grid[0])
+
+
+def test_binned_and_windowed_accumulation_agree():
+    rng = np.random.default_rng(0)
+    centres = rng.uniform(10, 90, 200)
+    weights = rng.uniform(0.5, 2, 200)
+    grid = np.linspace(0, 100, 200001)
+    # 0.2 degree peaks span 400 grid points, so accumulate takes the binned path
+    binned = powder.accumulate(centres, 0.2, weights, grid)
+    windowed = powder._windowed(centres, np.full(200, 0.2), weights, grid, 3., 1000000)
+    assert np.allclose(binned, windowed, atol=1e-3*windowed.max())
+    assert binned.sum()*(grid[1] - grid[0]) == pytest.approx(weights.sum(), rel=1e-6)
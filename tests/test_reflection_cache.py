@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import lattice_utils as lu
+import reflection_cache
+
+
+@pytest.fixture
+def cell():
+    return lu.lattice(5.1, 6.3, 7.2, 90., 101., 90.)
+
+
+def test_table_is_sorted_and_complete(cell, tmp_path):
+    rows = reflection_cache.table(cell, 3.2, 'C', str(tmp_path))
+    hkl, modQ = lu.hkl_list(cell, 4., 'C')
+    assert rows.size == hkl.shape[0]
+    assert np.all(np.diff(rows['modQ']) >= 0)
+    assert np.allclose(rows['d'], 2*np.pi/rows['modQ'])
+    assert lu.centring_allowed(rows['hkl'], 'C').all()
+
+
+def test_range_queries(cell, tmp_path):
+    rows = reflection_cache.table(cell, 4., 'P', str(tmp_path))
+    q = np.asarray(rows['modQ'])
+    view = reflection_cache.q_range(rows, 1.5, 2.5)
+    assert np.array_equal(view['modQ'], q[(q >= 1.5) & (q <= 2.5)])
+    view = reflection_cache.d_range(rows, 2., 3.)
+    d = np.asarray(rows['d'])
+    assert np.array_equal(np.sort(view['d']), np.sort(d[(d >= 2.) & (d <= 3.)]))
+    # searches run on the contiguous mapped key array, not on a copy of the strided field
+    keys = reflection_cache.sorted_q(rows)
+    assert isinstance(keys, np.memmap) and keys.flags['C_CONTIGUOUS']
+
+
+def test_tables_are_reused(cell, tmp_path):
+    rows = reflection_cache.table(cell, 2.5, 'P', str(tmp_path))
+    assert reflection_cache.table(cell, 2.1, 'P', str(tmp_path)) is rows
+    assert reflection_cache.table(cell, 3.5, 'P', str(tmp_path)) is not rows
+
+
+def test_open_maps_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(reflection_cache, 'CACHE_SIZE', 3)
+    for a in (3., 3.1, 3.2, 3.3, 3.4):
+        reflection_cache.table(lu.lattice(a, a, a, 90., 90., 90.), 2., 'P', str(tmp_path))
+    assert len(reflection_cache._open) <= 3
+
+
+def test_two_theta(cell, tmp_path):
+    rows = reflection_cache.table(cell, 3., 'P', str(tmp_path))
+    tth = reflection_cache.two_theta(rows, 2.)
+    assert np.allclose(tth[np.isfinite(tth)], 2*np.degrees(np.arcsin(2./(2*rows['d'][np.isfinite(tth)]))))
+    assert np.all(np.isnan(tth[2.*rows['modQ']/(4*np.pi) > 1]))
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import resolution as res
+
+K = 2.662 # 14.7 meV
+
+
+def test_elastic_scattering_angle_and_matrices():
+    modQ = np.linspace(0.5, 4.5, 9)
+    out = res.resolution(K, K, modQ)
+    assert out['valid'].all()
+    # Bragg's law for ki = kf
+    assert np.allclose(out['two_theta'], 2*np.degrees(np.arcsin(modQ/(2*K))))
+    cov = out['cov']
+    assert cov.shape == (9, 4, 4)
+    assert np.allclose(cov, np.swapaxes(cov, 1, 2))
+    assert (np.linalg.eigvalsh(cov) > 0).all()
+    assert np.allclose(out['M'] @ cov, np.eye(4), atol=1e-8)
+    assert np.allclose(out['fwhm'], res.SIGMA*np.sqrt(np.diagonal(cov, axis1=1, axis2=2)))
+
+
+def test_invalid_kinematics_are_flagged():
+    # Q beyond ki + kf, and ki below the PG(002) cutoff pi/dm
+    out = res.resolution([K, K, 0.9], [K, K, 0.9], [1., 2*K + 0.1, 1.])
+    assert out['valid'].tolist() == [True, False, False]
+    assert np.isnan(out['cov'][1:]).all() and np.isnan(out['two_theta'][1:]).all()
+    assert np.isfinite(out['cov'][0]).all()
+
+
+def test_sample_mosaic_widens_transverse_only():
+    modQ = np.array([1., 2., 3.])
+    sharp = res.resolution(K, K, modQ, {'eta_s': 1e-6, 'eta_s_v': 1e-6})['cov']
+    broad = res.resolution(K, K, modQ, {'eta_s': 40., 'eta_s_v': 60.})['cov']
+    delta = broad - sharp
+    assert np.allclose(delta[:, 1, 1], (modQ*40*res.ARCMIN/res.SIGMA)**2)
+    assert np.allclose(delta[:, 2, 2], (modQ*60*res.ARCMIN/res.SIGMA)**2)
+    delta[:, 1, 1] = delta[:, 2, 2] = 0
+    assert np.allclose(delta, 0, atol=1e-15)
+
+
+def test_blocks_and_broadcasting():
+    ki = np.full((3, 1), K)
+    kf = np.linspace(2.2, 3.0, 3)[:, np.newaxis]
+    modQ = np.linspace(0.5, 4., 50)
+    whole = res.resolution(ki, kf, modQ)
+    blocked = res.resolution(ki, kf, modQ, budget=3*400*8)
+    assert whole['cov'].shape == (3, 50, 4, 4)
+    assert np.array_equal(whole['valid'], blocked['valid'])
+    assert np.allclose(whole['cov'], blocked['cov'], equal_nan=True)
+
+
+def test_in_plane_and_outline():
+    cov = res.resolution(K, K, 2.)['cov']
+    assert np.allclose(res.in_plane(cov, 0., 1., 1.), cov[:2, :2])
+    modu, modv = 1.5, 0.75
+    cov2 = res.in_plane(cov, 30., modu, modv)
+    x, y = res.ellipse_outline(1., 2., cov2, n=33)
+    assert x.shape == y.shape == (33,)
+    # the outline is the half-maximum contour of the projected gaussian
+    d = np.stack([x - 1., y - 2.])
+    assert np.allclose(np.einsum('in,ij,jn->n', d, np.linalg.inv(cov2), d), 2*np.log(2))
+    x, y = res.ellipse_outline([0.], [0.], np.full((1, 2, 2), np.nan))
+    assert np.isnan(x).all() and np.isnan(y).all()
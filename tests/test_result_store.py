@@ -0,0 +1,105 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import result_store
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_store.time, 'time', clock)
+    return clock
+
+
+def accessed(store, key):
+    with sqlite3.connect(store.path) as conn:
+        return conn.execute('SELECT accessed FROM results WHERE key = ?', (key,)).fetchone()[0]
+
+
+def test_round_trip(tmp_path):
+    store = result_store.ResultStore(str(tmp_path/'store.sqlite'))
+    arrays = {'B': np.arange(9.).reshape(3, 3), 'hkl': np.arange(12, dtype=np.int32).reshape(4, 3)}
+    store.put('key', 'cell', arrays)
+    found = store.get('key')
+    assert set(found) == {'B', 'hkl'}
+    assert found['hkl'].dtype == np.int32
+    assert all(np.array_equal(found[name], arrays[name]) for name in arrays)
+    assert store.get('missing') is None
+    assert store.stats()['cell']['count'] == 1
+
+
+def test_canonical_key():
+    key = result_store.canonical_key('bz', {'a': 1.0, 'b': [0.0, 2]})
+    # numerical noise, signed zeros, numpy scalars and key order do not change the key
+    assert result_store.canonical_key('bz', {'b': (np.float64(-0.0), np.int64(2)), 'a': 1.0 + 1e-13}) == key
+    assert result_store.canonical_key('bz', {'a': 1.0 + 1e-8, 'b': [0.0, 2]}) != key
+    assert result_store.canonical_key('cell', {'a': 1.0, 'b': [0.0, 2]}) != key
+
+
+def test_get_or_compute_computes_once(tmp_path):
+    store = result_store.ResultStore(str(tmp_path/'store.sqlite'))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'x': [1., 2.]}
+
+    first = store.get_or_compute('cell', {'a': 1.}, compute)
+    second = store.get_or_compute('cell', {'a': 1.}, compute)
+    assert len(calls) == 1
+    assert np.array_equal(first['x'], second['x'])
+
+
+def test_access_time_is_coarse(tmp_path, clock):
+    store = result_store.ResultStore(str(tmp_path/'store.sqlite'), access_resolution=60.)
+    store.put('key', 'cell', {'x': np.zeros(3)})
+    clock.now += 30
+    store.get('key')
+    assert accessed(store, 'key') == 1000.
+    clock.now += 31
+    store.get('key')
+    assert accessed(store, 'key') == 1061.
+
+
+def test_least_recently_used_rows_are_evicted(tmp_path, clock):
+    blob = {'x': np.zeros(1000)}
+    size = len(result_store._dumps(blob))
+    store = result_store.ResultStore(str(tmp_path/'store.sqlite'), max_bytes=int(2.5*size), access_resolution=0.)
+    store.put('a', 'cell', blob)
+    clock.now += 1
+    store.put('b', 'cell', blob)
+    clock.now += 1
+    store.get('a')
+    clock.now += 1
+    store.put('c', 'cell', blob)
+    assert store.get('b') is None
+    assert store.get('a') is not None and store.get('c') is not None
+    assert store.stats()['cell']['bytes'] <= store.max_bytes
+
+
+def test_clear_by_kind(tmp_path):
+    store = result_store.ResultStore(str(tmp_path/'store.sqlite'))
+    store.put('a', 'cell', {'x': np.zeros(1)})
+    store.put('b', 'bz', {'x': np.zeros(1)})
+    store.clear('cell')
+    assert store.get('a') is None and store.get('b') is not None
+    store.clear()
+    assert store.stats() == {}
+
+
+def test_schema_change_drops_results(tmp_path, monkeypatch):
+    path = str(tmp_path/'store.sqlite')
+    result_store.ResultStore(path).put('a', 'cell', {'x': np.zeros(1)})
+    assert result_store.ResultStore(path).get('a') is not None
+    monkeypatch.setattr(result_store, 'SCHEMA_VERSION', result_store.SCHEMA_VERSION + 1)
+    assert result_store.ResultStore(path).get('a') is None
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import lattice_utils as lu
+import powder
+import reflection_cache
+import spurions
+
+ALUMINIUM = spurions.CONTAMINANTS['Al']
+D_111 = 4.0498/np.sqrt(3)
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(reflection_cache, 'DEFAULT_DIR', str(tmp_path))
+    monkeypatch.setattr(spurions, '_lines', type(spurions._lines)())
+
+
+def bragg(wavelength, d):
+    return 2*np.degrees(np.arcsin(wavelength/(2*d)))
+
+
+def test_material_lines_match_powder_reflections():
+    latt, centring = ALUMINIUM
+    d, hkl = spurions.material_lines(latt, centring, d_min=0.9)
+    expected = powder.reflections(latt, 2*0.9, centring)
+    assert np.allclose(d, np.sort(expected['d']))
+    assert lu.centring_allowed(hkl, 'F').all()
+    assert np.allclose(4.0498/np.linalg.norm(hkl, axis=1), d)
+
+
+def test_material_lines_are_kept_in_memory(monkeypatch):
+    latt, centring = ALUMINIUM
+    first = spurions.material_lines(latt, centring, d_min=0.9)
+    monkeypatch.setattr(reflection_cache, 'table', lambda *args, **kwargs: pytest.fail('table rebuilt'))
+    # a different d_min in the same |Q| bucket reuses the lines
+    d, _ = spurions.material_lines(latt, centring, d_min=0.95)
+    assert np.array_equal(d, first[0][first[0] >= 0.95])
+
+
+def test_harmonics_on_either_side_are_flagged():
+    tth = bragg(2.0, D_111)
+    # Al 111 seen by lambda/2 on the incident side, and by the fundamental on the final side
+    out = spurions.check([tth, tth], [4.0, 3.37], [3.37, 2.0])
+    assert out['flagged'].tolist() == [True, True]
+    assert out['side'].tolist() == ['ki', 'kf']
+    assert out['name'].tolist() == ['Al', 'Al']
+    # lambda/n on the line d is lambda on d/n, and the nhnknl lines of fcc Al make orders tie
+    assert out['order'][0] == 2 and out['d'][0] == pytest.approx(D_111)
+    assert np.allclose(2*out['d']*out['order']*np.sin(np.radians(tth)/2), [4.0, 2.0])
+    assert np.allclose(out['delta'], 0, atol=1e-9)
+
+
+def test_clear_point_and_tolerance():
+    lines = spurions.contaminant_lines(d_min=0.5)
+    tth = bragg(2.0, D_111) + 0.3
+    near = spurions.check(tth, 2.0, orders=(1,), tolerance=0.5, lines=lines)
+    far = spurions.check(tth, 2.0, orders=(1,), tolerance=0.2, lines=lines)
+    assert near['flagged'] and not far['flagged']
+    assert near['delta'] == pytest.approx(far['delta'])
+    assert near['delta'] <= 0.3 + 1e-9
+
+
+def test_sample_lines_only_on_request():
+    assert set(spurions.CONTAMINANTS) == {'Al', 'Cu'}
+    sample = (lu.lattice(5.43, 5.43, 5.43, 90, 90, 90), 'F')
+    tth = bragg(2.5, 5.43/np.sqrt(3))
+    default = spurions.check(tth, 2.5, orders=(1,), tolerance=0.05)
+    with_sample = spurions.check(tth, 2.5, orders=(1,), tolerance=0.05,
+                                 contaminants=dict(spurions.CONTAMINANTS, sample=sample))
+    assert default['name'] != 'sample'
+    assert with_sample['flagged'] and with_sample['name'] == 'sample'
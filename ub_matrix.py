@@ -0,0 +1,168 @@
+"""
+UB-matrix sample orientation and four-circle angle calculation.
+
+Follows Busing & Levy (Acta Cryst. 22, 457 (1967)) with the 2 pi
+included in B: a reflection hkl has the scattering vector q_phi = UB hkl in
+the phi-axis frame, and the diffractometer rotations bring it into the
+laboratory as Omega X Phi q_phi. Angles are computed in the bisecting
+geometry, omega = 2theta/2, for any number of reflections at once.
+"""
+
+import numpy as np
+
+ANGLES = ('omega', 'chi', 'phi', 'tth')
+
+
+def B_matrix(latt):
+    """
+    Return the B matrix of a real space lattice, mapping hkl columns to Cartesian
+    reciprocal vectors in inverse angstroms (2 pi included).
+    """
+    return latt.B.T
+
+
+def _rot_z(angle):
+    # Busing-Levy sense for the omega and phi axes, angles in degrees
+    c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    zero, one = np.zeros_like(c), np.ones_like(c)
+    return np.stack([np.stack([c, s, zero], -1),
+                     np.stack([-s, c, zero], -1),
+                     np.stack([zero, zero, one], -1)], -2)
+
+
+def _rot_chi(angle):
+    c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    zero, one = np.zeros_like(c), np.ones_like(c)
+    return np.stack([np.stack([c, zero, s], -1),
+                     np.stack([zero, one, zero], -1),
+                     np.stack([-s, zero, c], -1)], -2)
+
+
+def phi_vectors(omega, chi, phi, tth):
+    """
+    Return unit scattering vectors in the phi-axis frame for measured
+    diffractometer angles, all in degrees, shape (N,3).
+    """
+    omega, chi, phi, tth = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in (omega, chi, phi, tth)])
+    theta = np.deg2rad(tth)/2
+    # direction of the scattering vector in the laboratory
+    q_lab = np.stack([np.cos(theta), -np.sin(theta), np.zeros_like(theta)], -1)
+    R = _rot_z(omega) @ _rot_chi(chi) @ _rot_z(phi)
+    return np.einsum('...ji,...j->...i', R, q_lab)
+
+
+def U_from_reflections(latt, hkl, angles, weights=None):
+    """
+    Orientation matrix U best aligning B hkl with the measured scattering directions
+    Two non-parallel reflections determine U; more reflections are combined in a
+    weighted least-squares (Kabsch) fit.
+    Arguments:
+    latt -- real space lattice object
+    hkl -- indexed reflections, shape (N,3) with N >= 2
+    angles -- dictionary of measured 'omega', 'chi', 'phi' and 'tth' arrays in degrees
+    weights -- optional weight of every reflection
+    """
+    hkl = np.atleast_2d(np.asarray(hkl, dtype=float))
+    if hkl.shape[0] < 2:
+        raise ValueError('at least two indexed reflections are needed to orient the sample')
+    q_c = hkl @ B_matrix(latt).T
+    q_c /= np.linalg.norm(q_c, axis=1)[:, np.newaxis]
+    u_phi = phi_vectors(*(angles[name] for name in ANGLES))
+    if weights is None:
+        weights = np.ones(hkl.shape[0])
+
+    H = (q_c*np.asarray(weights, dtype=float)[:, np.newaxis]).T @ u_phi
+    V, S, Wt = np.linalg.svd(H)
+    if S[1] < 1e-8*S[0]:
+        raise ValueError('the reflections are parallel and do not fix the orientation')
+    # keep U a proper rotation
+    D = np.diag([1., 1., np.sign(np.linalg.det(Wt.T @ V.T))])
+    return Wt.T @ D @ V.T
+
+
+def UB_from_reflections(latt, hkl, angles, weights=None):
+    """
+    Return the UB matrix of a sample from two or more indexed reflections.
+    """
+    return U_from_reflections(latt, hkl, angles, weights) @ B_matrix(latt)
+
+
+def refine_UB(hkl, angles, wavelength):
+    """
+    Unconstrained least-squares UB from three or more non-coplanar reflections,
+    for refining the lattice together with the orientation.
+    Arguments:
+    hkl -- indexed reflections, shape (N,3) with N >= 3
+    angles -- dictionary of measured 'omega', 'chi', 'phi' and 'tth' arrays in degrees
+    wavelength -- wavelength in angstroms
+    """
+    hkl = np.atleast_2d(np.asarray(hkl, dtype=float))
+    if hkl.shape[0] < 3:
+        raise ValueError('at least three reflections are needed to refine UB')
+    q_phi = phi_vectors(*(angles[name] for name in ANGLES))
+    q_phi *= (4*np.pi/wavelength*np.sin(np.deg2rad(np.asarray(angles['tth'], dtype=float))/2))[..., np.newaxis]
+    UBt, _, rank, _ = np.linalg.lstsq(hkl, q_phi, rcond=None)
+    if rank < 3:
+        raise ValueError('the reflections are coplanar and do not fix UB')
+    return UBt.T
+
+
+def _in_range(values, limits, period=None):
+    lo, hi = limits
+    if period is not None:
+        # wrap into [lo, lo + period) before comparing
+        values = lo + np.mod(values - lo, period)
+    return (values >= lo) & (values <= hi), values
+
+
+def four_circle_angles(UB, hkl, wavelength, limits=None):
+    """
+    Bisecting-geometry four-circle angles for many reflections
+    Returns a dictionary of 'omega', 'chi', 'phi' and 'tth' arrays in degrees (NaN where
+    the reflection is beyond the Ewald sphere) and a boolean 'reachable' mask. When
+    limits are given, the equivalent setting (chi -> 180 - chi, phi -> phi + 180) is
+    used wherever it is reachable and the first one is not.
+    Arguments:
+    UB -- orientation matrix
+    hkl -- reflections, shape (N,3)
+    wavelength -- wavelength in angstroms
+    limits -- optional dictionary of (min, max) ranges in degrees for any of 'omega', 'chi', 'phi', 'tth'
+    """
+    q_phi = np.asarray(hkl, dtype=float) @ np.asarray(UB).T
+    modQ = np.linalg.norm(q_phi, axis=-1)
+    sin_theta = wavelength*modQ/(4*np.pi)
+    valid = (sin_theta <= 1) & (modQ > 0)
+    theta = np.rad2deg(np.arcsin(np.clip(sin_theta, 0, 1)))
+
+    tth = np.where(valid, 2*theta, np.nan)
+    omega = np.where(valid, theta, np.nan)
+    phi = np.rad2deg(np.arctan2(q_phi[..., 1], q_phi[..., 0]))
+    chi = np.rad2deg(np.arctan2(q_phi[..., 2], np.hypot(q_phi[..., 0], q_phi[..., 1])))
+
+    reachable = valid.copy()
+    if limits:
+        def check(chi, phi):
+            ok = valid.copy()
+            wrapped = {}
+            for name, values, period in (('omega', omega, None), ('tth', tth, None),
+                                         ('chi', chi, 360.), ('phi', phi, 360.)):
+                if name in limits:
+                    inside, values = _in_range(values, limits[name], period)
+                    ok &= inside
+                wrapped[name] = values
+            return ok, wrapped
+
+        ok1, first = check(chi, phi)
+        ok2, second = check(180. - chi, phi + 180.)
+        use_second = ok2 & ~ok1
+        chi = np.where(use_second, second['chi'], first['chi'])
+        phi = np.where(use_second, second['phi'], first['phi'])
+        reachable = ok1 | ok2
+
+    return {
+        'omega': omega,
+        'chi': np.where(valid, chi, np.nan),
+        'phi': np.where(valid, phi, np.nan),
+        'tth': tth,
+        'reachable': reachable,
+    }